@@ -0,0 +1,888 @@
+import os
+import io
+import gc
+import sys
+import json
+import time
+import gzip
+import importlib.util
+import uuid
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from contextlib import redirect_stdout
+from functools import partial
+
+# Start of the HTML payloads, one per shape of <html> start tag found in the wild.
+HEADER_SHAPES = {
+    'simple': '<!DOCTYPE html>\n<html lang="{lang}" dir="{dir}">',
+    'xhtml': '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" '
+             '"http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">\n'
+             '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="{lang}" lang="{lang}">',
+    'unquoted': '<!doctype html><HTML class=no-js LANG={lang} data-theme=dark DIR={dir}>',
+    'late': '<!DOCTYPE html>\n<!-- ' + 'generated by a template engine ' * 24 + '-->\n<html lang="{lang}">',
+    'missing': '<!DOCTYPE html>\n<head><meta charset="utf-8">',
+}
+CHARSETS = ['utf-8', 'iso-8859-1', 'utf-16']
+LANGUAGES = ['en', 'en-US', 'es-CL', 'es_ES', 'pt-BR', 'fr', 'de', 'zh-CN', 'ar', 'en, es']
+DIRS = ['ltr', 'rtl', 'auto']
+DOMAINS = ['com', 'cl', 'org', 'net', 'es', 'de', 'io']
+
+# Share of the responses that are not HTML (skipped by the metadata extractor).
+NON_HTML_RATIO = 0.1
+
+# Crawl layout served by the local HTTP stand-in.
+CRAWL_PREFIX = 'crawl-data/CC-BENCH/segments/0000000000000.00/'
+
+def _warc_record(headers: list, block: bytes) -> bytes:
+    head = 'WARC/1.0\r\n' + ''.join(f'{name}: {value}\r\n' for name, value in headers) + f'Content-Length: {len(block)}\r\n\r\n'
+    # Every record is its own gzip member, as in CommonCrawl files.
+    return gzip.compress(head.encode('utf-8') + block + b'\r\n\r\n', compresslevel=6, mtime=0)
+
+def _record_id(rng: random.Random) -> str:
+    return f'<urn:uuid:{uuid.UUID(int=rng.getrandbits(128), version=4)}>'
+
+def make_payload(rng: random.Random, index: int, shape='simple', charset='utf-8', body_size=4096) -> bytes:
+    """
+    Builds the HTML payload of a synthetic response.
+
+    Parameters:
+    - rng (random.Random): Random generator (fixtures are reproducible from its seed).
+    - index (int): Number of the record, used in its text.
+    - shape (str): Shape of the <html> start tag (see HEADER_SHAPES).
+    - charset (str): Encoding of the payload.
+    - body_size (int): Approximate size of the body in characters.
+
+    Returns:
+    bytes: The encoded payload.
+    """
+    head = HEADER_SHAPES[shape].format(lang=rng.choice(LANGUAGES), dir=rng.choice(DIRS))
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'canción', 'niño', 'über', 'données']
+    text = ' '.join(rng.choice(words) for _ in range(body_size // 6))
+    html = f'{head}<head><title>Page {index}</title></head><body><p>{text}</p></body></html>'
+    return html.encode(charset, errors='replace')
+
+def make_fixture(warc_file: str, wet_file: str, num_records=1000, shapes=None, charsets=None, body_size=4096, seed=0) -> list:
+    """
+    Writes a synthetic gzipped WARC file (request and response records) and its WET sibling
+    (one conversion record per HTML response).
+
+    Parameters:
+    - warc_file (str): Path of the .warc.gz file.
+    - wet_file (str): Path of the .warc.wet.gz file.
+    - num_records (int): Number of responses (default is 1000).
+    - shapes (list): Shapes of the <html> start tags, picked at random (default is every HEADER_SHAPES).
+    - charsets (list): Charsets of the payloads, picked at random (default is CHARSETS).
+    - body_size (int): Approximate size of every body in characters (default is 4096).
+    - seed (int): Seed of the random generator (default is 0).
+
+    Returns:
+    list: Record IDs of the HTML responses.
+    """
+    rng = random.Random(seed)
+    shapes = shapes or list(HEADER_SHAPES)
+    charsets = charsets or CHARSETS
+
+    ids = []
+    with open(warc_file, 'wb') as warc, open(wet_file, 'wb') as wet:
+        for i in range(num_records):
+            uri = f'https://site{rng.randrange(10000)}.example.{rng.choice(DOMAINS)}/page/{i}'
+            warc.write(_warc_record([('WARC-Type', 'request'), ('WARC-Record-ID', _record_id(rng)), ('WARC-Target-URI', uri),
+                                     ('Content-Type', 'application/http; msgtype=request')],
+                                    f'GET /page/{i} HTTP/1.1\r\nHost: example\r\n\r\n'.encode()))
+
+            record_id = _record_id(rng)
+            if rng.random() < NON_HTML_RATIO:
+                http = b'HTTP/1.1 200 OK\r\nContent-Type: image/png\r\n\r\n' + rng.randbytes(512)
+                html = False
+            else:
+                charset = rng.choice(charsets)
+                language = f'Content-Language: {rng.choice(LANGUAGES)}\r\n' if rng.random() < 0.5 else ''
+                http = (f'HTTP/1.1 200 OK\r\nContent-Type: text/html; charset={charset}\r\n{language}\r\n').encode() + \
+                       make_payload(rng, i, rng.choice(shapes), charset, body_size)
+                html = True
+
+            warc.write(_warc_record([('WARC-Type', 'response'), ('WARC-Record-ID', record_id), ('WARC-Target-URI', uri),
+                                     ('Content-Type', 'application/http; msgtype=response')], http))
+
+            if html:
+                ids.append(record_id)
+                text = f'Page {i}\n' + ' '.join(rng.choice(['hola', 'mundo', 'texto', 'página']) for _ in range(body_size // 8))
+                wet.write(_warc_record([('WARC-Type', 'conversion'), ('WARC-Record-ID', _record_id(rng)), ('WARC-Target-URI', uri),
+                                        ('WARC-Refers-To', record_id), ('WARC-Identified-Content-Language', 'spa'),
+                                        ('Content-Type', 'text/plain')], text.encode('utf-8')))
+
+    return ids
+
+class Fixtures:
+    """
+    Synthetic crawl used by the benchmarks: 'num_files' WARC/WET pairs laid out as in CommonCrawl
+    (plus warc.paths and wet.paths files), and a local HTTP server serving them.
+
+    Parameters:
+    - folder (str): Folder where the fixtures are written.
+    - num_files (int): Number of WARC/WET pairs.
+    - num_records (int): Number of responses per WARC file.
+    - body_size (int): Approximate size of every body in characters.
+    - seed (int): Seed of the first file (the others use the next ones).
+    """
+    def __init__(self, folder: str, num_files=2, num_records=1000, body_size=4096, seed=0):
+        self.folder = folder
+        self.root = f'{folder}/srv'
+        self.names = [f'CC-BENCH-{i:05d}' for i in range(num_files)]
+        self.warc_paths = [f'{CRAWL_PREFIX}warc/{name}.warc.gz' for name in self.names]
+        self.wet_paths = [f'{CRAWL_PREFIX}wet/{name}.warc.wet.gz' for name in self.names]
+        self.ids = []
+
+        os.makedirs(f'{self.root}/{CRAWL_PREFIX}warc', exist_ok=True)
+        os.makedirs(f'{self.root}/{CRAWL_PREFIX}wet', exist_ok=True)
+        for i, (warc_path, wet_path) in enumerate(zip(self.warc_paths, self.wet_paths)):
+            self.ids.append(make_fixture(f'{self.root}/{warc_path}', f'{self.root}/{wet_path}',
+                                         num_records, body_size=body_size, seed=seed + i))
+
+        self.warc_paths_file = f'{folder}/warc.paths'
+        self.wet_paths_file = f'{folder}/wet.paths'
+        with open(self.warc_paths_file, 'w') as file: file.write('\n'.join(self.warc_paths) + '\n')
+        with open(self.wet_paths_file, 'w') as file: file.write('\n'.join(self.wet_paths) + '\n')
+
+        self.server = None
+        self.base_url = None
+        self.bytes_sent = 0
+
+    def warc_file(self, i=0) -> str:
+        return f'{self.root}/{self.warc_paths[i]}'
+
+    def wet_file(self, i=0) -> str:
+        return f'{self.root}/{self.wet_paths[i]}'
+
+    def serve(self) -> str:
+        """
+        Starts (once) a local HTTP server standing in for data.commoncrawl.org and points utils.BASE_URL to it.
+        """
+        import utils
+        from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+        if self.server is None:
+            fixtures = self
+
+            class QuietHandler(SimpleHTTPRequestHandler):
+                def do_GET(self):
+                    # Byte ranges are answered like data.commoncrawl.org does (206 with Content-Range).
+                    path = self.translate_path(self.path)
+                    ranges = self.headers.get('Range', '')
+                    if not ranges.startswith('bytes=') or not os.path.isfile(path): return super().do_GET()
+
+                    size = os.path.getsize(path)
+                    start, _, end = ranges.removeprefix('bytes=').partition('-')
+                    start, end = int(start), min(int(end) if end else size - 1, size - 1)
+                    if start >= size: return self.send_error(416)
+
+                    with open(path, 'rb') as file:
+                        file.seek(start)
+                        data = file.read(end - start + 1)
+
+                    self.send_response(206)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.copyfile(io.BytesIO(data), self.wfile)
+
+                def copyfile(self, source, outputfile):
+                    # Bytes are counted as they are sent, a client closing early stops the transfer.
+                    try:
+                        while True:
+                            data = source.read(1 << 16)
+                            if not data: break
+                            outputfile.write(data)
+                            fixtures.bytes_sent += len(data)
+                    except (BrokenPipeError, ConnectionResetError):
+                        pass
+
+                def log_message(self, *args): pass
+
+            self.server = ThreadingHTTPServer(('127.0.0.1', 0), partial(QuietHandler, directory=self.root))
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}/'
+
+        utils.BASE_URL = self.base_url
+        return self.base_url
+
+    def close(self):
+        if self.server is not None: self.server.shutdown()
+
+def measure(func, repeat=3):
+    """
+    Runs func 'repeat' times and returns the best time in seconds and the last result.
+    """
+    best, result = None, None
+    for _ in range(repeat):
+        gc.collect()
+        begin = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - begin
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best, result
+
+def _result(seconds: float, records=None, size=None, **extra) -> dict:
+    result = {'seconds': round(seconds, 6)}
+    if records is not None:
+        result['records'] = records
+        result['records_per_s'] = round(records / seconds, 1) if seconds > 0 else None
+    if size is not None:
+        result['mb'] = round(size / 2**20, 3)
+        result['mb_per_s'] = round(size / 2**20 / seconds, 2) if seconds > 0 else None
+
+    return {**result, **extra}
+
+# Benchmarks. Every function receives the fixtures and the number of repetitions, and returns its metrics.
+
+def bench_get_metadata(fx: Fixtures, repeat: int) -> dict:
+    from extract_metadata import get_metadata
+    seconds, records = measure(lambda: get_metadata(fx.warc_file()), repeat)
+    return _result(seconds, len(records), os.path.getsize(fx.warc_file()))
+
+def bench_get_text(fx: Fixtures, repeat: int) -> dict:
+    from extract_text import get_text
+    seconds, records = measure(lambda: get_text(fx.wet_file()), repeat)
+    return _result(seconds, len(records), os.path.getsize(fx.wet_file()))
+
+def _scan_fields(record, warc: str, names: list) -> tuple:
+    # Fields read as before the extraction plans: a scan of the headers per header field.
+    from utils import get_header, get_warc_header, extract_tags, get_domain_from_url
+    from fields import extract_head, field_source, WARC_HEADER, HTTP_HEADER, HTML_TAG, HEAD_ELEMENT, DOMAIN
+
+    content = record.reader.read(1024)
+    charset = record.http_charset or 'utf-8'
+    row = []
+    for name in names:
+        source, key, _ = field_source(name)
+        if source == WARC_HEADER:
+            row.append(get_warc_header(key, record.headers))
+        elif source == DOMAIN:
+            row.append(get_domain_from_url(get_warc_header(key, record.headers)).split('.')[-1])
+        elif source == HTTP_HEADER:
+            row.append(get_header(key, record.http_headers))
+        elif source == HTML_TAG:
+            row.append(extract_tags(content, [key], charset)[key])
+        elif source == HEAD_ELEMENT:
+            row.append(extract_head(content, [key], charset)[key])
+        else:
+            row.append(key)
+
+    return tuple(row)
+
+def bench_extraction_plan(fx: Fixtures, repeat: int) -> dict:
+    # Seconds to extract the default fields and every field of fields.FIELDS (plus two more headers) from the responses
+    # of a WARC file, read in a single pass by an extraction plan and with a scan per field: the cost per record
+    # should stay flat as fields are added.
+    from fastwarc.warc import ArchiveIterator, WarcRecordType
+    from fields import compile_plan, FIELDS, DEFAULT_FIELDS
+
+    wide = list(FIELDS) + ['warc:WARC-Identified-Payload-Type', 'http:X-Powered-By']
+
+    def extract(func):
+        rows = []
+        with open(fx.warc_file(), 'rb') as stream:
+            for record in ArchiveIterator(stream, record_types=WarcRecordType.response):
+                if (record.http_content_type or '').split(';')[0] in {'text/html', 'application/xhtml+xml'}:
+                    rows.append(func(record))
+        return rows
+
+    result = {}
+    for mode, func in [('default', partial(compile_plan(DEFAULT_FIELDS).extract, warc='file', window=1024)),
+                       ('wide', partial(compile_plan(wide).extract, warc='file', window=1024)),
+                       ('default_scans', lambda record: _scan_fields(record, 'file', DEFAULT_FIELDS)),
+                       ('wide_scans', lambda record: _scan_fields(record, 'file', wide))]:
+        seconds, records = measure(lambda: extract(func), repeat)
+        result[f'seconds_{mode}'] = round(seconds, 6)
+
+    result['fields_default'] = len(DEFAULT_FIELDS)
+    result['fields_wide'] = len(wide)
+    result['records'] = len(records)
+    return result
+
+def _payloads(fx: Fixtures) -> list:
+    from fastwarc.warc import ArchiveIterator, WarcRecordType
+
+    payloads = []
+    with open(fx.warc_file(), 'rb') as stream:
+        for record in ArchiveIterator(stream, record_types=WarcRecordType.response):
+            payloads.append((record.reader.read(1024), record.http_charset or 'utf-8', list(record.http_headers)))
+
+    return payloads
+
+def bench_extract_tags(fx: Fixtures, repeat: int) -> dict:
+    from utils import extract_tags
+    payloads = _payloads(fx)
+    seconds, _ = measure(lambda: [extract_tags(content, ['lang', 'dir'], charset) for content, charset, _ in payloads], repeat)
+    return _result(seconds, len(payloads), sum(len(content) for content, _, _ in payloads))
+
+def bench_get_header(fx: Fixtures, repeat: int) -> dict:
+    from utils import get_header
+    headers = [http_headers for _, _, http_headers in _payloads(fx)]
+    seconds, _ = measure(lambda: [get_header('Content-Language', h, exact_match=True) for h in headers], repeat)
+    return _result(seconds, len(headers))
+
+def bench_get_domain_from_url(fx: Fixtures, repeat: int) -> dict:
+    from utils import get_domain_from_url
+    from extract_metadata import get_metadata
+    urls = [record['WARC_Target_URI'] for record in get_metadata(fx.warc_file())]
+    seconds, _ = measure(lambda: [get_domain_from_url(url) for url in urls], repeat)
+    return _result(seconds, len(urls))
+
+def bench_decompress_gz(fx: Fixtures, repeat: int) -> dict:
+    from utils import decompress_gz
+    with tempfile.TemporaryDirectory() as folder:
+        seconds, output = measure(lambda: decompress_gz(fx.warc_file(), folder), repeat)
+        size = os.path.getsize(output)
+
+    return _result(seconds, size=size, compressed_mb=round(os.path.getsize(fx.warc_file()) / 2**20, 3))
+
+DECOMPRESS_THREADS = 4
+
+def _inflate_to(file_path: str, dest: str, num_threads: int, chunk_size: int) -> int:
+    from inflate import iter_inflate
+    with open(dest, 'wb') as output:
+        for data in iter_inflate(file_path, num_threads, chunk_size): output.write(data)
+
+    return os.path.getsize(dest)
+
+def bench_decompress_gz_parallel(fx: Fixtures, repeat: int) -> dict:
+    from inflate import inflate_backend, find_member_starts
+
+    # The fixtures are smaller than inflate.CHUNK_SIZE, so they are split in DECOMPRESS_THREADS chunks per thread.
+    file_path = fx.warc_file()
+    compressed = os.path.getsize(file_path)
+    chunk_size = max(1 << 16, compressed // (DECOMPRESS_THREADS * DECOMPRESS_THREADS))
+
+    def copy(dest):
+        # Previous implementation of decompress_gz.
+        with gzip.open(file_path, 'rb') as f_in, open(dest, 'wb') as f_out:
+            shutil.copyfileobj(f_in, f_out)
+        return os.path.getsize(dest)
+
+    with tempfile.TemporaryDirectory() as folder:
+        dest = f'{folder}/out.warc'
+        baseline, size = measure(lambda: copy(dest), repeat)
+        single, _ = measure(lambda: _inflate_to(file_path, dest, 1, chunk_size), repeat)
+        seconds, _ = measure(lambda: _inflate_to(file_path, dest, DECOMPRESS_THREADS, chunk_size), repeat)
+        with open(file_path, 'rb') as file:
+            chunks = len(find_member_starts(file.fileno(), compressed, chunk_size))
+
+    return _result(seconds, size=size, compressed_mb=round(compressed / 2**20, 3), backend=inflate_backend().__name__,
+                   threads=DECOMPRESS_THREADS, cpus=os.cpu_count(), chunks=chunks, gzip_seconds=round(baseline, 6),
+                   single_thread_seconds=round(single, 6), speedup=round(baseline / seconds, 2) if seconds > 0 else None)
+
+# Near-duplicate texts generated by bench_dedup: the words of another text with DUPLICATE_EDITS of them replaced.
+# The fixture WET texts repeat a few words, so they do not tell duplicates apart from different texts.
+DEDUP_TEXTS = 2000
+DEDUP_DUPLICATES = 200
+DUPLICATE_EDITS = 0.01
+
+def _dedup_texts(rng: random.Random, num_texts: int, num_duplicates: int) -> tuple:
+    # Random texts followed by a near-duplicate of num_duplicates of them, and the index of their originals.
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 10))) for _ in range(20000)]
+    texts = [' '.join(rng.choice(vocabulary) for _ in range(rng.randint(100, 600))) for _ in range(num_texts)]
+
+    originals = rng.sample(range(num_texts), num_duplicates)
+    for original in originals:
+        words = texts[original].split()
+        for i in rng.sample(range(len(words)), max(1, int(len(words) * DUPLICATE_EDITS))):
+            words[i] = rng.choice(vocabulary)
+        texts.append(' '.join(words))
+
+    return texts, originals
+
+def bench_minhash(fx: Fixtures, repeat: int) -> dict:
+    # Signatures of the texts of a WET file, as written by extract_text.py --minhash (see dedup.SignatureWriter).
+    from extract_text import iter_text_rows
+    from dedup import SignatureWriter
+
+    rows = list(iter_text_rows(fx.wet_file()))
+    with tempfile.TemporaryDirectory() as folder:
+        def sign():
+            with SignatureWriter(f'{folder}/signatures.npy') as writer:
+                for row in rows: writer.add(row[2], row[4])
+            return writer.rows
+
+        seconds, records = measure(sign, repeat)
+
+    return _result(seconds, records, sum(len(row[4].encode('utf-8')) for row in rows))
+
+def bench_dedup(fx: Fixtures, repeat: int) -> dict:
+    # Signatures and LSH index of generated texts, where every near-duplicate is in another signature file than
+    # its original: the seconds of both stages, and the recall (near-duplicates dropped) and precision (dropped
+    # records that are near-duplicates) of the masks.
+    import numpy as np
+    from dedup import SignatureWriter, find_duplicates
+
+    texts, _ = _dedup_texts(random.Random(0), DEDUP_TEXTS, DEDUP_DUPLICATES)
+    half = DEDUP_TEXTS // 2
+    with tempfile.TemporaryDirectory() as folder:
+        def sign():
+            for name, indexes in [('a', range(half)), ('b', range(half, len(texts)))]:
+                with SignatureWriter(f'{folder}/{name}.minhash.npy') as writer:
+                    for i in indexes: writer.add(f'<urn:uuid:{i}>', texts[i])
+
+        sign_seconds, _ = measure(sign, repeat)
+        index_seconds, (_, _, labels) = measure(lambda: find_duplicates([folder]), repeat)
+
+    # Near-duplicates come after their originals, so they are the records to drop.
+    dropped = set(np.flatnonzero(labels != np.arange(len(labels))).tolist())
+    duplicates = set(range(DEDUP_TEXTS, len(texts)))
+
+    return {
+        'seconds_minhash': round(sign_seconds, 6),
+        'seconds_index': round(index_seconds, 6),
+        'records': len(texts),
+        'records_per_s': round(len(texts) / (sign_seconds + index_seconds), 1),
+        'recall': round(len(dropped & duplicates) / len(duplicates), 4),
+        'precision': round(len(dropped & duplicates) / len(dropped), 4) if dropped else None,
+    }
+
+def _bench_save(fx: Fixtures, repeat: int, output_format: str) -> dict:
+    from extract_metadata import get_metadata, save_metadata
+    from sinks import EXTENSIONS
+    records = get_metadata(fx.warc_file())
+    with tempfile.TemporaryDirectory() as folder:
+        dest = f'{folder}/out{EXTENSIONS[output_format]}'
+        seconds, _ = measure(lambda: save_metadata(dest, records, output_format), repeat)
+        return _result(seconds, len(records), os.path.getsize(dest))
+
+def bench_save_metadata_csv(fx: Fixtures, repeat: int) -> dict:
+    return _bench_save(fx, repeat, 'csv')
+
+def bench_save_metadata_parquet(fx: Fixtures, repeat: int) -> dict:
+    if importlib.util.find_spec('pyarrow') is None:
+        return {'skipped': 'pyarrow is not installed'}
+
+    return _bench_save(fx, repeat, 'parquet')
+
+def _save_dataframes(dest: str, records, columns: list, batch_size: int) -> int:
+    # Former CSV sink: every batch of dictionaries becomes a DataFrame, appended to the file.
+    import pandas as pd
+    from utils import batched
+
+    count = 0
+    for i, batch in enumerate(batched(records, batch_size)):
+        pd.DataFrame(batch, columns=columns).to_csv(dest, index=False, mode='w' if i == 0 else 'a', header=i == 0)
+        count += len(batch)
+
+    return count
+
+def _retained(func) -> tuple:
+    # Bytes and memory blocks still allocated by the result of func, e.g. a batch of records.
+    import tracemalloc
+
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    gc.collect()
+    return size, sys.getallocatedblocks() - blocks, result
+
+def bench_record_buffers(fx: Fixtures, repeat: int) -> dict:
+    # Records as dictionaries saved through DataFrames (before) against rows saved column by column (after):
+    # memory held per record of a batch, and throughput of extracting and saving a WARC file as CSV.
+    from extract_metadata import iter_metadata, iter_metadata_rows, save_metadata, METADATA_COLUMNS, BATCH_SIZE
+
+    result = {}
+    with tempfile.TemporaryDirectory() as folder:
+        dest = f'{folder}/out.csv'
+        for mode, extract, save in [
+            ('dicts', iter_metadata, lambda records: _save_dataframes(dest, records, METADATA_COLUMNS, BATCH_SIZE)),
+            ('rows', iter_metadata_rows, lambda records: save_metadata(dest, records))
+        ]:
+            size, blocks, records = _retained(lambda: list(extract(fx.warc_file())))
+            result[f'bytes_per_record_{mode}'] = round(size / len(records), 1)
+            result[f'blocks_per_record_{mode}'] = round(blocks / len(records), 2)
+            del records
+
+            seconds, count = measure(lambda: save(extract(fx.warc_file())), repeat)
+            result[f'seconds_{mode}'] = round(seconds, 6)
+            result[f'records_per_s_{mode}'] = round(count / seconds, 1)
+
+    result['records'] = count
+    return result
+
+def _metadata_csv(fx: Fixtures, folder: str) -> str:
+    from extract_metadata import iter_metadata, save_metadata
+    dest = f'{folder}/{fx.names[0]}.csv'
+    if not os.path.exists(dest): save_metadata(dest, iter_metadata(fx.warc_file()))
+    return dest
+
+STRATUM_SIZE = 20
+
+def bench_stratified_sample(fx: Fixtures, repeat: int) -> dict:
+    # Seconds to sample STRATUM_SIZE records per HTML_Language over the metadata of every fixture file, in a single
+    # pass with bounded reservoirs (sample.py) and loading every file into a DataFrame first (as the notebooks do).
+    import pandas as pd
+    from extract_metadata import iter_metadata, save_metadata
+    from sample import sample_outputs
+
+    with tempfile.TemporaryDirectory() as folder:
+        for i, name in enumerate(fx.names):
+            save_metadata(f'{folder}/{name}.csv', iter_metadata(fx.warc_file(i)))
+
+        def load_all():
+            df = pd.concat([pd.read_csv(f'{folder}/{name}.csv', dtype=str) for name in fx.names], ignore_index=True)
+            return df.sample(frac=1, random_state=0).groupby('HTML_Language').head(STRATUM_SIZE)
+
+        seconds, (records, population) = measure(lambda: sample_outputs([folder], ['HTML_Language'], size=STRATUM_SIZE), repeat)
+        load_seconds, _ = measure(load_all, repeat)
+
+    return _result(seconds, sum(population.values()), strata=len(population), sampled=len(records),
+                   seconds_load_all=round(load_seconds, 6))
+
+def bench_warcchunk_load(fx: Fixtures, repeat: int) -> dict:
+    import warcapi
+    fx.serve()
+    warcapi.wet_dict = warcapi._get_paths(fx.wet_paths_file, use_cache=False)
+    with tempfile.TemporaryDirectory() as folder:
+        chunk = _metadata_csv(fx, folder)
+        seconds, loaded = measure(lambda: warcapi.WARCChunk(chunk, streaming=True), repeat)
+        return _result(seconds, len(loaded.wet_df), os.path.getsize(fx.wet_file()))
+
+def bench_warcchunk_store(fx: Fixtures, repeat: int) -> dict:
+    import warcapi
+    fx.serve()
+    warcapi.wet_dict = warcapi._get_paths(fx.wet_paths_file, use_cache=False)
+    with tempfile.TemporaryDirectory() as folder:
+        chunk = _metadata_csv(fx, folder)
+        build, _ = measure(lambda: warcapi.WARCChunk(chunk, streaming=True, store_dir=f'{folder}/store'), 1)
+        seconds, loaded = measure(lambda: warcapi.WARCChunk(chunk, store_dir=f'{folder}/store'), repeat)
+        return _result(seconds, len(loaded.store), build_seconds=round(build, 6))
+
+def bench_warcchunk_lookup(fx: Fixtures, repeat: int) -> dict:
+    import warcapi
+    fx.serve()
+    warcapi.wet_dict = warcapi._get_paths(fx.wet_paths_file, use_cache=False)
+    ids = fx.ids[0]
+    with tempfile.TemporaryDirectory() as folder:
+        chunk = _metadata_csv(fx, folder)
+        in_memory = warcapi.WARCChunk(chunk, streaming=True)
+        stored = warcapi.WARCChunk(chunk, streaming=True, store_dir=f'{folder}/store')
+
+        seconds, _ = measure(lambda: [in_memory.get_text(i) for i in ids], repeat)
+        store_seconds, _ = measure(lambda: [stored.get_text(i) for i in ids], repeat)
+        return _result(seconds, len(ids), store_seconds=round(store_seconds, 6),
+                       store_records_per_s=round(len(ids) / store_seconds, 1))
+
+def _bench_pipeline(fx: Fixtures, repeat: int, streaming: bool, num_workers=2, max_count=0, partial_fetch=False) -> dict:
+    import extract_metadata
+    fx.serve()
+
+    def run():
+        with tempfile.TemporaryDirectory() as dest, redirect_stdout(io.StringIO()):
+            extract_metadata.run_pipeline(fx.warc_paths_file, dest_path=dest, num_workers=num_workers, streaming=streaming,
+                                          max_count=max_count, partial_fetch=partial_fetch)
+            return sum(1 for file in os.listdir(dest) if file.endswith('.csv'))
+
+    seconds, files = measure(run, repeat)
+    size = sum(os.path.getsize(fx.warc_file(i)) for i in range(len(fx.names)))
+    return _result(seconds, size=size, files=files, files_per_s=round(files / seconds, 2))
+
+def bench_run_pipeline(fx: Fixtures, repeat: int) -> dict:
+    return _bench_pipeline(fx, repeat, streaming=False)
+
+def bench_run_pipeline_streaming(fx: Fixtures, repeat: int) -> dict:
+    return _bench_pipeline(fx, repeat, streaming=True)
+
+# Responses per file read by the sampling benchmarks (--num_responses).
+SAMPLE_RESPONSES = 50
+
+def _fetched_bytes(max_count: int, partial_fetch: bool, fx: Fixtures) -> int:
+    # Bytes sent by the server for a single file (a plain GET keeps sending until the connection is closed).
+    from extract_metadata import iter_metadata
+
+    fx.bytes_sent = 0
+    for _ in iter_metadata(fx.warc_paths[0], max_count=max_count, streaming=True, partial_fetch=partial_fetch): pass
+    time.sleep(0.1)
+    return fx.bytes_sent
+
+def bench_run_pipeline_sample(fx: Fixtures, repeat: int) -> dict:
+    fx.serve()
+    result = _bench_pipeline(fx, repeat, streaming=True, max_count=SAMPLE_RESPONSES)
+    result['fetched_bytes_per_file'] = _fetched_bytes(SAMPLE_RESPONSES, False, fx)
+    return result
+
+def bench_run_pipeline_partial(fx: Fixtures, repeat: int) -> dict:
+    fx.serve()
+    result = _bench_pipeline(fx, repeat, streaming=True, max_count=SAMPLE_RESPONSES, partial_fetch=True)
+    result['fetched_bytes_per_file'] = _fetched_bytes(SAMPLE_RESPONSES, True, fx)
+    return result
+
+# A node of the distributed benchmark: a process running the metadata pipeline with the shared coordinator.
+_NODE_SCRIPT = '''
+import sys, io
+from contextlib import redirect_stdout
+sys.path.insert(0, {repo!r})
+import utils, extract_metadata
+from coordinator import SQLiteCoordinator
+utils.BASE_URL = {base_url!r}
+with redirect_stdout(io.StringIO()):
+    extract_metadata.run_pipeline({paths!r}, dest_path={dest!r}, streaming=True, coordinator=SQLiteCoordinator({db!r}))
+'''
+
+# Number of nodes of the distributed benchmark, compared with a single node.
+NUM_NODES = 2
+
+def bench_run_pipeline_distributed(fx: Fixtures, repeat: int) -> dict:
+    import sqlite3
+    from coordinator import SQLiteCoordinator
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    base_url = fx.serve()
+    result = {}
+    for nodes in (1, NUM_NODES):
+        def run():
+            with tempfile.TemporaryDirectory() as dest:
+                db = f'{dest}/coordinator.sqlite'
+                script = _NODE_SCRIPT.format(repo=repo, base_url=base_url, paths=fx.warc_paths_file, dest=dest, db=db)
+                processes = [subprocess.Popen([sys.executable, '-c', script]) for _ in range(nodes)]
+                for process in processes:
+                    if process.wait() != 0: raise RuntimeError(f'A node exited with status {process.returncode}')
+
+                conn = sqlite3.connect(db)
+                try:
+                    claims = conn.execute('SELECT SUM(attempts) FROM leases').fetchone()[0]
+                    busiest = conn.execute('SELECT MAX(paths) FROM (SELECT COUNT(*) AS paths FROM leases GROUP BY owner)').fetchone()[0]
+                finally:
+                    conn.close()
+                files = sum(1 for file in os.listdir(dest) if file.endswith('.csv'))
+                return SQLiteCoordinator(db).status(), claims, files, busiest
+
+        seconds, (status, claims, files, busiest) = measure(run, repeat)
+        result[f'seconds_{nodes}_nodes'] = round(seconds, 6)
+        result[f'files_per_s_{nodes}_nodes'] = round(files / seconds, 2)
+        # Paths done by the busiest node: nodes only claim paths for their free workers, so they share the work.
+        result[f'max_files_per_node_{nodes}_nodes'] = busiest
+
+    # Every path must be done exactly once, even when several nodes claim at the same time.
+    result['files'] = files
+    result['lost_files'] = len(fx.names) - status['done']
+    result['duplicate_claims'] = claims - status['done']
+    return result
+
+# Peak memory of extracting and saving a WARC file, measured in a fresh process for every mode.
+_MEMORY_SCRIPT = '''
+import sys, resource, tracemalloc
+sys.path.insert(0, {repo!r})
+from extract_metadata import get_metadata, iter_metadata, save_metadata
+import fastwarc.warc  # imported on first use, not part of the extraction
+tracemalloc.start()
+records = {records}
+save_metadata({dest!r}, records)
+print(tracemalloc.get_traced_memory()[1], resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+# Responses of the file saved by bench_memory, several times the batch of save_metadata (a smaller file would
+# fit in a single batch, and the list and the generator would hold the same records).
+MEMORY_BATCHES = 4
+
+def bench_memory(fx: Fixtures, repeat: int) -> dict:
+    # Memory allocated while saving a WARC file from a list and from a generator: the peak traced by tracemalloc
+    # (only what the extraction allocates, which grows with the file for a list and stays at one batch for a
+    # generator), and the peak RSS of the process (mostly the interpreter and the imported modules).
+    from extract_metadata import BATCH_SIZE
+
+    repo = os.path.dirname(os.path.abspath(__file__))
+    result = {}
+    with tempfile.TemporaryDirectory() as folder:
+        memory_fx = Fixtures(folder, num_files=1, num_records=MEMORY_BATCHES * BATCH_SIZE, body_size=256)
+        for mode, records in [('list', f'get_metadata({memory_fx.warc_file()!r})'), ('generator', f'iter_metadata({memory_fx.warc_file()!r})')]:
+            script = _MEMORY_SCRIPT.format(repo=repo, records=records, dest=f'{folder}/out.csv')
+            runs = [subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout.split()
+                    for _ in range(repeat)]
+            result[f'traced_peak_mb_{mode}'] = round(min(int(traced) for traced, _ in runs) / 2**20, 2)
+            # ru_maxrss is in KiB on Linux and in bytes on macOS.
+            result[f'peak_rss_mb_{mode}'] = round(min(int(rss) for _, rss in runs) / (2**20 if sys.platform == 'darwin' else 2**10), 2)
+
+    result['responses'] = MEMORY_BATCHES * BATCH_SIZE
+    return result
+
+# Modules whose import time is measured (the CLI entry points and the public API).
+IMPORT_MODULES = ['extract_metadata', 'extract_text', 'extract_joint', 'warcapi', 'stats']
+
+def bench_import_time(fx: Fixtures, repeat: int) -> dict:
+    repo = os.path.dirname(os.path.abspath(__file__))
+    result = {}
+    for module in IMPORT_MODULES:
+        best = None
+        for _ in range(repeat):
+            process = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                                     cwd=repo, capture_output=True, text=True, check=True)
+            # Last line of -X importtime: 'import time: self | cumulative | module' of the module itself.
+            cumulative = int(process.stderr.strip().splitlines()[-1].split('|')[1])
+            best = cumulative if best is None else min(best, cumulative)
+        result[f'{module}_seconds'] = best / 1e6
+
+    return result
+
+BENCHMARKS = {
+    'get_metadata': bench_get_metadata,
+    'get_text': bench_get_text,
+    'extraction_plan': bench_extraction_plan,
+    'extract_tags': bench_extract_tags,
+    'get_header': bench_get_header,
+    'get_domain_from_url': bench_get_domain_from_url,
+    'decompress_gz': bench_decompress_gz,
+    'decompress_gz_parallel': bench_decompress_gz_parallel,
+    'minhash': bench_minhash,
+    'dedup': bench_dedup,
+    'save_metadata_csv': bench_save_metadata_csv,
+    'save_metadata_parquet': bench_save_metadata_parquet,
+    'record_buffers': bench_record_buffers,
+    'stratified_sample': bench_stratified_sample,
+    'warcchunk_load': bench_warcchunk_load,
+    'warcchunk_store': bench_warcchunk_store,
+    'warcchunk_lookup': bench_warcchunk_lookup,
+    'run_pipeline': bench_run_pipeline,
+    'run_pipeline_streaming': bench_run_pipeline_streaming,
+    'run_pipeline_sample': bench_run_pipeline_sample,
+    'run_pipeline_partial': bench_run_pipeline_partial,
+    'run_pipeline_distributed': bench_run_pipeline_distributed,
+    'memory': bench_memory,
+    'import_time': bench_import_time,
+}
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def run_benchmarks(names=None, num_files=2, num_records=1000, body_size=4096, repeat=3, seed=0, fixtures_dir=None) -> dict:
+    """
+    Generates the fixtures and runs the benchmarks.
+
+    Parameters:
+    - names (list): Benchmarks to run (default is None, that means every one in BENCHMARKS).
+    - num_files (int): Number of WARC/WET pairs of the synthetic crawl (default is 2).
+    - num_records (int): Number of responses per WARC file (default is 1000).
+    - body_size (int): Approximate size of every body in characters (default is 4096).
+    - repeat (int): Number of repetitions, the best one is kept (default is 3).
+    - seed (int): Seed of the fixtures (default is 0).
+    - fixtures_dir (str): Folder where the fixtures are written (default is None, that means a temporary folder).
+
+    Returns:
+    dict: Environment, parameters and the metrics of every benchmark.
+    """
+    folder = fixtures_dir or tempfile.mkdtemp(prefix='cc-bench-')
+    fx = Fixtures(folder, num_files, num_records, body_size, seed)
+
+    report = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'parameters': {'num_files': num_files, 'num_records': num_records, 'body_size': body_size, 'repeat': repeat, 'seed': seed},
+        'results': {}
+    }
+
+    try:
+        for name in names or BENCHMARKS:
+            try:
+                report['results'][name] = BENCHMARKS[name](fx, repeat)
+            except Exception as e:
+                report['results'][name] = {'error': f'{type(e).__name__}: {e}'}
+            print(f'{name}: {json.dumps(report["results"][name])}', file=sys.stderr)
+    finally:
+        fx.close()
+        if fixtures_dir is None: shutil.rmtree(folder, ignore_errors=True)
+
+    return report
+
+# Metrics where a higher value is a regression. Throughputs are derived from them.
+LOWER_IS_BETTER = ('seconds', 'traced_peak_mb', 'peak_rss_mb', 'bytes_per_record', 'blocks_per_record')
+
+def compare(report: dict, baseline: dict, threshold=0.1) -> list:
+    """
+    Compares a report with a baseline report. A benchmark that failed, or a metric of the baseline that the
+    report lacks (or that is not a number any more), is a regression too. Benchmarks that were not run are skipped.
+
+    Parameters:
+    - report (dict): Report returned by run_benchmarks.
+    - baseline (dict): Report of a previous run (e.g. of the main branch).
+    - threshold (float): Relative increase considered a regression (default is 0.1, that means 10%).
+
+    Returns:
+    list: Tuples of (benchmark, metric, baseline value, new value, ratio) for every regressed metric. The ratio
+    is None for failed benchmarks (metric 'error') and missing metrics.
+    """
+    def compared(metric: str) -> bool:
+        return any(key in metric for key in LOWER_IS_BETTER) and not metric.startswith('build')
+
+    regressions = []
+    for name, metrics in report['results'].items():
+        old_metrics = baseline.get('results', {}).get(name, {})
+        if 'error' in metrics:
+            regressions.append((name, 'error', old_metrics.get('error'), metrics['error'], None))
+            continue
+
+        for metric, old in old_metrics.items():
+            if compared(metric) and isinstance(old, (int, float)) and not isinstance(metrics.get(metric), (int, float)):
+                regressions.append((name, metric, old, metrics.get(metric), None))
+
+        for metric, value in metrics.items():
+            old = old_metrics.get(metric)
+            if not compared(metric): continue
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or old <= 0: continue
+
+            ratio = value / old
+            if ratio > 1 + threshold:
+                regressions.append((name, metric, old, value, round(ratio, 3)))
+
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the extractors over a synthetic crawl.')
+
+    parser.add_argument('--only', help=f'Benchmarks to run (default is all of them: {" ".join(BENCHMARKS)}).', nargs='+', choices=list(BENCHMARKS), required=False)
+    parser.add_argument('--num_files', help='Number of WARC/WET pairs of the synthetic crawl (default is 2).', required=False)
+    parser.add_argument('--num_records', help='Number of responses per WARC file (default is 1000).', required=False)
+    parser.add_argument('--body_size', help='Approximate size of every HTML body in characters (default is 4096).', required=False)
+    parser.add_argument('--repeat', help='Number of repetitions of every benchmark, the best one is kept (default is 3).', required=False)
+    parser.add_argument('--seed', help='Seed of the synthetic crawl (default is 0).', required=False)
+    parser.add_argument('--fixtures_dir', help='Folder to write (and keep) the fixtures (default is a temporary folder).', required=False)
+    parser.add_argument('--output', help='JSON file to save the results (default is stdout).', required=False)
+    parser.add_argument('--compare', help='JSON results of a previous run. Exits with status 1 if any metric regressed.', required=False)
+    parser.add_argument('--threshold', help='Relative slowdown reported as a regression by --compare (default is 0.1).', required=False)
+
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.only,
+                            num_files=int(args.num_files) if args.num_files != None else 2,
+                            num_records=int(args.num_records) if args.num_records != None else 1000,
+                            body_size=int(args.body_size) if args.body_size != None else 4096,
+                            repeat=int(args.repeat) if args.repeat != None else 3,
+                            seed=int(args.seed) if args.seed != None else 0,
+                            fixtures_dir=args.fixtures_dir)
+
+    if args.output:
+        with open(args.output, 'w') as file: json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            baseline = json.load(file)
+
+        if baseline.get('parameters') != report['parameters']:
+            print(f'Warning: the baseline was run with other parameters ({baseline.get("parameters")}).', file=sys.stderr)
+
+        regressions = compare(report, baseline, float(args.threshold) if args.threshold != None else 0.1)
+        for name, metric, old, new, ratio in regressions:
+            print(f'Regression in {name}.{metric}: {old} -> {new}' + (f' (x{ratio})' if ratio is not None else ''), file=sys.stderr)
+
+        if regressions: sys.exit(1)
@@ -0,0 +1,347 @@
+import os
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+from manifest import file_checksum
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: entries are still written atomically, but two processes may download the same path at once.
+    fcntl = None
+
+# Environment variables used to configure the cache of processes that do not call configure_cache (e.g. notebooks).
+CACHE_DIR_ENV = 'CC_CACHE_DIR'
+CACHE_SIZE_ENV = 'CC_CACHE_SIZE'
+
+# Default size budget in GiB.
+DEFAULT_SIZE = 100
+
+def cache_key(cc_path: str) -> str:
+    """
+    Returns the key of a CommonCrawl path in the cache (the SHA-1 of the path).
+    """
+    return hashlib.sha1(cc_path.strip().encode('utf-8')).hexdigest()
+
+def link_or_copy(source: str, dest: str):
+    """
+    Makes dest a hard link to source (a copy if the link fails, e.g. on another file system).
+    dest appears atomically and removing it never affects source.
+    """
+    part = f'{dest}.part'
+    if os.path.exists(part): os.remove(part)
+    try:
+        os.link(source, part)
+    except OSError:
+        shutil.copyfile(source, part)
+    os.replace(part, dest)
+
+class DownloadCache:
+    """
+    Local cache of downloaded CommonCrawl files shared by every process of a machine (metadata, text and
+    WARCChunk), so running several passes over the same segment downloads it only once.
+
+    Files are stored by the hash of their CommonCrawl path, and an SQLite index keeps their size, checksum
+    (computed once, when they are added) and last access. When the cache grows over its budget, the least recently used files are evicted.
+    A file is downloaded under a per-path file lock, so concurrent processes asking for the same path
+    wait for a single download instead of repeating it.
+
+    Parameters:
+    - cache_dir (str): Folder of the cache.
+    - max_size (float): Size budget in GiB (default is DEFAULT_SIZE).
+    - verify (bool): Check the SHA-1 of a file every time it is used, not only its size (default is False).
+      It reads the whole file once more per use, so it is only worth it on unreliable disks.
+    """
+    def __init__(self, cache_dir: str, max_size=DEFAULT_SIZE, verify=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size * 2**30)
+        self.verify = verify
+        self.db_path = f'{cache_dir}/cache.sqlite'
+
+        os.makedirs(f'{cache_dir}/files', exist_ok=True)
+        os.makedirs(f'{cache_dir}/locks', exist_ok=True)
+
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    checksum TEXT NOT NULL,
+                    last_access REAL NOT NULL
+                )
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def file_path(self, cc_path: str) -> str:
+        """
+        Returns where the file of a CommonCrawl path is stored (whether it is cached or not).
+        """
+        key = cache_key(cc_path)
+        return f'{self.cache_dir}/files/{key[:2]}/{key}-{cc_path.strip().split("/")[-1]}'
+
+    @contextmanager
+    def _lock(self, key: str, blocking=True):
+        if fcntl is None:
+            yield True
+            return
+
+        with open(f'{self.cache_dir}/locks/{key}.lock', 'a') as file:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+
+            try:
+                yield True
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def _valid(self, entry) -> bool:
+        path, size, checksum = entry
+        if not os.path.exists(path) or os.path.getsize(path) != size: return False
+        return not self.verify or file_checksum(path) == checksum
+
+    def _lookup(self, key: str):
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT path, size, checksum FROM entries WHERE key = ?', (key,)).fetchone()
+        finally:
+            conn.close()
+
+    def _touch(self, key: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+        finally:
+            conn.close()
+
+    def _forget(self, key: str, path: str):
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+        finally:
+            conn.close()
+
+        if os.path.exists(path): os.remove(path)
+
+    def get(self, cc_path: str) -> str:
+        """
+        Returns the cached file of a CommonCrawl path, or None if it is not cached (or is corrupted,
+        in which case it is removed).
+        """
+        key = cache_key(cc_path)
+        with self._lock(key):
+            entry = self._lookup(key)
+            if entry is None: return None
+
+            if not self._valid(entry):
+                self._forget(key, entry[0])
+                return None
+
+            self._touch(key)
+            return entry[0]
+
+    def put(self, cc_path: str, source: str) -> str:
+        """
+        Moves a complete file into the cache as the file of a CommonCrawl path (the caller must hold its lock).
+
+        Returns:
+        str: Path of the cached file.
+        """
+        key = cache_key(cc_path)
+        path = self.file_path(cc_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        size = os.path.getsize(source)
+        checksum = file_checksum(source)
+        os.replace(source, path)
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute('INSERT INTO entries (key, path, size, checksum, last_access) VALUES (?, ?, ?, ?, ?) '
+                             'ON CONFLICT(key) DO UPDATE SET path=excluded.path, size=excluded.size, '
+                             'checksum=excluded.checksum, last_access=excluded.last_access',
+                             (key, path, size, checksum, time.time()))
+        finally:
+            conn.close()
+
+        self.evict(keep=key)
+        return path
+
+    def fetch(self, cc_path: str, download) -> str:
+        """
+        Returns the cached file of a CommonCrawl path, downloading it first if it is not cached.
+        Concurrent calls for the same path (from any process) wait for a single download.
+
+        Parameters:
+        - cc_path (str): CommonCrawl path (without base URL).
+        - download (callable): Called with a temporary file path to download the file into.
+
+        Returns:
+        str: Path of the cached file.
+        """
+        key = cache_key(cc_path)
+        with self._lock(key):
+            entry = self._lookup(key)
+            if entry is not None:
+                if self._valid(entry):
+                    self._touch(key)
+                    return entry[0]
+                self._forget(key, entry[0])
+
+            tmp = f'{self.file_path(cc_path)}.{os.getpid()}.{threading.get_ident()}.tmp'
+            os.makedirs(os.path.dirname(tmp), exist_ok=True)
+            try:
+                download(tmp)
+                return self.put(cc_path, tmp)
+            finally:
+                if os.path.exists(tmp): os.remove(tmp)
+
+    def size(self) -> int:
+        """
+        Returns the number of bytes stored in the cache.
+        """
+        conn = self._connect()
+        try:
+            return conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        finally:
+            conn.close()
+
+    def evict(self, keep=None) -> int:
+        """
+        Removes the least recently used files until the cache fits its budget. Files being downloaded or
+        checked by another process are skipped, and files already opened keep working until closed.
+
+        Parameters:
+        - keep (str): Key that must not be evicted (e.g. the file just added).
+
+        Returns:
+        int: Number of bytes freed.
+        """
+        excess = self.size() - self.max_bytes
+        if excess <= 0: return 0
+
+        conn = self._connect()
+        try:
+            entries = conn.execute('SELECT key, path, size FROM entries ORDER BY last_access').fetchall()
+        finally:
+            conn.close()
+
+        freed = 0
+        for key, path, size in entries:
+            if freed >= excess: break
+            if key == keep: continue
+
+            with self._lock(key, blocking=False) as locked:
+                if not locked: continue
+                self._forget(key, path)
+                freed += size
+
+        return freed
+
+class CachingReader:
+    """
+    File-like wrapper over a stream (e.g. a streamed HTTP body) that copies every byte read into a temporary
+    file. If the stream is read to the end, the copy is added to the cache when the reader is closed.
+
+    Parameters:
+    - cache (DownloadCache): Cache to fill.
+    - cc_path (str): CommonCrawl path of the stream.
+    - stream: Object with read(size) and tell() methods; if it has a 'total' attribute (expected size),
+      the copy is only kept if it has exactly that size.
+    """
+    def __init__(self, cache: DownloadCache, cc_path: str, stream):
+        self.cache = cache
+        self.cc_path = cc_path
+        self.stream = stream
+        self.complete = False
+
+        self.tmp = f'{cache.file_path(cc_path)}.{os.getpid()}.{threading.get_ident()}.tmp'
+        os.makedirs(os.path.dirname(self.tmp), exist_ok=True)
+        self._file = open(self.tmp, 'wb')
+
+    def read(self, size=-1) -> bytes:
+        data = self.stream.read(size)
+        if data:
+            self._file.write(data)
+        elif size != 0:
+            self.complete = True
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self) -> int:
+        return self.stream.tell()
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def close(self):
+        if self._file.closed: return
+
+        written = self._file.tell()
+        self._file.close()
+        total = getattr(self.stream, 'total', None)
+        try:
+            if self.complete and (total is None or written == total):
+                with self.cache._lock(cache_key(self.cc_path)):
+                    self.cache.put(self.cc_path, self.tmp)
+        finally:
+            if os.path.exists(self.tmp): os.remove(self.tmp)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_cache = None
+_cache_configured = False
+_cache_lock = threading.Lock()
+
+def get_cache() -> DownloadCache:
+    """
+    Returns the download cache of the process, or None if there is no cache. Unless configure_cache was
+    called, it is configured from the CC_CACHE_DIR and CC_CACHE_SIZE (GiB) environment variables.
+    """
+    global _cache, _cache_configured
+    with _cache_lock:
+        if not _cache_configured:
+            cache_dir = os.environ.get(CACHE_DIR_ENV)
+            if cache_dir:
+                _cache = DownloadCache(cache_dir, float(os.environ.get(CACHE_SIZE_ENV, DEFAULT_SIZE)))
+            _cache_configured = True
+
+        return _cache
+
+def configure_cache(cache_dir: str, max_size=DEFAULT_SIZE, verify=False) -> DownloadCache:
+    """
+    Sets the download cache of the process (see DownloadCache), or disables it if cache_dir is None.
+    """
+    global _cache, _cache_configured
+    with _cache_lock:
+        _cache = DownloadCache(cache_dir, max_size, verify) if cache_dir is not None else None
+        _cache_configured = True
+
+        return _cache
@@ -0,0 +1,489 @@
+import os
+import time
+import random
+import threading
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+import metrics
+
+# Status codes worth retrying (data.commoncrawl.org answers 503 when throttling).
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+# Errors raised by requests when a connection is refused, reset or dropped mid-transfer.
+RETRY_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+# Same errors, as raised by urllib3 when the raw body is read directly.
+RAW_RETRY_ERRORS = RETRY_ERRORS + (urllib3.exceptions.HTTPError, ConnectionError)
+
+# Size of the first Range request of a RangeReader, doubled on every request up to MAX_RANGE_SIZE.
+RANGE_SIZE = 1 << 18
+MAX_RANGE_SIZE = 1 << 25
+
+class HTTPClient:
+    """
+    Thread-safe HTTP client shared by every download of a process. Connections are pooled and reused
+    (one session per thread), the number of simultaneous requests is bounded, failed requests are retried
+    with exponential backoff and jitter, and interrupted transfers are resumed with HTTP Range requests.
+
+    Parameters:
+    - max_connections (int): Max number of simultaneous requests (default is 16).
+    - max_retries (int): Max number of retries per request or interruption (default is 5).
+    - backoff (float): Base delay in seconds, doubled on every retry (default is 1).
+    - max_backoff (float): Max delay in seconds between retries (default is 60).
+    - timeout (tuple): Connect and read timeouts in seconds (default is (10, 60)).
+    - chunk_size (int): Number of bytes written to disk at a time (default is 1 MiB).
+    """
+    def __init__(self, max_connections=16, max_retries=5, backoff=1.0, max_backoff=60.0, timeout=(10, 60), chunk_size=1 << 20):
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+
+        return session
+
+    def _record(self, size=0, seconds=0.0, retries=0, requests_count=0):
+        worker = threading.current_thread().name
+        with self._lock:
+            stats = self._metrics.setdefault(worker, {'bytes': 0, 'seconds': 0.0, 'requests': 0, 'retries': 0})
+            stats['bytes'] += size
+            stats['seconds'] += seconds
+            stats['retries'] += retries
+            stats['requests'] += requests_count
+
+    def _wait(self, attempt: int, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after is not None and retry_after.isdigit():
+            delay = min(self.max_backoff, float(retry_after))
+        else:
+            # Full jitter: a random delay up to the exponential bound, so workers do not retry in lockstep.
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+        self._record(retries=1)
+        time.sleep(delay)
+
+    def get(self, url: str, start=0, stream=True, end=None) -> requests.Response:
+        """
+        Sends a GET request (retrying on throttling, server errors and connection errors).
+
+        Parameters:
+        - url (str): URL to request.
+        - start (int): First byte to request, sent as a Range header if greater than 0 (default is 0).
+        - stream (bool): Whether the body is read lazily (default is True).
+        - end (int): Last byte to request (inclusive), default is None, that means up to the end.
+
+        Returns:
+        requests.Response: The last response received (its status may still be an error).
+        """
+        with self._slots:
+            return self._get(url, start, stream, end)
+
+    def _get(self, url: str, start=0, stream=True, end=None) -> requests.Response:
+        if end is not None:
+            headers = {'Range': f'bytes={start}-{end}'}
+        else:
+            headers = {'Range': f'bytes={start}-'} if start > 0 else {}
+
+        attempt = 0
+        while True:
+            try:
+                response = self._session().get(url, headers=headers, stream=stream, timeout=self.timeout)
+                self._record(requests_count=1)
+            except RETRY_ERRORS:
+                if attempt >= self.max_retries: raise
+                self._wait(attempt)
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUS and attempt < self.max_retries:
+                response.close()
+                self._wait(attempt, response)
+                attempt += 1
+                continue
+
+            return response
+
+    def download(self, url: str, dest_file: str) -> int:
+        """
+        Downloads a URL into a file, streaming it in chunks. If the connection drops, the transfer
+        continues from the last written byte with a Range request. The data is written to a '.part'
+        file that is renamed to dest_file once complete. A connection slot is held for the whole transfer.
+
+        Parameters:
+        - url (str): URL to download.
+        - dest_file (str): Path of the downloaded file.
+
+        Returns:
+        int: Number of bytes downloaded.
+        """
+        part = f'{dest_file}.part'
+        written = 0
+        total = None
+        interruptions = 0
+        begin = time.time()
+
+        with self._slots, open(part, 'wb') as file:
+            while True:
+                response = self._get(url, start=written)
+                try:
+                    if written > 0 and response.status_code == 200:
+                        # The server ignored the Range header, start over.
+                        file.seek(0)
+                        file.truncate()
+                        written = 0
+                    elif response.status_code not in {200, 206}:
+                        raise requests.HTTPError(f'Status code: {response.status_code}', response=response)
+
+                    if total is None and response.headers.get('Content-Length') is not None:
+                        total = written + int(response.headers['Content-Length'])
+
+                    # Raw bytes: CommonCrawl files are gzip at the file level, they must not be decoded.
+                    for chunk in response.raw.stream(self.chunk_size, decode_content=False):
+                        file.write(chunk)
+                        written += len(chunk)
+                except RAW_RETRY_ERRORS:
+                    if interruptions >= self.max_retries: raise
+                    self._wait(interruptions)
+                    interruptions += 1
+                    continue
+                finally:
+                    response.close()
+
+                if total is not None and written < total:
+                    # The body ended early without an error, resume the missing bytes.
+                    if interruptions >= self.max_retries:
+                        raise IOError(f'Incomplete download: expected {total} bytes, got {written}')
+                    interruptions += 1
+                    continue
+
+                break
+
+        os.replace(part, dest_file)
+        self._record(size=written, seconds=time.time() - begin)
+
+        return written
+
+    def read_range(self, url: str, start: int, end: int) -> bytes:
+        """
+        Reads a byte range of a URL (both ends included), retrying if the connection drops.
+
+        Returns:
+        bytes: The requested bytes (fewer if the range goes past the end of the body).
+        """
+        interruptions = 0
+        while True:
+            # The slot is held until the body is read, like in download.
+            with self._slots:
+                response = self._get(url, start=start, end=end)
+                try:
+                    if response.status_code == 200:
+                        raise IOError(f'{url} does not support Range requests.')
+                    if response.status_code != 206:
+                        raise requests.HTTPError(f'Status code: {response.status_code}', response=response)
+
+                    data = response.raw.read(decode_content=False)
+                except RAW_RETRY_ERRORS:
+                    if interruptions >= self.max_retries: raise
+                    self._wait(interruptions)
+                    interruptions += 1
+                    continue
+                finally:
+                    response.close()
+
+            self._record(size=len(data))
+            return data
+
+    def open(self, url: str):
+        """
+        Opens a URL as a file-like object whose read() transparently resumes (with a Range request)
+        when the connection drops, so a long streaming parse survives transient network errors.
+        A connection slot is held until the reader is closed.
+
+        Parameters:
+        - url (str): URL to open.
+
+        Returns:
+        ResumableReader: Object with read(size) and close() methods.
+        """
+        return ResumableReader(self, url)
+
+    def open_range(self, url: str, initial_size=RANGE_SIZE, max_size=MAX_RANGE_SIZE):
+        """
+        Opens a URL as a file-like object that fetches the body in Range requests of growing size,
+        for readers that usually stop early (e.g. the first records of a file).
+
+        Parameters:
+        - url (str): URL to open.
+        - initial_size (int): Size of the first request in bytes (default is RANGE_SIZE).
+        - max_size (int): Max size of a request in bytes (default is MAX_RANGE_SIZE).
+
+        Returns:
+        RangeReader: Object with read(size) and close() methods.
+        """
+        return RangeReader(self, url, initial_size, max_size)
+
+    def metrics(self) -> dict:
+        """
+        Returns the download metrics of every worker thread: bytes, seconds, requests, retries and
+        throughput in bytes per second.
+        """
+        with self._lock:
+            metrics = {worker: dict(stats) for worker, stats in self._metrics.items()}
+
+        for stats in metrics.values():
+            stats['throughput'] = stats['bytes'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+
+        return metrics
+
+class ResumableReader:
+    """
+    File-like view over an HTTP body that reopens the connection from the current position on errors.
+    The body is read raw (no HTTP content decoding), since CommonCrawl files are gzip at the file level.
+    A connection slot of the client is held from the first request until the reader is closed, so the
+    body being streamed counts towards max_connections. Requests and reads are timed as the 'download'
+    stage (see metrics.py), so waiting on the network is not taken for the stage reading the body.
+    """
+    def __init__(self, client: HTTPClient, url: str):
+        self.client = client
+        self.url = url
+        self.position = 0
+        self.total = None
+        self.status_code = None
+        self._begin = time.time()
+        self._response = None
+        self._slot = False
+
+        client._slots.acquire()
+        self._slot = True
+        try:
+            with metrics.stage('download'):
+                self._open()
+        except BaseException:
+            self._release()
+            raise
+
+    def _release(self):
+        if self._slot:
+            self._slot = False
+            self.client._slots.release()
+
+    def _open(self):
+        response = self.client._get(self.url, start=self.position)
+        self.status_code = response.status_code
+
+        if self.position > 0 and response.status_code == 200:
+            response.close()
+            raise IOError(f'{self.url} does not support Range requests, the stream cannot be resumed.')
+        if response.status_code not in {200, 206}:
+            response.close()
+            raise requests.HTTPError(f'Status code: {response.status_code}', response=response)
+
+        if self.total is None and response.headers.get('Content-Length') is not None:
+            self.total = self.position + int(response.headers['Content-Length'])
+
+        response.raw.decode_content = False
+        self._response = response
+
+    def read(self, size=-1) -> bytes:
+        with metrics.stage('download'):
+            interruptions = 0
+            while True:
+                try:
+                    data = self._response.raw.read(None if size is None or size < 0 else size)
+                    self.position += len(data)
+                    return data
+                except RAW_RETRY_ERRORS:
+                    if interruptions >= self.client.max_retries: raise
+
+                    self._response.close()
+                    self.client._wait(interruptions)
+                    interruptions += 1
+                    self._open()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self) -> int:
+        return self.position
+
+    @property
+    def closed(self) -> bool:
+        return self._response is None
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+            self.client._record(size=self.position, seconds=time.time() - self._begin)
+        self._release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class RangeReader:
+    """
+    File-like view over an HTTP body fetched in consecutive Range requests: initial_size bytes first,
+    then twice as many every time, up to max_size. Every request is read completely before it is used,
+    so a reader closed after the first records of a file has fetched at most one request more than it
+    needed, instead of the whole file. If the server ignores Range requests, the body is read as a stream.
+    A connection slot of the client is held while a request is read, and while the body is streamed.
+    Requests and streamed reads are timed as the 'download' stage (see metrics.py).
+    """
+    def __init__(self, client: HTTPClient, url: str, initial_size=RANGE_SIZE, max_size=MAX_RANGE_SIZE):
+        self.client = client
+        self.url = url
+        self.position = 0
+        self.fetched = 0
+        self.total = None
+        self.requests = 0
+        self.max_size = max_size
+        self._size = initial_size
+        self._buffer = memoryview(b'')
+        self._response = None
+        self._slot = False
+        self._closed = False
+        self._begin = time.time()
+        self._buffer = memoryview(self._fetch())
+
+    def _fetch(self) -> bytes:
+        with metrics.stage('download'):
+            return self._fetch_range()
+
+    def _fetch_range(self) -> bytes:
+        start = self.fetched
+        if self.total is not None and start >= self.total: return b''
+
+        interruptions = 0
+        while True:
+            self.client._slots.acquire()
+            response = None
+            try:
+                response = self.client._get(self.url, start=start, end=start + self._size - 1)
+                self.requests += 1
+                if response.status_code == 416: return b''
+
+                if response.status_code == 200:
+                    if start > 0:
+                        raise IOError(f'{self.url} stopped answering Range requests.')
+                    # Range requests are not supported, the body is read as a stream from now on (keeping the slot).
+                    response.raw.decode_content = False
+                    self._response, response = response, None
+                    self._slot = True
+                    return b''
+                if response.status_code != 206:
+                    raise requests.HTTPError(f'Status code: {response.status_code}', response=response)
+
+                content_range = response.headers.get('Content-Range', '')
+                if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+                    self.total = int(content_range.rsplit('/', 1)[1])
+
+                data = response.raw.read(decode_content=False)
+            except RAW_RETRY_ERRORS:
+                if interruptions >= self.client.max_retries: raise
+                self.client._wait(interruptions)
+                interruptions += 1
+                continue
+            finally:
+                if response is not None: response.close()
+                if not self._slot: self.client._slots.release()
+
+            self.fetched += len(data)
+            self._size = min(self._size * 2, self.max_size)
+            return data
+
+    def read(self, size=-1) -> bytes:
+        if self._closed: raise ValueError('I/O operation on closed reader.')
+
+        if not self._buffer and self._response is None:
+            self._buffer = memoryview(self._fetch())
+
+        if self._response is not None and not self._buffer:
+            with metrics.stage('download'):
+                data = self._response.raw.read(None if size is None or size < 0 else size)
+            self.position += len(data)
+            self.fetched += len(data)
+            return data
+
+        if size is None or size < 0: size = len(self._buffer)
+        data = self._buffer[:size].tobytes()
+        self._buffer = self._buffer[size:]
+        self.position += len(data)
+        return data
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self) -> int:
+        return self.position
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self):
+        if self._closed: return
+
+        self._closed = True
+        self._buffer = memoryview(b'')
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+        if self._slot:
+            self._slot = False
+            self.client._slots.release()
+        self.client._record(size=self.fetched, seconds=time.time() - self._begin)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client() -> HTTPClient:
+    """
+    Returns the HTTP client shared by the whole process, creating it on first use.
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = HTTPClient()
+
+        return _client
+
+def configure_client(**kwargs) -> HTTPClient:
+    """
+    Replaces the shared HTTP client with a new one (see HTTPClient for the accepted parameters).
+    """
+    global _client
+    with _client_lock:
+        _client = HTTPClient(**kwargs)
+
+        return _client
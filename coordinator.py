@@ -0,0 +1,585 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Seconds a claimed path stays leased to a node without being renewed. Nodes renew their leases every
+# lease_seconds / 3, so a path is only claimed again once the node holding it stopped (or lost the coordinator).
+DEFAULT_LEASE = 300
+
+# Number of times a path is claimed before it is given up as failed (errors and expired leases both count).
+MAX_ATTEMPTS = 3
+
+# Seconds between two checks of the coordinator while other nodes finish their paths: the first check is
+# quick (the job is often about to end) and the interval doubles up to POLL_INTERVAL.
+MIN_POLL_INTERVAL = 0.05
+POLL_INTERVAL = 2
+
+# States of a path in a coordinator.
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+
+def node_id() -> str:
+    """
+    Returns a name for this process, unique across nodes ('<host>:<pid>:<random>').
+    """
+    import uuid
+    import socket
+
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+def shard_of(path: str, num_shards: int) -> int:
+    """
+    Returns the shard of a path: a stable hash of the path modulo num_shards, the same on every node and run.
+    """
+    digest = hashlib.blake2b(path.strip().encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % num_shards
+
+def shard_paths(paths, shard_id: int, num_shards: int):
+    """
+    Keeps the paths of one shard (see shard_of). Running shards 0 to num_shards - 1 on different nodes
+    processes every path exactly once, without any coordination, as long as every shard is run.
+
+    Parameters:
+    - paths: Iterable of paths (e.g. lines from warc.paths).
+    - shard_id (int): Shard of this node, from 0 to num_shards - 1.
+    - num_shards (int): Number of shards (usually the number of nodes).
+
+    Returns:
+    generator: The paths of the shard, in order.
+    """
+    for path in paths:
+        if shard_of(path, num_shards) == shard_id:
+            yield path
+
+class Coordinator:
+    """
+    Base class of the coordinators, which hand out the paths of a job to the nodes processing it. A node
+    claims paths and holds a lease on them until it reports them done or failed. Leases expire if they are
+    not renewed, so the paths of a node that died are claimed again by another one.
+
+    Every method is safe to call from several nodes at once.
+    """
+    def add(self, paths) -> int:
+        """
+        Adds paths to the job (paths already added, by this node or another one, are ignored).
+
+        Returns:
+        int: Number of new paths.
+        """
+        raise NotImplementedError
+
+    def claim(self, owner: str, count=1) -> list:
+        """
+        Leases up to 'count' paths to a node: pending paths in order, or paths whose lease expired.
+
+        Returns:
+        list: The paths claimed (empty if there is nothing to claim right now).
+        """
+        raise NotImplementedError
+
+    def renew(self, owner: str, paths) -> list:
+        """
+        Extends the leases of a node.
+
+        Returns:
+        list: The paths whose lease the node no longer holds (e.g. it expired and was claimed by another node).
+        """
+        raise NotImplementedError
+
+    def complete(self, owner: str, path: str):
+        """
+        Records that a path was processed (even if its lease was lost meanwhile, its output is complete).
+        """
+        raise NotImplementedError
+
+    def fail(self, owner: str, path: str, error: str):
+        """
+        Records that a path failed. It is pending again, unless it was already claimed max_attempts times.
+        Nothing is done if the node does not hold its lease anymore.
+        """
+        raise NotImplementedError
+
+    def release(self, owner: str, paths):
+        """
+        Gives up the leases of a node without counting an attempt (e.g. when it is interrupted),
+        so other nodes can claim the paths right away.
+        """
+        raise NotImplementedError
+
+    def status(self) -> dict:
+        """
+        Returns the number of paths of the job in every state (PENDING, LEASED, DONE, FAILED), the number
+        of leases already expired ('expired') and the number of paths ('total').
+        """
+        raise NotImplementedError
+
+class SQLiteCoordinator(Coordinator):
+    """
+    Coordinator stored in a SQLite database, for nodes sharing a file system with working file locks
+    (processes of one machine, or NFS with locking enabled). Leases use the clock of every node, which
+    must be roughly in sync.
+
+    Parameters:
+    - db_path (str): SQLite file of the coordinator (several jobs can share it).
+    - job (str): Name of the job (default is 'default').
+    - lease_seconds (float): Duration of a lease (default is DEFAULT_LEASE).
+    - max_attempts (int): Number of claims before a path is given up (default is MAX_ATTEMPTS).
+    """
+    def __init__(self, db_path: str, job='default', lease_seconds=DEFAULT_LEASE, max_attempts=MAX_ATTEMPTS):
+        self.db_path = db_path
+        self.job = job
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    job TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    owner TEXT,
+                    expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    updated REAL,
+                    PRIMARY KEY (job, path)
+                )
+            """)
+            conn.execute('CREATE INDEX IF NOT EXISTS leases_state ON leases (job, state, position)')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE.
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def _transaction(self, func):
+        conn = self._connect()
+        try:
+            # IMMEDIATE takes the write lock up front, so two nodes never read the same pending paths.
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+            return result
+        finally:
+            conn.close()
+
+    def add(self, paths) -> int:
+        def add(conn):
+            start = conn.execute('SELECT COALESCE(MAX(position) + 1, 0) FROM leases WHERE job = ?', (self.job,)).fetchone()[0]
+            before = conn.total_changes
+            conn.executemany('INSERT OR IGNORE INTO leases (job, path, position, state, updated) VALUES (?, ?, ?, ?, ?)',
+                             ((self.job, path, start + i, PENDING, time.time())
+                              for i, path in enumerate(path.strip() for path in paths if path.strip())))
+            return conn.total_changes - before
+
+        return self._transaction(add)
+
+    def claim(self, owner: str, count=1) -> list:
+        def claim(conn):
+            now = time.time()
+            # Paths whose node died on every attempt are given up instead of killing more nodes.
+            conn.execute('UPDATE leases SET state = ?, owner = NULL, expires = NULL, error = ?, updated = ? '
+                         'WHERE job = ? AND state = ? AND expires < ? AND attempts >= ?',
+                         (FAILED, 'lease expired', now, self.job, LEASED, now, self.max_attempts))
+
+            paths = [row[0] for row in conn.execute(
+                'SELECT path FROM leases WHERE job = ? AND (state = ? OR (state = ? AND expires < ?)) '
+                'ORDER BY state = ?, position LIMIT ?',
+                (self.job, PENDING, LEASED, now, PENDING, count)
+            )]
+            conn.executemany('UPDATE leases SET state = ?, owner = ?, expires = ?, attempts = attempts + 1, updated = ? '
+                             'WHERE job = ? AND path = ?',
+                             ((LEASED, owner, now + self.lease_seconds, now, self.job, path) for path in paths))
+            return paths
+
+        return self._transaction(claim)
+
+    def renew(self, owner: str, paths) -> list:
+        def renew(conn):
+            now = time.time()
+            lost = []
+            for path in paths:
+                cursor = conn.execute('UPDATE leases SET expires = ?, updated = ? WHERE job = ? AND path = ? AND owner = ? AND state = ?',
+                                      (now + self.lease_seconds, now, self.job, path, owner, LEASED))
+                if cursor.rowcount == 0: lost.append(path)
+            return lost
+
+        return self._transaction(renew)
+
+    def complete(self, owner: str, path: str):
+        self._transaction(lambda conn: conn.execute(
+            'UPDATE leases SET state = ?, owner = ?, expires = NULL, error = NULL, updated = ? WHERE job = ? AND path = ?',
+            (DONE, owner, time.time(), self.job, path.strip())
+        ))
+
+    def fail(self, owner: str, path: str, error: str):
+        self._transaction(lambda conn: conn.execute(
+            'UPDATE leases SET state = CASE WHEN attempts >= ? THEN ? ELSE ? END, owner = NULL, expires = NULL, error = ?, updated = ? '
+            'WHERE job = ? AND path = ? AND owner = ? AND state = ?',
+            (self.max_attempts, FAILED, PENDING, str(error), time.time(), self.job, path.strip(), owner, LEASED)
+        ))
+
+    def release(self, owner: str, paths):
+        self._transaction(lambda conn: conn.executemany(
+            'UPDATE leases SET state = ?, owner = NULL, expires = NULL, attempts = attempts - 1, updated = ? '
+            'WHERE job = ? AND path = ? AND owner = ? AND state = ?',
+            ((PENDING, time.time(), self.job, path, owner, LEASED) for path in paths)
+        ))
+
+    def status(self) -> dict:
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute('SELECT state, COUNT(*) FROM leases WHERE job = ? GROUP BY state', (self.job,)).fetchall())
+            expired = conn.execute('SELECT COUNT(*) FROM leases WHERE job = ? AND state = ? AND expires < ?',
+                                   (self.job, LEASED, time.time())).fetchone()[0]
+        finally:
+            conn.close()
+
+        status = {state: counts.get(state, 0) for state in (PENDING, LEASED, DONE, FAILED)}
+        return {**status, 'expired': expired, 'total': sum(status.values())}
+
+class RedisCoordinator(Coordinator):
+    """
+    Coordinator stored in a Redis-compatible server (Redis, Valkey, KeyDB, ...), for nodes on different machines.
+    Only plain commands and WATCH/MULTI transactions are used (no scripts), so any server or in-process
+    stand-in implementing them works. Leases use the clock of the server. Requires the redis package.
+
+    Keys of a job ('<prefix>:<job>:...'): 'paths' (set of every path), 'pending' (list, in order), 'leases'
+    (sorted set of leased paths by expiry), 'owners' and 'attempts' (hashes by path), 'done' (set) and
+    'failed' (hash of errors by path).
+
+    Parameters:
+    - client: A redis.Redis client (or compatible object, e.g. fakeredis.FakeRedis).
+    - job (str): Name of the job (default is 'default').
+    - lease_seconds (float): Duration of a lease (default is DEFAULT_LEASE).
+    - max_attempts (int): Number of claims before a path is given up (default is MAX_ATTEMPTS).
+    - prefix (str): Prefix of the keys (default is 'ccpipeline').
+    """
+    def __init__(self, client, job='default', lease_seconds=DEFAULT_LEASE, max_attempts=MAX_ATTEMPTS, prefix='ccpipeline'):
+        try:
+            from redis.exceptions import WatchError
+        except ImportError:
+            raise ImportError('redis is required to use a Redis coordinator (pip install redis).')
+
+        self._watch_error = WatchError
+        self.client = client
+        self.job = job
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+        keys = f'{prefix}:{job}'
+        self._paths, self._pending, self._leases = f'{keys}:paths', f'{keys}:pending', f'{keys}:leases'
+        self._owners, self._attempts = f'{keys}:owners', f'{keys}:attempts'
+        self._done, self._failed = f'{keys}:done', f'{keys}:failed'
+
+    def _now(self) -> float:
+        seconds, microseconds = self.client.time()
+        return seconds + microseconds / 1e6
+
+    def _transaction(self, keys: list, func):
+        # func reads with the pipeline in immediate mode, then queues its writes after pipe.multi().
+        # If a watched key changed meanwhile, nothing is written and func runs again.
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(*keys)
+                    result = func(pipe)
+                    pipe.execute()
+                    return result
+                except self._watch_error:
+                    continue
+
+    def add(self, paths) -> int:
+        paths = list(dict.fromkeys(path.strip() for path in paths if path.strip()))
+        if not paths: return 0
+
+        # SADD tells which paths are new, so two nodes adding the same file push every path once.
+        with self.client.pipeline() as pipe:
+            for path in paths:
+                pipe.sadd(self._paths, path)
+            new = [path for path, added in zip(paths, pipe.execute()) if added]
+
+        for i in range(0, len(new), 10000):
+            self.client.rpush(self._pending, *new[i:i + 10000])
+        return len(new)
+
+    def claim(self, owner: str, count=1) -> list:
+        def claim(pipe):
+            now = self._now()
+            expired = [_text(path) for path in pipe.zrangebyscore(self._leases, '-inf', now, start=0, num=count)]
+            pending = [_text(path) for path in pipe.lrange(self._pending, 0, count - len(expired) - 1)] if len(expired) < count else []
+            attempts = [int(n or 0) for n in pipe.hmget(self._attempts, expired)] if expired else []
+
+            pipe.multi()
+            if pending: pipe.ltrim(self._pending, len(pending), -1)
+
+            claimed = []
+            for path, n in zip(expired + pending, attempts + [0] * len(pending)):
+                if n >= self.max_attempts:
+                    pipe.zrem(self._leases, path)
+                    pipe.hdel(self._owners, path)
+                    pipe.hset(self._failed, path, 'lease expired')
+                    continue
+
+                pipe.zadd(self._leases, {path: now + self.lease_seconds})
+                pipe.hset(self._owners, path, owner)
+                pipe.hincrby(self._attempts, path, 1)
+                claimed.append(path)
+
+            return claimed
+
+        return self._transaction([self._pending, self._leases], claim)
+
+    def renew(self, owner: str, paths) -> list:
+        paths = list(paths)
+        if not paths: return []
+
+        def renew(pipe):
+            owners = [_text(value) for value in pipe.hmget(self._owners, paths)]
+            expires = self._now() + self.lease_seconds
+
+            pipe.multi()
+            held = [path for path, holder in zip(paths, owners) if holder == owner]
+            for path in held:
+                pipe.zadd(self._leases, {path: expires}, xx=True)
+            return [path for path in paths if path not in held]
+
+        return self._transaction([self._owners], renew)
+
+    def complete(self, owner: str, path: str):
+        path = path.strip()
+        with self.client.pipeline() as pipe:
+            pipe.zrem(self._leases, path)
+            pipe.hdel(self._owners, path)
+            pipe.hdel(self._failed, path)
+            pipe.sadd(self._done, path)
+            pipe.execute()
+
+    def fail(self, owner: str, path: str, error: str):
+        path = path.strip()
+
+        def fail(pipe):
+            if _text(pipe.hget(self._owners, path)) != owner: return
+            attempts = int(pipe.hget(self._attempts, path) or 0)
+
+            pipe.multi()
+            pipe.zrem(self._leases, path)
+            pipe.hdel(self._owners, path)
+            if attempts >= self.max_attempts:
+                pipe.hset(self._failed, path, str(error))
+            else:
+                pipe.rpush(self._pending, path)
+
+        self._transaction([self._owners], fail)
+
+    def release(self, owner: str, paths):
+        for path in paths:
+            def release(pipe):
+                if _text(pipe.hget(self._owners, path)) != owner: return
+
+                pipe.multi()
+                pipe.zrem(self._leases, path)
+                pipe.hdel(self._owners, path)
+                pipe.hincrby(self._attempts, path, -1)
+                pipe.lpush(self._pending, path)
+
+            self._transaction([self._owners], release)
+
+    def status(self) -> dict:
+        now = self._now()
+        with self.client.pipeline(transaction=False) as pipe:
+            pipe.llen(self._pending)
+            pipe.zcard(self._leases)
+            pipe.scard(self._done)
+            pipe.hlen(self._failed)
+            pipe.zcount(self._leases, '-inf', now)
+            pipe.scard(self._paths)
+            pending, leased, done, failed, expired, total = pipe.execute()
+
+        return {PENDING: pending, LEASED: leased, DONE: done, FAILED: failed, 'expired': expired, 'total': total}
+
+def _text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def open_coordinator(url: str, job='default', lease_seconds=DEFAULT_LEASE, max_attempts=MAX_ATTEMPTS) -> Coordinator:
+    """
+    Opens a coordinator from its location: a 'redis://', 'rediss://' or 'unix://' URL for a RedisCoordinator,
+    or the path of a SQLite file (optionally prefixed with 'sqlite://') for a SQLiteCoordinator.
+
+    Parameters:
+    - url (str): Location of the coordinator.
+    - job (str): Name of the job, nodes working on the same job must use the same one (default is 'default').
+    - lease_seconds (float): Duration of a lease (default is DEFAULT_LEASE).
+    - max_attempts (int): Number of claims before a path is given up (default is MAX_ATTEMPTS).
+
+    Returns:
+    Coordinator: The coordinator of the job.
+    """
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError('redis is required to use a Redis coordinator (pip install redis).')
+
+        return RedisCoordinator(redis.Redis.from_url(url), job, lease_seconds, max_attempts)
+
+    return SQLiteCoordinator(url.removeprefix('sqlite://'), job, lease_seconds, max_attempts)
+
+class PathQueue:
+    """
+    Paths processed by this node in a pipeline run: every path of the paths file, the paths of one shard
+    (see shard_paths), or the paths leased from a coordinator. With a coordinator, the leases held by the
+    node are renewed by a background thread until the node reports them done (or stops, releasing them).
+
+    Paths are handed out in rounds (see rounds): a round ends when there is nothing left to claim, and a new
+    one starts if a path becomes claimable again (e.g. the lease of a node that died expires).
+
+    Parameters:
+    - paths_file (str): warc.paths (or wet.paths) file.
+    - coordinator (Coordinator): Coordinator of the job (default is None, that means no coordination).
+    - shard (tuple): (shard_id, num_shards) to process only one shard of the paths (default is None, that means every path).
+    - owner (str): Name of the node in the coordinator (default is node_id()).
+    """
+    def __init__(self, paths_file: str, coordinator=None, shard=None, owner=None):
+        self.paths_file = paths_file
+        self.coordinator = coordinator
+        self.shard = shard
+        self.owner = owner or node_id()
+        self.held = set()
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+        if coordinator is not None:
+            with open(paths_file, 'r') as file:
+                coordinator.add(file)
+            self.total = coordinator.status()['total']
+
+            self._heartbeat = threading.Thread(target=self._renew, daemon=True)
+            self._heartbeat.start()
+        else:
+            with open(paths_file, 'r') as file:
+                paths = (line for line in file if line.strip())
+                self.total = sum(1 for _ in (shard_paths(paths, *shard) if shard is not None else paths))
+
+    def _renew(self):
+        while not self._stop.wait(self.coordinator.lease_seconds / 3):
+            with self._lock:
+                held = list(self.held)
+            try:
+                lost = self.coordinator.renew(self.owner, held)
+            except Exception as e:
+                print(f'[Coordinator] Leases could not be renewed: {e}')
+                continue
+
+            for path in lost:
+                print(f'[Coordinator] Lease lost, {path} may be processed by another node')
+
+    def _claims(self):
+        while not self._stop.is_set():
+            claimed = self.coordinator.claim(self.owner)
+            if not claimed: return
+
+            with self._lock:
+                self.held.update(claimed)
+            yield from claimed
+
+    def _lines(self):
+        with open(self.paths_file, 'r') as file:
+            paths = (line for line in file if line.strip())
+            yield from shard_paths(paths, *self.shard) if self.shard is not None else paths
+
+    def wait(self) -> bool:
+        """
+        Waits until a path can be claimed, or until every path is done or failed.
+
+        Returns:
+        bool: Whether there are paths to claim.
+        """
+        interval = MIN_POLL_INTERVAL
+        while not self._stop.is_set():
+            status = self.coordinator.status()
+            if status[PENDING] or status['expired']: return True
+            if not status[LEASED]: return False
+            self._stop.wait(min(interval, self.coordinator.lease_seconds / 2))
+            interval = min(interval * 2, POLL_INTERVAL)
+
+        return False
+
+    def prefetch(self, prefetch: int) -> int:
+        """
+        Returns the number of paths the scheduler may fetch ahead of the workers. With a coordinator every path
+        taken by the scheduler is a lease, so none are: the node only claims paths for its free workers, and
+        the other paths are left to the nodes that are idle.
+        """
+        return prefetch if self.coordinator is None else 0
+
+    def rounds(self):
+        """
+        Returns:
+        generator: Iterables of paths, each one to be run through the scheduler (consumed lazily).
+        """
+        if self.coordinator is None:
+            yield self._lines()
+            return
+
+        while True:
+            yield self._claims()
+            if not self.wait(): return
+
+    def remaining(self) -> int:
+        """
+        Returns the number of paths of the job not done yet by any node (pending, leased or failed), or None
+        without a coordinator, since this node does not know about the other shards.
+        """
+        if self.coordinator is None: return None
+
+        status = self.coordinator.status()
+        return status['total'] - status[DONE]
+
+    def done(self, path: str, error=None):
+        """
+        Reports a path as processed, or as failed if error is given.
+        """
+        if self.coordinator is None: return
+
+        path = path.strip()
+        with self._lock:
+            self.held.discard(path)
+
+        if error is None:
+            self.coordinator.complete(self.owner, path)
+        else:
+            self.coordinator.fail(self.owner, path, str(error))
+
+    def close(self):
+        """
+        Stops renewing leases and releases the paths claimed but not reported (e.g. after an interruption).
+        """
+        self._stop.set()
+        if self._heartbeat is not None: self._heartbeat.join()
+
+        if self.coordinator is not None and self.held:
+            self.coordinator.release(self.owner, list(self.held))
+            self.held.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
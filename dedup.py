@@ -0,0 +1,403 @@
+import os
+import csv
+import json
+import argparse
+import numpy as np
+from functools import lru_cache
+import metrics
+
+# Number of hash functions of a signature (its length).
+NUM_PERM = 128
+
+# Number of consecutive words of a shingle.
+SHINGLE_SIZE = 5
+
+# Signatures are split in NUM_BANDS bands of NUM_PERM // NUM_BANDS values. Records sharing a band are candidates,
+# and candidates agreeing on at least THRESHOLD of their signature (their estimated Jaccard similarity) are duplicates.
+NUM_BANDS = 16
+THRESHOLD = 0.8
+
+# Seed of the hash coefficients: every process must draw the same ones, so signatures of different files compare.
+SEED = 20240229
+
+# Shingles hashed at a time (a NUM_PERM x BLOCK_SIZE matrix).
+BLOCK_SIZE = 1 << 13
+
+# Texts buffered by a SignatureWriter before computing their signatures.
+BATCH_SIZE = 1000
+
+# Files written next to the content outputs ('<name>.minhash.npy') and by find_duplicates ('<name>.dedup.csv').
+SIGNATURE_SUFFIX = '.minhash.npy'
+MASK_SUFFIX = '.dedup.csv'
+
+# Record IDs of CommonCrawl ('<urn:uuid:...>') take 47 bytes.
+ID_SIZE = 64
+
+MAX_HASH = np.uint32(0xFFFFFFFF)
+
+# Bytes splitting words: ASCII whitespace (texts are hashed as UTF-8, so other bytes never split a character).
+_space = np.zeros(256, dtype=bool)
+_space[[9, 10, 11, 12, 13, 32]] = True
+
+def signature_dtype(num_perm=NUM_PERM) -> np.dtype:
+    """
+    Returns the dtype of the entries of a signature file: the record ID and its signature.
+    """
+    return np.dtype([('id', f'S{ID_SIZE}'), ('signature', '<u4', (num_perm,))])
+
+@lru_cache(maxsize=None)
+def _coefficients(num_perm: int, shingle_size: int) -> tuple:
+    # Odd multipliers (they permute 64-bit integers) for the bytes of a word by position, the words of a shingle
+    # and the hash functions, plus the offsets of the hash functions.
+    rng = np.random.default_rng(SEED)
+    def odd(size):
+        return rng.integers(0, 1 << 63, size=size, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+    return odd(64), odd(shingle_size), odd(num_perm), rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+
+def _mix(hashes: np.ndarray) -> np.ndarray:
+    # Finalizer of splitmix64, spreads every input bit over the whole hash.
+    hashes = hashes ^ (hashes >> np.uint64(30))
+    hashes *= np.uint64(0xBF58476D1CE4E5B9)
+    hashes ^= hashes >> np.uint64(27)
+    hashes *= np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+def shingle_hashes(texts: list, shingle_size=SHINGLE_SIZE) -> tuple:
+    """
+    Hashes the shingles (shingle_size consecutive words, lowercased) of a batch of texts at once: the texts are
+    joined and every step runs over the bytes or words of the whole batch, without a Python loop per word.
+    A text shorter than shingle_size words is a single shingle, and an empty text has none.
+
+    Parameters:
+    - texts (list): Texts to be hashed.
+    - shingle_size (int): Number of words of a shingle (default is SHINGLE_SIZE).
+
+    Returns:
+    tuple: 64-bit hashes of the shingles of every text, in order, and the index where the shingles of every
+    text start (len(texts) + 1 values, the last one being the number of hashes).
+    """
+    with np.errstate(over='ignore'):
+        positions, shingle_weights, _, _ = _coefficients(NUM_PERM, shingle_size)
+        encoded = [text.lower().encode('utf-8', errors='replace') for text in texts]
+        data = np.frombuffer(b' '.join(encoded), dtype=np.uint8)
+        text_starts = np.zeros(len(texts), dtype=np.int64)
+        text_starts[1:] = np.cumsum([len(text) + 1 for text in encoded[:-1]])
+
+        # Every byte of a word is weighted by its position in the word, and the word hash is their sum.
+        chars = np.flatnonzero(~_space[data])
+        if not len(chars):
+            return np.empty(0, dtype=np.uint64), np.zeros(len(texts) + 1, dtype=np.int64)
+
+        first = np.ones(len(chars), dtype=bool)
+        first[1:] = np.diff(chars) != 1
+        word_starts = np.flatnonzero(first)
+        offsets = np.arange(len(chars)) - np.repeat(word_starts, np.diff(np.append(word_starts, len(chars))))
+        weighted = (data[chars].astype(np.uint64) + np.uint64(1)) * positions[offsets & 63]
+        words = _mix(np.add.reduceat(weighted, word_starts))
+
+        # Words are numbered by text, so a shingle is valid only if its first and last words are in the same text.
+        word_texts = np.searchsorted(text_starts, chars[word_starts], side='right') - 1
+        counts = np.bincount(word_texts, minlength=len(texts))
+        word_bounds = np.zeros(len(texts) + 1, dtype=np.int64)
+        word_bounds[1:] = np.cumsum(counts)
+
+        size = len(words) - shingle_size + 1
+        hashes = np.zeros(max(size, 0), dtype=np.uint64)
+        for i in range(shingle_size):
+            hashes += words[i:i + len(hashes)] * shingle_weights[i]
+        valid = word_texts[:len(hashes)] == word_texts[shingle_size - 1:]
+        shingle_texts = word_texts[:len(hashes)][valid]
+        hashes = hashes[valid]
+
+        # Short texts are a single shingle, the sum of their words.
+        filled = np.flatnonzero(counts)
+        is_short = counts[filled] < shingle_size
+        if is_short.any():
+            short = filled[is_short]
+            short_hashes = np.add.reduceat(words * shingle_weights[0], word_bounds[filled])[is_short]
+            hashes = np.concatenate([hashes, short_hashes])
+            shingle_texts = np.concatenate([shingle_texts, short])
+            order = np.argsort(shingle_texts, kind='stable')
+            hashes, shingle_texts = hashes[order], shingle_texts[order]
+
+        starts = np.searchsorted(shingle_texts, np.arange(len(texts) + 1))
+        return _mix(hashes), starts
+
+def minhash_signatures(texts: list, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE) -> np.ndarray:
+    """
+    Computes the MinHash signatures of a batch of texts: for every hash function (a*x + b, keeping the top
+    32 bits), the smallest hash of the shingles of a text. Shingles are hashed in blocks of BLOCK_SIZE rows for
+    the whole batch, and the minimum of every text is taken with a single reduction per block.
+
+    Parameters:
+    - texts (list): Texts of the batch.
+    - num_perm (int): Number of hash functions (default is NUM_PERM).
+    - shingle_size (int): Number of words of a shingle (default is SHINGLE_SIZE).
+
+    Returns:
+    np.ndarray: A (len(texts), num_perm) array of uint32. Empty texts get MAX_HASH everywhere (so they are
+    duplicates of each other).
+    """
+    _, _, multipliers, increments = _coefficients(num_perm, shingle_size)
+    hashes, starts = shingle_hashes(texts, shingle_size)
+
+    signatures = np.full((len(texts), num_perm), MAX_HASH, dtype=np.uint32)
+    with np.errstate(over='ignore'):
+        for begin in range(0, len(hashes), BLOCK_SIZE):
+            end = min(begin + BLOCK_SIZE, len(hashes))
+            # One row per hash function, so the minima are taken along contiguous rows.
+            values = ((multipliers[:, None] * hashes[None, begin:end] + increments[:, None]) >> np.uint64(32)).astype(np.uint32)
+
+            # The block is split where a text starts, a text cut by the block edges is finished by the next block.
+            first = np.searchsorted(starts, begin, side='right') - 1
+            last = np.searchsorted(starts, end - 1, side='right') - 1
+            bounds = np.maximum(starts[first:last + 1], begin) - begin
+            keep = np.append(np.diff(bounds) > 0, True)
+            texts_in_block = np.arange(first, last + 1)[keep]
+            minima = np.minimum.reduceat(values, bounds[keep], axis=1)
+            signatures[texts_in_block] = np.minimum(signatures[texts_in_block], minima.T)
+
+    return signatures
+
+class SignatureWriter:
+    """
+    Computes the MinHash signatures of the records of an output file as they are extracted, BATCH_SIZE
+    texts at a time, and writes them to 'dest' (a NumPy file of signature_dtype entries). Like the sinks,
+    the file is written to a temporary file renamed when the writer is closed without errors.
+
+    Parameters:
+    - dest (str): Path of the signature file (usually '<name>.minhash.npy' next to the content file).
+    - num_perm (int): Number of hash functions (default is NUM_PERM).
+    - batch_size (int): Texts hashed at a time (default is BATCH_SIZE).
+    """
+    def __init__(self, dest: str, num_perm=NUM_PERM, batch_size=BATCH_SIZE):
+        self.dest = dest
+        self.num_perm = num_perm
+        self.batch_size = batch_size
+        self.rows = 0
+        self._ids, self._texts = [], []
+        self._parts = []
+
+    def add(self, record_id: str, text: str):
+        self._ids.append(record_id or '')
+        self._texts.append(text or '')
+        if len(self._texts) >= self.batch_size: self._flush()
+
+    def track(self, rows, id_index: int, text_index: int):
+        """
+        Adds the record ID and text of every row of a generator, yielding the rows unchanged.
+        """
+        for row in rows:
+            self.add(row[id_index], row[text_index])
+            yield row
+
+    def _flush(self):
+        if not self._texts: return
+
+        with metrics.stage('minhash'):
+            part = np.empty(len(self._texts), dtype=signature_dtype(self.num_perm))
+            part['id'] = [record_id.encode('utf-8')[:ID_SIZE] for record_id in self._ids]
+            part['signature'] = minhash_signatures(self._texts, self.num_perm)
+
+        self._parts.append(part)
+        self.rows += len(part)
+        self._ids, self._texts = [], []
+
+    def close(self):
+        self._flush()
+        entries = np.concatenate(self._parts) if self._parts else np.empty(0, dtype=signature_dtype(self.num_perm))
+        with open(f'{self.dest}.tmp', 'wb') as file:
+            np.save(file, entries)
+        os.replace(f'{self.dest}.tmp', self.dest)
+
+    def abort(self):
+        self._parts, self._ids, self._texts = [], [], []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def signature_files(paths) -> list:
+    """
+    Returns the signature files among some files and folders (every '<name>.minhash.npy' file of a folder).
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files += sorted(f'{path}/{name}' for name in os.listdir(path) if name.endswith(SIGNATURE_SUFFIX))
+        elif path.endswith(SIGNATURE_SUFFIX):
+            files.append(path)
+
+    return files
+
+def _band_keys(signatures: np.ndarray, band: int, rows: int) -> np.ndarray:
+    # 64-bit hash of the values of a band, for every signature.
+    with np.errstate(over='ignore'):
+        keys = np.zeros(len(signatures), dtype=np.uint64)
+        for column in range(band * rows, (band + 1) * rows):
+            keys = _mix(keys + signatures[:, column].astype(np.uint64))
+
+    return keys
+
+def _find(labels: np.ndarray, records: np.ndarray) -> np.ndarray:
+    # Roots of some records, whose labels are set to them (path compression of the records only).
+    roots = labels[records]
+    while True:
+        parents = labels[roots]
+        if np.array_equal(parents, roots): break
+        roots = parents
+
+    labels[records] = roots
+    return roots
+
+def _union(labels: np.ndarray, a: np.ndarray, b: np.ndarray):
+    """
+    Merges the clusters of the pairs (a, b) in place, hooking the larger root of every pair to the smaller one
+    until both records of every pair have the same root. Roots are only hooked to smaller records, so the root
+    of a cluster is its first record.
+    """
+    while len(a):
+        roots_a, roots_b = _find(labels, a), _find(labels, b)
+        apart = roots_a != roots_b
+        a, b, roots_a, roots_b = a[apart], b[apart], roots_a[apart], roots_b[apart]
+        np.minimum.at(labels, np.maximum(roots_a, roots_b), np.minimum(roots_a, roots_b))
+
+def find_duplicates(paths, num_bands=NUM_BANDS, threshold=THRESHOLD, pair_batch=1 << 16) -> tuple:
+    """
+    Finds the clusters of near-duplicate records of some signature files with LSH banding. Bands are processed
+    one at a time: the band keys of every record are sorted, records sharing a key are paired with the first
+    one of the key, and pairs agreeing on at least 'threshold' of their signatures are merged (see _union).
+    Signature files are memory-mapped, so memory only grows with the number of records (a band key and a
+    label per record), not with their texts nor their signatures.
+
+    Parameters:
+    - paths (list): Signature files and/or folders containing them (see signature_files).
+    - num_bands (int): Number of bands, it must divide the signature length (default is NUM_BANDS).
+    - threshold (float): Min share of equal signature values of a duplicate (default is THRESHOLD). 0 keeps every candidate.
+    - pair_batch (int): Candidate pairs whose signatures are compared at a time (default is 1 << 16).
+
+    Returns:
+    tuple: Signature files, index of the first record of every file (plus the total) and the label of every
+    record: the index of the first record of its cluster, so a record is kept if its label is its own index.
+    """
+    files = signature_files(paths)
+    arrays = [np.load(path, mmap_mode='r') for path in files]
+    starts = np.zeros(len(arrays) + 1, dtype=np.int64)
+    starts[1:] = np.cumsum([len(array) for array in arrays])
+    labels = np.arange(starts[-1], dtype=np.int64)
+    if not len(labels): return files, starts, labels
+
+    num_perm = arrays[0].dtype['signature'].shape[0]
+    if num_perm % num_bands: raise ValueError(f'num_bands ({num_bands}) must divide the signature length ({num_perm}).')
+    rows = num_perm // num_bands
+
+    def gather(records):
+        # Signatures of some records (global indexes), read from the file of each one.
+        result = np.empty((len(records), num_perm), dtype=np.uint32)
+        owners = np.searchsorted(starts, records, side='right') - 1
+        for owner in np.unique(owners):
+            selected = owners == owner
+            result[selected] = arrays[owner]['signature'][records[selected] - starts[owner]]
+        return result
+
+    for band in range(num_bands):
+        keys = np.concatenate([_band_keys(array['signature'], band, rows) for array in arrays])
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+
+        repeated = np.flatnonzero(keys[1:] == keys[:-1]) + 1
+        if not len(repeated): continue
+
+        # Every record of a key is paired with the first record of the key.
+        run_starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+        firsts = order[run_starts[np.searchsorted(run_starts, repeated, side='right') - 1]]
+        others = order[repeated]
+
+        for begin in range(0, len(others), pair_batch):
+            a, b = firsts[begin:begin + pair_batch], others[begin:begin + pair_batch]
+            # Pairs already in the same cluster are not compared again.
+            apart = _find(labels, a) != _find(labels, b)
+            a, b = a[apart], b[apart]
+            if threshold > 0 and len(a):
+                similar = (gather(a) == gather(b)).mean(axis=1) >= threshold
+                a, b = a[similar], b[similar]
+            _union(labels, a, b)
+
+    # Every label is set to the root of its cluster.
+    while True:
+        parents = labels[labels]
+        if np.array_equal(parents, labels): break
+        labels = parents
+
+    return files, starts, labels
+
+def save_masks(files: list, starts: np.ndarray, labels: np.ndarray, dest_folder=None) -> dict:
+    """
+    Writes the keep/drop mask of every signature file ('<name>.dedup.csv', next to it or in dest_folder), with
+    the columns WARC_Record_ID, Keep (1 or 0) and Duplicate_Of (the record ID kept for its cluster, empty if kept).
+    Masks are applied with warcapi.DuplicateFilter.
+
+    Returns:
+    dict: Number of records, of records to drop and of clusters with duplicates.
+    """
+    arrays = [np.load(path, mmap_mode='r') for path in files]
+
+    def record_ids(records):
+        owners = np.searchsorted(starts, records, side='right') - 1
+        return [arrays[owner]['id'][record - starts[owner]].decode('utf-8') for owner, record in zip(owners, records)]
+
+    for path, array, begin, end in zip(files, arrays, starts[:-1], starts[1:]):
+        name = os.path.basename(path).removesuffix(SIGNATURE_SUFFIX)
+        dest = f'{dest_folder or os.path.dirname(path) or "."}/{name}{MASK_SUFFIX}'
+
+        file_labels = labels[begin:end]
+        drop = np.flatnonzero(file_labels != np.arange(begin, end))
+        kept_ids = dict(zip(drop.tolist(), record_ids(file_labels[drop])))
+
+        with open(f'{dest}.tmp', 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file, lineterminator='\n')
+            writer.writerow(['WARC_Record_ID', 'Keep', 'Duplicate_Of'])
+            for row, record_id in enumerate(array['id']):
+                kept = kept_ids.get(row)
+                writer.writerow([record_id.decode('utf-8'), 1 if kept is None else 0, kept or ''])
+        os.replace(f'{dest}.tmp', dest)
+
+    keep = labels == np.arange(len(labels))
+    return {
+        'records': int(len(labels)),
+        'duplicates': int((~keep).sum()),
+        'clusters': int(len(np.unique(labels[~keep])))
+    }
+
+def deduplicate(paths, dest_folder=None, num_bands=NUM_BANDS, threshold=THRESHOLD) -> dict:
+    """
+    Finds the near-duplicates of some signature files (see find_duplicates) and writes their masks (see save_masks).
+
+    Returns:
+    dict: Number of files, records, records to drop and clusters with duplicates.
+    """
+    files, starts, labels = find_duplicates(paths, num_bands, threshold)
+    if dest_folder is not None: os.makedirs(dest_folder, exist_ok=True)
+    return {'files': len(files), **save_masks(files, starts, labels, dest_folder)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Finds near-duplicate texts across the MinHash signatures written by extract_text.py --minhash.')
+
+    parser.add_argument('paths', help=f"Signature files ('<name>{SIGNATURE_SUFFIX}') or folders containing them.", nargs='+')
+    parser.add_argument('--dest', help=f"Folder to save the masks ('<name>{MASK_SUFFIX}', default is next to every signature file).", required=False)
+    parser.add_argument('--num_bands', help=f'Number of LSH bands, dividing the signature length (default is {NUM_BANDS}).', required=False)
+    parser.add_argument('--threshold', help=f'Min estimated Jaccard similarity of two duplicates, 0 to keep every LSH candidate (default is {THRESHOLD}).', required=False)
+
+    args = parser.parse_args()
+
+    stats = deduplicate(args.paths, dest_folder=args.dest,
+                        num_bands=int(args.num_bands) if args.num_bands != None else NUM_BANDS,
+                        threshold=float(args.threshold) if args.threshold != None else THRESHOLD)
+    print(json.dumps(stats))
@@ -0,0 +1,418 @@
+import os
+import argparse
+from utils import *
+from functools import partial
+from scheduler import run_scheduler
+from sinks import open_sink, EXTENSIONS
+from manifest import Manifest, file_checksum, QUEUED, DOWNLOADED, WRITTEN, FAILED
+import metrics
+from metrics import PipelineMetrics, instrumented
+from coordinator import PathQueue
+from extract_metadata import iter_metadata
+from extract_text import iter_text
+from warcapi import _get_paths
+
+JOINED_COLUMNS = [
+    'WARC_File', 'WARC_Record_ID', 'WARC_Target_URI', 'Domain',
+    'Content_Language', 'HTML_Language', 'HTML_Dir', 'WARC_Offset', 'WARC_Length',
+    'WARC_Identified_Content_Language', 'Content', 'WET_Offset', 'WET_Length'
+]
+BATCH_SIZE = 1000
+
+# SQLite file (inside the destination folder) recording the state of every WARC path.
+MANIFEST_FILE = 'manifest.sqlite'
+
+# Max number of unmatched records kept on each side of the join. WET files follow the order of their
+# WARC file, so only a few records are pending at a time; the limit only protects against odd files.
+MAX_PENDING = 10000
+
+def get_wet_path(warc_path: str, wet_dict: dict) -> str:
+    """
+    Returns the WET path of a WARC path (its sibling in the same crawl segment).
+
+    Parameters:
+    - warc_path (str): Path to the .warc.gz file (contained in warc.paths).
+    - wet_dict (dict): Mapping of WET files to their prefixes (see warcapi._get_paths). If the file is
+      not found, the path is derived from the WARC path.
+
+    Returns:
+    str: Path to the .warc.wet.gz file.
+    """
+    warc_path = warc_path.strip()
+    name = warc_path.split('/')[-1].removesuffix('.warc.gz')
+
+    if name in wet_dict:
+        return f'{wet_dict[name]}{name}.warc.wet.gz'
+
+    folder = warc_path.removesuffix(warc_path.split('/')[-1]).removesuffix('warc/')
+    return f'{folder}wet/{name}.warc.wet.gz'
+
+def _pop_match(pending: dict, key: str):
+    # Pops a matched record along with the ones pending before it: the files are in the same order, so those
+    # were skipped by the other side and can never be matched.
+    while True:
+        first = next(iter(pending))
+        record = pending.pop(first)
+        if first == key: return record
+
+def iter_joined(warc_records, wet_records, max_count=0, max_pending=MAX_PENDING):
+    """
+    Joins WARC metadata records with the text of their WET records (WARC_Record_ID == WARC_Refers_To)
+    in a single streaming pass. Both sides are consumed alternately and unmatched records wait in a hash
+    table; the side whose records are awaited is the one advanced, and both sides take turns while both
+    have records pending. WET files follow the order of their WARC file, so a match also drops the records
+    that can no longer be matched: the ones pending before it on its side (e.g. text conversions of non-HTML
+    responses, that have no metadata), and every record pending on the other side. Memory stays bounded by
+    how far the two files drift apart (at most max_pending records per side, the oldest ones are dropped).
+
+    Parameters:
+    - warc_records: Iterable of metadata records (see extract_metadata.iter_metadata).
+    - wet_records: Iterable of content records (see extract_text.iter_text).
+    - max_count (int): Max number of joined records (default is 0, that means no limit).
+    - max_pending (int): Max number of unmatched records kept per side (default is MAX_PENDING).
+
+    Returns:
+    generator: The joined records, as dictionaries with the JOINED_COLUMNS keys.
+    """
+    warc_records = iter(warc_records)
+    wet_records = iter(wet_records)
+    pending_metadata = {}
+    pending_text = {}
+    warc_done = wet_done = False
+    warc_turn = True
+    count = 0
+
+    while True:
+        if max_count != 0 and count >= max_count: return
+
+        # Once a side is exhausted, the records pending on that side cannot be matched anymore.
+        if warc_done and not pending_metadata: return
+        if wet_done and not pending_text: return
+
+        # Advance the side whose records are awaited (metadata first when nothing is pending), taking
+        # turns when both sides wait, so a record that is never matched does not stop the other side.
+        if warc_done or wet_done:
+            read_warc = not warc_done
+        elif pending_text and pending_metadata:
+            read_warc = warc_turn
+            warc_turn = not warc_turn
+        else:
+            read_warc = bool(pending_text) or not pending_metadata
+
+        if read_warc:
+            record = next(warc_records, None)
+            if record is None:
+                warc_done = True
+                pending_text.clear()
+                continue
+
+            key = record['WARC_Record_ID']
+            if key in pending_text:
+                text = _pop_match(pending_text, key)
+                pending_metadata.clear()
+            else:
+                pending_metadata[key] = record
+                if len(pending_metadata) > max_pending:
+                    del pending_metadata[next(iter(pending_metadata))]
+                continue
+        else:
+            text = next(wet_records, None)
+            if text is None:
+                wet_done = True
+                pending_metadata.clear()
+                continue
+
+            key = text['WARC_Refers_To']
+            if key in pending_metadata:
+                record = _pop_match(pending_metadata, key)
+                pending_text.clear()
+            else:
+                pending_text[key] = text
+                if len(pending_text) > max_pending:
+                    del pending_text[next(iter(pending_text))]
+                continue
+
+        yield {
+            **record,
+            'WARC_Identified_Content_Language': text['WARC_Identified_Content_Language'],
+            'Content': text['Content'],
+            'WET_Offset': text.get('WARC_Offset'),
+            'WET_Length': text.get('WARC_Length')
+        }
+        count += 1
+
+def get_joined(warc_path, wet_path, max_count=0, remove=False, streaming=False, errors=None):
+    """
+    Get the joined metadata and text of a WARC file and its WET sibling.
+
+    Parameters:
+    - warc_path (str): WARC file path (a CommonCrawl WARC path if streaming is enabled).
+    - wet_path (str): WET file path (a CommonCrawl WET path if streaming is enabled).
+    - max_count (int): Max number of joined records (default is 0).
+    - remove (bool): Wether you want to remove both files or not.
+    - streaming (bool): Parse both files while they are downloaded, without touching disk (default is False).
+    - errors (str): Path to the errors file, used only when streaming (default is None).
+
+    Returns:
+    list: The list of joined records.
+    """
+    records = list(iter_joined(iter_metadata(warc_path, streaming=streaming, errors=errors),
+                               iter_text(wet_path, streaming=streaming, errors=errors),
+                               max_count))
+
+    # The join may stop before the end of a file, so the files are removed here instead of by the parsers.
+    if remove and not streaming:
+        os.remove(warc_path)
+        os.remove(wet_path)
+
+    return records
+
+def save_joined(dest: str, records, output_format='csv'):
+    """
+    Saves the joined records to a CSV (or Parquet) file, flushing every BATCH_SIZE records.
+
+    Parameters:
+    - dest (str): Path to save the output file.
+    - records: List or generator (see iter_joined) of joined records.
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+
+    Returns:
+    int: Number of records written.
+    """
+    with open_sink(dest, JOINED_COLUMNS, output_format) as sink:
+        # Time spent producing a batch is parsing, time spent in the sink is writing.
+        for batch in metrics.timed(batched(records, BATCH_SIZE), 'parse'):
+            with metrics.stage('write'):
+                sink.write(batch)
+            metrics.count('records', len(batch))
+
+    return sink.rows
+
+def fetch(path, dest_path, errors, wet_dict, streaming=False, output_format='csv', manifest=None, resume=False):
+    """
+    I/O stage of a pipeline process: downloads a WARC path and its WET sibling into the destination folder.
+
+    Parameters:
+    - path (str): Path to the .warc.gz file (contained in warc.paths).
+    - dest_path (str): Path to the destionation where you want to save all the process.
+    - errors (str): Path to the errors file.
+    - wet_dict (dict): Mapping of WET files to their prefixes (see warcapi._get_paths).
+    - streaming (bool): Skip the downloads, both files will be streamed by the parse stage.
+    - output_format (str): Format of the joined files, used to skip already processed paths.
+    - manifest (Manifest): Manifest where the state of the path is recorded (default is None).
+    - resume (bool): Decide from the manifest whether the path is complete, instead of checking if its output exists.
+
+    Returns:
+    tuple: The WARC and WET paths to parse, or None if they were already processed or a download failed.
+    """
+    path = path.strip()
+    wet_path = get_wet_path(path, wet_dict)
+    name = path.split('/')[-1].removesuffix('.warc.gz')
+    local_files = [f'{dest_path}/{p.split("/")[-1]}' for p in (path, wet_path)]
+
+    if resume and manifest is not None:
+        if manifest.is_written(path): return None
+
+        # Downloads are atomic, but the files could still be leftovers from another run.
+        entry = manifest.get(path)
+        for local_file in local_files:
+            if os.path.exists(local_file) and (entry is None or entry['state'] != DOWNLOADED):
+                os.remove(local_file)
+    elif os.path.exists(f'{dest_path}/{name}.joined{EXTENSIONS[output_format]}'):
+        return None
+
+    if manifest is not None: manifest.mark(path, QUEUED)
+
+    if streaming: return path, wet_path
+
+    download_size = 0
+    for p, local_file in zip((path, wet_path), local_files):
+        if not os.path.exists(local_file) and download(p, dest_path, errors) is None:
+            if manifest is not None: manifest.mark(path, FAILED, error=f'download failed: {p}')
+            return None
+        download_size += os.path.getsize(local_file)
+
+    if manifest is not None: manifest.mark(path, DOWNLOADED, download_size=download_size)
+
+    return path, wet_path
+
+def parse(paths, dest_path, errors, max_count, decompression=True, streaming=False, output_format='csv', manifest=None,
+          decompress_threads=1):
+    """
+    CPU stage of a pipeline process: joins the metadata of a fetched WARC file with the text of its WET
+    file in a single pass and saves the joined records.
+
+    Parameters:
+    - paths (tuple): WARC and WET paths, as returned by fetch.
+    - dest_path (str): Path to the destionation where you want to save all the process.
+    - errors (str): Path to the errors file.
+    - max_count (int): Max number of joined records to save per WARC path.
+    - streaming (bool): Parse both files while they are downloaded, skipping downloads and decompression to disk.
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+    - manifest (Manifest): Manifest where the state of the path is recorded (default is None).
+    - decompress_threads (int): Number of threads decompressing each file (default is 1, see inflate.iter_inflate).
+
+    Returns:
+    int: Number of records written.
+    """
+    path, wet_path = paths
+    name = path.split('/')[-1].removesuffix('.warc.gz')
+    output = f'{dest_path}/{name}.joined{EXTENSIONS[output_format]}'
+
+    if streaming:
+        warc_records = iter_metadata(path, streaming=True, errors=errors)
+        wet_records = iter_text(wet_path, streaming=True, errors=errors)
+    else:
+        local_files = []
+        for p in (path, wet_path):
+            local_file = f'{dest_path}/{p.split("/")[-1]}'
+            if decompression:
+                local_file = decompress_gz(local_file, extract_path=dest_path, remove=True, num_threads=decompress_threads) or local_file
+            local_files.append(local_file)
+
+        warc_records = iter_metadata(local_files[0])
+        wet_records = iter_text(local_files[1])
+
+    count = save_joined(output, iter_joined(warc_records, wet_records, max_count), output_format)
+
+    # The join may stop before the end of a file, so the files are removed here instead of by the parsers.
+    if not streaming:
+        for local_file in local_files: os.remove(local_file)
+
+    if manifest is not None:
+        manifest.mark(path, WRITTEN, records=count, output=output,
+                      size=os.path.getsize(output), checksum=file_checksum(output))
+
+    return count
+
+def run_pipeline(paths_file: str, wet_paths_file: str, dest_path='', errors=None, max_count=0, num_workers=1, decompression=True,
+                 streaming=False, num_downloaders=None, prefetch=1, output_format='csv', resume=False, metrics_interval=None,
+                 metrics_port=None, coordinator=None, shard=None, decompress_threads=None):
+    """
+    Runs the whole joint extraction pipeline.
+
+    Parameters:
+    - paths_file (str): warc.paths file path.
+    - wet_paths_file (str): wet.paths file path of the same crawl.
+    - dest_path (str): Destination path to save all the process (defaults to the current directory).
+    - errors (str): Path to the errors file (defaults to None, that means no errors file)
+    - max_count (int): Max number of joined records to save per WARC path (default is 0).
+    - num_workers (int): Number of worker processes joining files (default is 1).
+    - streaming (bool): Parse files while they are downloaded, without temporary files (default is False).
+    - num_downloaders (int): Number of download threads (defaults to num_workers).
+    - prefetch (int): Number of WARC/WET pairs downloaded ahead of the workers (default is 1, none with a coordinator).
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+    - resume (bool): Restart only the paths that the manifest does not record as written (default is False).
+    - metrics_interval (float): Print the pipeline metrics as a JSON line every metrics_interval seconds, and a JSON
+      line with the stages of every finished file (default is None, that means no metrics are printed).
+    - metrics_port (int): Serve the pipeline metrics at http://127.0.0.1:<metrics_port>/metrics in the Prometheus
+      text format (default is None).
+    - coordinator (Coordinator): Coordinator handing out the paths to the nodes running this job (see coordinator.py).
+      Every path of paths_file is added to it, and this node only processes the paths it leases (default is None).
+    - shard (tuple): (shard_id, num_shards) to process only the paths of one shard, without a coordinator (default is None).
+    - decompress_threads (int): Number of threads decompressing every WARC and WET file, see inflate.py (default is 1).
+    """
+    # The workers already use the CPUs, more threads only when asked for (see WINDOW_SIZE in inflate.py).
+    decompress_threads = decompress_threads or 1
+    manifest = Manifest(f'{dest_path or "."}/{MANIFEST_FILE}')
+    wet_dict = _get_paths(wet_paths_file)
+
+    queue = PathQueue(paths_file, coordinator, shard)
+    monitor = PipelineMetrics(queue.total, num_workers, log_files=metrics_interval is not None)
+
+    def on_done(path, result, error):
+        skipped = result is None and error is None
+        result, record = result if result is not None else (None, None)
+        monitor.file_done(path, record, error, skipped)
+
+        # A failed download is finished as skipped, its error is in the manifest.
+        entry = manifest.get(path) if skipped else None
+        queue.done(path, error if entry is None or entry['state'] != FAILED else entry['error'])
+
+        if error is not None:
+            manifest.mark(path, FAILED, error=str(error))
+            print(f"Error: {error}")
+            return
+
+        print(monitor.progress())
+
+    if metrics_interval is not None: monitor.start_reporter(metrics_interval)
+    if metrics_port is not None: monitor.serve(metrics_port)
+
+    try:
+        # With a coordinator, another round starts when paths leased by a node that stopped become claimable again.
+        for paths in queue.rounds():
+            run_scheduler(paths,
+                          work=partial(instrumented, partial(parse, dest_path=dest_path, errors=errors, max_count=max_count,
+                                                             decompression=decompression, streaming=streaming, output_format=output_format,
+                                                             manifest=manifest, decompress_threads=decompress_threads)),
+                          fetch=partial(monitor.fetch, partial(fetch, dest_path=dest_path, errors=errors, wet_dict=wet_dict, streaming=streaming,
+                                                               output_format=output_format, manifest=manifest, resume=resume)),
+                          num_workers=num_workers, num_fetchers=num_downloaders or num_workers,
+                          prefetch=queue.prefetch(prefetch), on_done=on_done, on_state=monitor.set_queues)
+    except Exception as e:
+        print(f'[Pipeline] An error ocurred: {e}')
+    finally:
+        queue.close()
+        monitor.close()
+
+
+if __name__ == "__main__":
+    from client import configure_client
+    from cache import configure_cache, DEFAULT_SIZE
+    from coordinator import open_coordinator, DEFAULT_LEASE
+
+    parser = argparse.ArgumentParser(description='Get the metadata of WARC files joined with the text of their WET files from CommonCrawl.')
+
+    parser.add_argument('warcpaths', help="'warc.paths' file.")
+    parser.add_argument('wetpaths', help="'wet.paths' file of the same crawl.")
+    parser.add_argument('dest', help='Folder path to save joined records.')
+    parser.add_argument('--num_responses', help='Number of joined records to save per WARC path (default is no limit).', required=False)
+    parser.add_argument('--num_workers', help='Number of worker processes to process the pipeline (default is 1).', required=False)
+    parser.add_argument('--num_downloaders', help='Number of download threads (default is num_workers).', required=False)
+    parser.add_argument('--prefetch', help='Number of WARC/WET pairs downloaded ahead of the workers (default is 1).', required=False)
+    parser.add_argument('--errors_file', help='File to save which files failed while processing.', required=False)
+    parser.add_argument('--without_decompression', help='Removes decompression from pipeline.', action='store_true')
+    parser.add_argument('--decompress_threads', help='Number of threads decompressing every WARC and WET file (default is 1).', required=False)
+    parser.add_argument('--streaming', help='Parses WARC and WET files while downloading them, without writing them to disk.', action='store_true')
+    parser.add_argument('--output_format', help='Format of the joined files (default is csv).', choices=list(EXTENSIONS), default='csv')
+    parser.add_argument('--max_connections', help='Max number of simultaneous HTTP requests per process (default is 16).', required=False)
+    parser.add_argument('--max_retries', help='Max number of retries per request or dropped connection (default is 5).', required=False)
+    parser.add_argument('--cache_dir', help='Folder of a download cache shared by every run on this machine (default is no cache).', required=False)
+    parser.add_argument('--cache_size', help=f'Size budget of the download cache in GiB (default is {DEFAULT_SIZE}).', required=False)
+    parser.add_argument('--verify_cache', help='Checks the SHA-1 of every cached file before using it, not only its size (reads it once more).', action='store_true')
+    parser.add_argument('--metrics_interval', help='Prints the pipeline metrics as JSON lines every N seconds (and one line per finished file).', required=False)
+    parser.add_argument('--metrics_port', help='Serves the pipeline metrics in the Prometheus text format at http://127.0.0.1:<port>/metrics.', required=False)
+    parser.add_argument('--resume', help='Restarts only the WARC paths that the manifest does not record as written.', action='store_true')
+    parser.add_argument('--coordinator', help='Coordinator shared by the nodes running this job: a SQLite file on a shared file system, or a redis:// URL (default is no coordinator).', required=False)
+    parser.add_argument('--job', help='Name of the job in the coordinator, the same on every node (default is joint).', required=False)
+    parser.add_argument('--lease', help=f'Seconds a WARC path stays leased to a node without news from it (default is {DEFAULT_LEASE}).', required=False)
+    parser.add_argument('--shard_id', help='Processes only the WARC paths of this shard (from 0 to --num_shards - 1), without a coordinator.', required=False)
+    parser.add_argument('--num_shards', help='Number of shards the WARC paths are split into with --shard_id.', required=False)
+
+    args = parser.parse_args()
+
+    num_responses = int(args.num_responses) if args.num_responses != None else 0
+    num_workers = int(args.num_workers) if args.num_workers != None else 1
+    num_downloaders = int(args.num_downloaders) if args.num_downloaders != None else None
+    prefetch = int(args.prefetch) if args.prefetch != None else 1
+
+    configure_client(max_connections=int(args.max_connections) if args.max_connections != None else 16,
+                     max_retries=int(args.max_retries) if args.max_retries != None else 5)
+    if args.cache_dir != None:
+        configure_cache(args.cache_dir, float(args.cache_size) if args.cache_size != None else DEFAULT_SIZE,
+                        verify=args.verify_cache)
+
+    if (args.shard_id != None) != (args.num_shards != None): parser.error('--shard_id and --num_shards must be used together')
+    if args.shard_id != None and args.coordinator != None: parser.error('--shard_id cannot be used with --coordinator')
+    shard = (int(args.shard_id), int(args.num_shards)) if args.shard_id != None else None
+    coordinator = open_coordinator(args.coordinator, job=args.job or 'joint',
+                                   lease_seconds=float(args.lease) if args.lease != None else DEFAULT_LEASE) if args.coordinator != None else None
+
+    run_pipeline(args.warcpaths, args.wetpaths, dest_path=args.dest, errors=args.errors_file, max_count=num_responses,
+                 num_workers=num_workers, decompression=not args.without_decompression, streaming=args.streaming,
+                 num_downloaders=num_downloaders, prefetch=prefetch, output_format=args.output_format, resume=args.resume,
+                 metrics_interval=float(args.metrics_interval) if args.metrics_interval != None else None,
+                 metrics_port=int(args.metrics_port) if args.metrics_port != None else None,
+                 coordinator=coordinator, shard=shard,
+                 decompress_threads=int(args.decompress_threads) if args.decompress_threads != None else None)
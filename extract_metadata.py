@@ -1,111 +1,355 @@
-import pandas as pd
 import os
 import argparse
 from utils import *
-from itertools import islice
-from fastwarc.warc import ArchiveIterator, WarcRecordType
-from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from scheduler import run_scheduler
+from sinks import open_sink, EXTENSIONS
+from stats import count_records, merge_counts, save_counts, load_counts, STATS_COLUMNS, STATS_FILE
+import metrics
+from metrics import PipelineMetrics, instrumented
+from coordinator import PathQueue
+from fields import compile_plan, read_fields, FIELDS
+from manifest import Manifest, file_checksum, QUEUED, DOWNLOADED, WRITTEN, FAILED
 
 VERBOSE = False
 
-def get_metadata(warc_path, max_count=0, remove=False):
+METADATA_COLUMNS = [
+    'WARC_File', 'WARC_Record_ID', 'WARC_Target_URI', 'Domain',
+    'Content_Language', 'HTML_Language', 'HTML_Dir', 'WARC_Offset', 'WARC_Length'
+]
+RANGE_COLUMNS = ['WARC_Offset', 'WARC_Length']
+BATCH_SIZE = 10000
+
+# SQLite file (inside the destination folder) recording the state of every WARC path.
+MANIFEST_FILE = 'manifest.sqlite'
+
+# Suffix of the counts file of every WARC file when aggregating (inside the destination folder).
+COUNTS_SUFFIX = '.counts.csv'
+
+# Number of payload bytes scanned for the <html> start tag (doctypes and comments may push it far).
+TAGS_WINDOW = 1024
+
+def metadata_columns(fields=None) -> list:
+    """
+    Returns the columns of the metadata outputs extracted with some fields (see fields.py): a column per
+    field and the range columns (METADATA_COLUMNS if fields is None).
+    """
+    return compile_plan(fields).columns + RANGE_COLUMNS
+
+def record_metadata(record, warc: str, plan=None, tags_window=TAGS_WINDOW) -> tuple:
+    """
+    Extracts the metadata of a WARC record (a fastwarc WarcRecord). HTTP headers are parsed only for responses.
+
+    Parameters:
+    - record (WarcRecord): Record being read.
+    - warc (str): Name of the WARC file.
+    - plan (ExtractionPlan): Fields to extract (default is the fields of METADATA_COLUMNS, see fields.compile_plan).
+    - tags_window (int): Number of payload bytes scanned for HTML tags (default is TAGS_WINDOW).
+
+    Returns:
+    tuple: The metadata of the record as a row (a value per field of the plan, without the range columns), or None
+    if it is not an HTML response. Low-cardinality values (domain, languages, ...) are interned (see utils.intern_value).
+    """
+    from fastwarc.warc import WarcRecordType
+
+    if record.record_type != WarcRecordType.response: return None
+    if record.http_headers is None: record.parse_http()
+
+    content_type = record.http_content_type
+    if not content_type: return None
+
+    content_type = content_type.replace(';', ' ').split()[0]
+    if not content_type or content_type not in {'text/html', 'application/xhtml+xml'}: return None
+
+    # Every field is read in a single pass over the headers and the first tags_window bytes of the payload.
+    return (plan or compile_plan()).extract(record, warc, tags_window)
+
+def iter_metadata_rows(warc_path, max_count=0, remove=False, streaming=False, errors=None, partial_fetch=False, fields=None,
+                       tags_window=TAGS_WINDOW):
+    """
+    Get metadata from a WARC file path, yielding one row (a tuple with a value per column of METADATA_COLUMNS,
+    or of metadata_columns(fields)) at a time. Rows are much lighter than dictionaries and are written by the
+    sinks without conversion, so this is what the pipeline uses (see iter_metadata for the parameters).
+    When the .gz file is parsed (streaming or without decompression), every record also gets the range of its
+    gzip member (WARC_Offset, WARC_Length), to fetch it again later (see recordreader.py).
+
+    Returns:
+    generator: The records found, as tuples.
+    """
+    from fastwarc.warc import ArchiveIterator
+
+    warc = warc_path.split('/')[-1].split('.')[0] # split the folder path first, CC segments contain dots
+    plan = compile_plan(fields)
+
+    def parse(stream):
+        # Every record is visited (not only responses), since the next record is where a member ends.
+        i = 0
+        for record in ArchiveIterator(stream, parse_http=False):
+            if i >= max_count and max_count != 0:
+                yield None, record.stream_pos
+                return
+
+            metadata = record_metadata(record, warc, plan, tags_window)
+            yield metadata, record.stream_pos
+            if metadata is not None: i += 1
+
+    with open_archive(warc_path, streaming, errors, verbose=VERBOSE, partial_fetch=partial_fetch) as stream:
+        yield from with_record_ranges(parse(stream), stream, compressed=streaming or warc_path.endswith('.gz'))
+
+    if remove and not streaming:
+        os.remove(warc_path)
+
+def iter_metadata(warc_path, max_count=0, remove=False, streaming=False, errors=None, partial_fetch=False, fields=None,
+                  tags_window=TAGS_WINDOW):
+    """
+    Get metadata from a WARC file path, yielding one record at a time (memory does not grow with the file size).
+    When the .gz file is parsed (streaming or without decompression), every record also gets the range of its
+    gzip member (WARC_Offset, WARC_Length), to fetch it again later (see recordreader.py).
+
+    Parameters:
+    - warc_path (str): WARC file path to extract the metadata (a CommonCrawl WARC path if streaming is enabled).
+    - max_count (int): Max number of responses to get from a WARC path (default is 0).
+    - remove (bool): Wether you want to remove the .warc file or not.
+    - streaming (bool): Parse the records while they are downloaded, without touching disk (default is False).
+    - errors (str): Path to the errors file, used only when streaming (default is None).
+    - partial_fetch (bool): When streaming, fetch only the leading byte ranges of the file needed to find max_count records (default is False).
+    - fields (list): Fields to extract, see fields.py (default is the fields of METADATA_COLUMNS).
+
+    Returns:
+    generator: The records found, as dictionaries.
+    """
+    columns = metadata_columns(fields)
+    for row in iter_metadata_rows(warc_path, max_count, remove, streaming, errors, partial_fetch, fields, tags_window):
+        yield dict(zip(columns, row))
+
+def get_metadata(warc_path, max_count=0, remove=False, streaming=False, errors=None, partial_fetch=False, fields=None,
+                 tags_window=TAGS_WINDOW):
     """
     Get metadata from a WARC file path.
 
     Parameters:
-    - warc_path (str): WARC file path to extract the metadata.
+    - warc_path (str): WARC file path to extract the metadata (a CommonCrawl WARC path if streaming is enabled).
     - max_count (int): Max number of responses to get from a WARC path (default is 0).
     - remove (bool): Wether you want to remove the .warc file or not.
+    - streaming (bool): Parse the records while they are downloaded, without touching disk (default is False).
+    - errors (str): Path to the errors file, used only when streaming (default is None).
+    - partial_fetch (bool): When streaming, fetch only the leading byte ranges of the file needed to find max_count records (default is False).
+    - fields (list): Fields to extract, see fields.py (default is the fields of METADATA_COLUMNS).
 
     Returns:
     list: The list of records found.
     """
-    warc = warc_path.split('.')[0].split('/')[-1] # second split in case that it's a folder path
+    return list(iter_metadata(warc_path, max_count, remove, streaming, errors, partial_fetch, fields, tags_window))
 
-    i = 0
-    records = []
-    with open(warc_path, 'rb') as stream:
-        for record in ArchiveIterator(stream, record_types=WarcRecordType.response):
-            if i >= max_count and max_count != 0: break
-            content_type = record.http_content_type
-            if not content_type: continue
+def save_metadata(dest: str, records, output_format='csv', columns=METADATA_COLUMNS):
+    """
+    Saves the metadata to a CSV (or Parquet) file, flushing every BATCH_SIZE records.
 
-            content_type = content_type.replace(';', ' ').split()[0]
-            if not content_type or content_type not in {'text/html', 'application/xhtml+xml'}: continue
+    Parameters:
+    - dest (str): Path to save the output file.
+    - records: List or generator of records found in a WARC path, either dictionaries (see iter_metadata)
+      or rows (see iter_metadata_rows).
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+    - columns (list): Columns of the records (default is METADATA_COLUMNS, see metadata_columns).
+
+    Returns:
+    int: Number of records written.
+    """
+    with open_sink(dest, columns, output_format) as sink:
+        # Time spent producing a batch is parsing, time spent in the sink is writing.
+        for batch in metrics.timed(batched(records, BATCH_SIZE), 'parse'):
+            with metrics.stage('write'):
+                if isinstance(batch[0], tuple):
+                    sink.write_rows(batch)
+                else:
+                    sink.write(batch)
+            metrics.count('records', len(batch))
+
+    return sink.rows
+
+def counts_file(dest_path: str, name: str) -> str:
+    """
+    Returns the counts file of a WARC file when aggregating ('<name>.counts.csv' inside dest_path, see stats.save_counts).
+    """
+    return f'{dest_path or "."}/{name}{COUNTS_SUFFIX}'
 
-            warc_record_id = record.record_id
-            warc_target_uri = get_warc_header('WARC-Target-URI', record.headers)
-            content_language = get_header('Content-Language', record.http_headers, exact_match=True)
+def merge_counts_files(paths_file: str, dest_path='') -> tuple:
+    """
+    Merges the counts files of every WARC path of a paths file (see counts_file), e.g. written into a shared
+    destination folder by the nodes of a job run with aggregate.
 
-            content = record.reader.read(200)
+    Returns:
+    tuple: The merged counts (a Counter of values for every column), and the number of paths without counts file.
+    """
+    total, missing = {}, 0
+    with open(paths_file, 'r') as file:
+        for line in file:
+            if not line.strip(): continue
 
-            extracted_tags = extract_tags(content, ['lang', 'dir'], record.http_charset or 'utf-8')
+            output = counts_file(dest_path, line.strip().split('/')[-1].removesuffix('.warc.gz'))
+            if os.path.exists(output):
+                merge_counts(total, load_counts(output))
+            else:
+                missing += 1
 
-            records.append({
-                'WARC_File': warc,
-                'WARC_Record_ID': warc_record_id,
-                'WARC_Target_URI': warc_target_uri,
-                'Domain': get_domain_from_url(warc_target_uri).split('.')[-1],
-                'Content_Language': content_language,
-                'HTML_Language': extracted_tags['lang'],
-                'HTML_Dir': extracted_tags['dir']
-            })
+    return total, missing
 
-            i += 1
+def save_total_counts(paths_file: str, dest_path='') -> bool:
+    """
+    Saves the total of the counts files of every WARC path of a paths file to STATS_FILE inside dest_path,
+    unless some path has no counts file yet (see merge_counts_files).
 
-    if remove:
-        os.remove(warc_path)
+    Returns:
+    bool: Whether the total was saved.
+    """
+    total, missing = merge_counts_files(paths_file, dest_path)
+    if missing:
+        print(f'Not saving {STATS_FILE}: {missing} paths have no counts file in {dest_path or "."} yet.')
+        return False
 
-    return records
+    save_counts(f'{dest_path or "."}/{STATS_FILE}', total)
+    return True
 
-def save_metadata(dest: str, records: list):
+def fetch(path, dest_path, errors, streaming=False, output_format='csv', manifest=None, resume=False, aggregate=False):
     """
-    Saves the metadata to a CSV file.
+    I/O stage of a pipeline process: downloads a WARC path into the destination folder.
 
     Parameters:
-    - dest (str): Path to save the CSV file.
-    - records (list): List of records found in a WARC path.
+    - path (str): Path to the .warc.gz file (contained in warc.paths).
+    - dest_path (str): Path to the destionation where you want to save all the process.
+    - errors (str): Path to the errors file.
+    - streaming (bool): Skip the download, the WARC file will be streamed by the parse stage.
+    - output_format (str): Format of the metadata files, used to skip already processed paths.
+    - manifest (Manifest): Manifest where the state of the path is recorded (default is None).
+    - resume (bool): Decide from the manifest whether the path is complete, instead of checking if its output exists.
+    - aggregate (bool): The output of the path is its counts file (see counts_file).
+
+    Returns:
+    str: The WARC path to parse, or None if it was already processed or the download failed.
     """
-    df = pd.DataFrame(records)
+    path = path.strip()
+    file = path.split('/')[-1]
+    name = file.removesuffix('.warc.gz')
+    output = counts_file(dest_path, name) if aggregate else f'{dest_path}/{name}{EXTENSIONS[output_format]}'
+
+    if resume and manifest is not None:
+        entry = manifest.get(path)
+        # A path written by a run of the other mode (its metadata file when aggregating) is parsed again.
+        if manifest.is_written(path) and (entry['output'] == output or (aggregate and os.path.exists(output))): return None
+
+        # Downloads are atomic, but the file could still be a leftover from another run.
+        local_file = f'{dest_path}/{file}'
+        if os.path.exists(local_file) and (entry is None or entry['download_size'] != os.path.getsize(local_file)):
+            os.remove(local_file)
+    elif os.path.exists(output):
+        #print(f'Skipping process for {name} since it already exists.')
+        return None
+
+    if manifest is not None: manifest.mark(path, QUEUED)
 
-    df.to_csv(dest, index=False)
+    if streaming: return path
 
-def process(path, dest_path, errors, max_count, decompression=True):
+    if VERBOSE: print(f'Downloading {file}...')
+    local_file = download(path, dest_path, errors, verbose=VERBOSE)
+
+    if local_file is None:
+        if manifest is not None: manifest.mark(path, FAILED, error='download failed')
+        return None
+
+    if manifest is not None: manifest.mark(path, DOWNLOADED, download_size=os.path.getsize(local_file))
+
+    return path
+
+def parse(path, dest_path, errors, max_count, decompression=True, streaming=False, output_format='csv', manifest=None,
+          aggregate=False, joint=(), partial_fetch=False, decompress_threads=1, fields=None, tags_window=TAGS_WINDOW):
     """
-    Runs a single pipeline process.
+    CPU stage of a pipeline process: decompresses a fetched WARC file, extracts its metadata and saves it
+    (or only counts it, if aggregate is enabled).
 
     Parameters:
-    - path (str): Path to the .warc.gz file that contains WARC paths (contained in warc.paths).
+    - path (str): Path to the .warc.gz file, as returned by fetch.
     - dest_path (str): Path to the destionation where you want to save all the process.
     - errors (str): Path to the errors file.
     - max_count (int): Max number of responses to get from a WARC path.
+    - streaming (bool): Parse the WARC file while it is downloaded, skipping download and decompression to disk.
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+    - manifest (Manifest): Manifest where the state of the path is recorded (default is None).
+    - aggregate (bool): Count the values of STATS_COLUMNS instead of saving the records (default is False).
+    - joint (list): Groups of columns whose combinations are also counted when aggregating (see stats.count_records).
+    - partial_fetch (bool): When streaming, fetch only the leading byte ranges needed to find max_count records (default is False).
+    - decompress_threads (int): Number of threads decompressing the file (default is 1, see inflate.iter_inflate).
+    - fields (list): Fields to extract, see fields.py (default is the fields of METADATA_COLUMNS). When aggregating,
+      the fields counted (default is STATS_COLUMNS).
+    - tags_window (int): Number of payload bytes scanned for HTML tags (default is TAGS_WINDOW).
+
+    Returns:
+    int: Number of records written, or the counts of the file (see stats.count_records) if aggregate is enabled,
+    also saved to its counts file (see counts_file).
     """
-    path = path.strip()
-    out = path.split('/')
-    file = out[-1]
+    file = path.split('/')[-1]
     name = file.removesuffix('.warc.gz')
+    output = f'{dest_path}/{name}{EXTENSIONS[output_format]}'
+
+    # Records are counted as dictionaries, but saved as rows.
+    extract = iter_metadata if aggregate else iter_metadata_rows
+    if streaming:
+        records = extract(path, max_count=max_count, streaming=True, errors=errors, partial_fetch=partial_fetch, fields=fields,
+                          tags_window=tags_window)
+    else:
+        new_file = None
+        if decompression:
+            if VERBOSE: print(f'Decompressing {file}...')
+            new_file = decompress_gz(f'{dest_path}/{file}', extract_path=dest_path, remove=True, num_threads=decompress_threads)
+
+        records = extract(new_file or f'{dest_path}/{file}', max_count=max_count, remove=True, fields=fields, tags_window=tags_window)
+
+    if aggregate:
+        # Records are counted as they are extracted, only the counters go back to the parent process. They are
+        # also saved for the file, so a resumed run merges them instead of counting the file again.
+        columns = compile_plan(fields).columns if fields else STATS_COLUMNS
+        counts = count_records(metrics.timed(records, 'parse'), columns=columns, joint=joint)
+        output = counts_file(dest_path, name)
+        save_counts(output, counts)
+        if manifest is not None:
+            manifest.mark(path, WRITTEN, records=sum(counts[columns[0]].values()), output=output,
+                          size=os.path.getsize(output), checksum=file_checksum(output))
+
+        if VERBOSE: print(f'Done counting metadata from {name}')
+        return counts
+
+    # Records are extracted lazily, while the sink writes them in batches.
+    if VERBOSE: print(f'Getting and saving metadata from {name}...')
+    count = save_metadata(output, records, output_format, metadata_columns(fields))
+
+    if manifest is not None:
+        manifest.mark(path, WRITTEN, records=count, output=output,
+                      size=os.path.getsize(output), checksum=file_checksum(output))
 
-    if os.path.exists(f'{dest_path}/{name}.csv'):
-        #print(f'Skipping process for {name} since it already exists.')
-        return
+    if VERBOSE: print(f'Done writing metadata from {name}')
 
-    if VERBOSE: print(f'Downloading {file}...')
-    download(path, dest_path, errors, verbose=VERBOSE)
+    return count
 
-    new_file = None
-    if decompression:
-        if VERBOSE: print(f'Decompressing {file}...')
-        new_file = decompress_gz(f'{dest_path}/{file}', extract_path=dest_path, remove=True)
-    
-    if VERBOSE: print(f'Getting metadata from {name}...')
-    records = get_metadata(new_file or f'{dest_path}/{file}', max_count=max_count, remove=True)
+def process(path, dest_path, errors, max_count, decompression=True, streaming=False, output_format='csv'):
+    """
+    Runs a single pipeline process (fetch and parse stages in the calling thread).
 
-    if VERBOSE: print(f'Saving metadata from {name}...')
-    save_metadata(f'{dest_path}/{name}.csv', records)
+    Parameters:
+    - path (str): Path to the .warc.gz file that contains WARC paths (contained in warc.paths).
+    - dest_path (str): Path to the destionation where you want to save all the process.
+    - errors (str): Path to the errors file.
+    - max_count (int): Max number of responses to get from a WARC path.
+    - streaming (bool): Parse the WARC file while it is downloaded, skipping download and decompression to disk.
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+    """
+    path = fetch(path, dest_path, errors, streaming, output_format)
+    if path is None: return
 
-    if VERBOSE: print(f'Done writing metadata from {name}')
+    parse(path, dest_path, errors, max_count, decompression, streaming, output_format)
 
-def run_pipeline(paths_file: str, dest_path='', errors=None, max_count=0, num_workers=1, decompression=True):
+def run_pipeline(paths_file: str, dest_path='', errors=None, max_count=0, num_workers=1, decompression=True, streaming=False,
+                 num_downloaders=None, prefetch=1, output_format='csv', resume=False, aggregate=False, joint=(),
+                 metrics_interval=None, metrics_port=None, partial_fetch=False, coordinator=None, shard=None, decompress_threads=None,
+                 fields=None, tags_window=TAGS_WINDOW):
     """
     Runs the whole extraction pipeline.
 
@@ -114,49 +358,191 @@ def run_pipeline(paths_file: str, dest_path='', errors=None, max_count=0, num_wo
     - dest_path (str): Destination path to save all the process (defaults to the current directory).
     - errors (str): Path to the errors file (defaults to None, that means no errors file)
     - max_count (int): Max number of responses to get from a WARC path (default is 0).
-    - num_workers (int): Number of workers to run the pipeline (default is 1).
+    - num_workers (int): Number of worker processes parsing WARC files (default is 1).
+    - streaming (bool): Parse WARC files while they are downloaded, without temporary files (default is False).
+    - num_downloaders (int): Number of download threads (defaults to num_workers).
+    - prefetch (int): Number of WARC files downloaded ahead of the parsing workers (default is 1, none with a coordinator).
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+    - resume (bool): Restart only the paths that the manifest does not record as written (default is False).
+    - aggregate (bool): Only count the values of STATS_COLUMNS, writing the counts of every WARC path (see counts_file)
+      and, if every path is counted, their total (STATS_FILE) instead of one metadata file per WARC path (default is False).
+      A node that only processes a shard never saves the total: with a coordinator it is merged from the counts files
+      once every path of the job is done (see save_total_counts), and without one it is left to save_total_counts.
+    - joint (list): Groups of columns whose combinations are also counted when aggregating, e.g. [('Domain', 'HTML_Language')].
+    - metrics_interval (float): Print the pipeline metrics as a JSON line every metrics_interval seconds, and a JSON
+      line with the stages of every finished file (default is None, that means no metrics are printed).
+    - metrics_port (int): Serve the pipeline metrics at http://127.0.0.1:<metrics_port>/metrics in the Prometheus
+      text format (default is None).
+    - partial_fetch (bool): Stream every WARC file fetching only the leading byte ranges needed to find max_count
+      records, in Range requests of growing size (default is False). Requires max_count.
+    - coordinator (Coordinator): Coordinator handing out the paths to the nodes running this job (see coordinator.py).
+      Every path of paths_file is added to it, and this node only processes the paths it leases (default is None).
+    - shard (tuple): (shard_id, num_shards) to process only the paths of one shard, without a coordinator (default is None).
+    - decompress_threads (int): Number of threads decompressing every WARC file, see inflate.py (default is 1).
+    - fields (list): Fields extracted from every response, see fields.py (defaults to the fields of METADATA_COLUMNS).
+      With aggregate, the fields counted instead of STATS_COLUMNS.
+    - tags_window (int): Number of payload bytes of every response scanned for HTML tags (default is TAGS_WINDOW).
     """
+    # Partial fetches are streamed, nothing is downloaded to disk.
+    streaming = streaming or partial_fetch
+    # The workers already use the CPUs, more threads only when asked for (see WINDOW_SIZE in inflate.py).
+    decompress_threads = decompress_threads or 1
+    manifest = Manifest(f'{dest_path or "."}/{MANIFEST_FILE}')
+    queue = PathQueue(paths_file, coordinator, shard)
+    monitor = PipelineMetrics(queue.total, num_workers, log_files=metrics_interval is not None)
+    total = {}
+    failures = 0
+
+    def on_done(path, result, error):
+        nonlocal failures
+        skipped = result is None and error is None
+        result, record = result if result is not None else (None, None)
+        monitor.file_done(path, record, error, skipped)
+
+        # A failed download is finished as skipped, its error is in the manifest.
+        entry = manifest.get(path) if skipped else None
+        failed = entry is not None and entry['state'] == FAILED
+        queue.done(path, error if not failed else entry['error'])
+
+        if error is not None or failed:
+            failures += 1
+        if error is not None:
+            manifest.mark(path, FAILED, error=str(error))
+            print(f"Error: {error}")
+            return
+
+        if aggregate:
+            if result is not None:
+                merge_counts(total, result)
+            elif not failed:
+                # Already counted by a previous run.
+                merge_counts(total, load_counts(counts_file(dest_path, path.strip().split('/')[-1].removesuffix('.warc.gz'))))
+        print(monitor.progress())
+
+    if metrics_interval is not None: monitor.start_reporter(metrics_interval)
+    if metrics_port is not None: monitor.serve(metrics_port)
+
     try:
-        with open(paths_file, 'r') as file:
-            completed = 0
-            while True:
-                batch = list(islice(file, num_workers))
-                if not batch: break
-
-                with ThreadPoolExecutor(max_workers=num_workers) as executor:
-                    features = {executor.submit(process, line, dest_path, errors, max_count, decompression) for line in batch}
-
-                    for future in features:
-                        try:
-                            future.result()
-                            completed += 1
-                            print(f'Progress: {completed}/90000')
-                        except Exception as e:
-                            print(f"Error: {e}")
+        # With a coordinator, another round starts when paths leased by a node that stopped become claimable again.
+        for paths in queue.rounds():
+            run_scheduler(paths,
+                          work=partial(instrumented, partial(parse, dest_path=dest_path, errors=errors, max_count=max_count,
+                                                             decompression=decompression, streaming=streaming, output_format=output_format,
+                                                             manifest=manifest, aggregate=aggregate, joint=joint, partial_fetch=partial_fetch,
+                                                             decompress_threads=decompress_threads, fields=fields,
+                                                             tags_window=tags_window)),
+                          fetch=partial(monitor.fetch, partial(fetch, dest_path=dest_path, errors=errors, streaming=streaming,
+                                                               output_format=output_format, manifest=manifest, resume=resume,
+                                                               aggregate=aggregate)),
+                          num_workers=num_workers, num_fetchers=num_downloaders or num_workers,
+                          prefetch=queue.prefetch(prefetch), on_done=on_done, on_state=monitor.set_queues)
     except Exception as e:
+        failures += 1
         print(f'[Pipeline] An error ocurred: {e}')
+    finally:
+        queue.close()
+        monitor.close()
+
+    if aggregate:
+        # A partial total would look like the counts of the whole crawl.
+        remaining = queue.remaining()
+        if failures:
+            print(f'Not saving {STATS_FILE}: {failures} paths were not counted. Run again with --resume to count only them.')
+        elif shard is not None:
+            print(f'Not saving {STATS_FILE} from a single shard. Once every shard is done, merge their counts with --merge_counts.')
+        elif remaining:
+            print(f'Not saving {STATS_FILE}: {remaining} paths of the job are not done. Once they are, merge their counts with --merge_counts.')
+        elif coordinator is not None:
+            # The other nodes counted some paths: their counts are only in the (shared) destination folder.
+            save_total_counts(paths_file, dest_path)
+        else:
+            save_counts(f'{dest_path or "."}/{STATS_FILE}', total)
 
 
 if __name__ == "__main__":
+    from client import configure_client
+    from cache import configure_cache, DEFAULT_SIZE
+    from coordinator import open_coordinator, DEFAULT_LEASE
+
     parser = argparse.ArgumentParser(description='Get all metadata from WARC files from CommonCrawl.')
 
     parser.add_argument('warcpaths', help="'warc.paths' file.")
     parser.add_argument('dest', help='Folder path to save metadata.')
     parser.add_argument('--num_responses', help='Number of responses to save per record (default is no limit).', required=False)
-    parser.add_argument('--num_workers', help='Number of workers to process the pipeline (default is 1).', required=False)
+    parser.add_argument('--num_workers', help='Number of worker processes to process the pipeline (default is 1).', required=False)
+    parser.add_argument('--num_downloaders', help='Number of download threads (default is num_workers).', required=False)
+    parser.add_argument('--prefetch', help='Number of WARC files downloaded ahead of the workers (default is 1).', required=False)
     parser.add_argument('--errors_file', help='File to save which files failed while processing.', required=False)
     parser.add_argument('--without_decompression', help='Removes decompression from pipeline.', action='store_true')
+    parser.add_argument('--decompress_threads', help='Number of threads decompressing every WARC file (default is 1).', required=False)
+    parser.add_argument('--streaming', help='Parses WARC files while downloading them, without writing them to disk.', action='store_true')
+    parser.add_argument('--partial_fetch', help='With --num_responses, fetches only the first byte ranges of every WARC file needed to find them.', action='store_true')
+    parser.add_argument('--output_format', help='Format of the metadata files (default is csv).', choices=list(EXTENSIONS), default='csv')
+    parser.add_argument('--fields', help=f"Fields extracted from every response, separated by commas, or a file listing them (default is {','.join(METADATA_COLUMNS[:-2])}). Available fields are {', '.join(FIELDS)}, and any header as warc:<Name> or http:<Name>.", required=False)
+    parser.add_argument('--tags_window', help='Number of bytes of every response scanned for HTML tags (default is 1024).', required=False)
+    parser.add_argument('--max_connections', help='Max number of simultaneous HTTP requests per process (default is 16).', required=False)
+    parser.add_argument('--max_retries', help='Max number of retries per request or dropped connection (default is 5).', required=False)
+    parser.add_argument('--cache_dir', help='Folder of a download cache shared by every run on this machine (default is no cache).', required=False)
+    parser.add_argument('--cache_size', help=f'Size budget of the download cache in GiB (default is {DEFAULT_SIZE}).', required=False)
+    parser.add_argument('--verify_cache', help='Checks the SHA-1 of every cached file before using it, not only its size (reads it once more).', action='store_true')
+    parser.add_argument('--resume', help='Restarts only the WARC paths that the manifest does not record as written.', action='store_true')
+    parser.add_argument('--aggregate_only', help=f"Only counts {', '.join(STATS_COLUMNS)} and saves a single counts file ('{STATS_FILE}') instead of the metadata files.", action='store_true')
+    parser.add_argument('--merge_counts', help=f"Only saves the total of the counts files of every WARC path ('{STATS_FILE}'), e.g. once every shard of an --aggregate_only job is done.", action='store_true')
+    parser.add_argument('--joint', help="Columns whose combinations are also counted with --aggregate_only, separated by commas (e.g. Domain,HTML_Language). Can be repeated.", action='append', required=False)
+    parser.add_argument('--metrics_interval', help='Prints the pipeline metrics as JSON lines every N seconds (and one line per finished file).', required=False)
+    parser.add_argument('--metrics_port', help='Serves the pipeline metrics in the Prometheus text format at http://127.0.0.1:<port>/metrics.', required=False)
+    parser.add_argument('--coordinator', help='Coordinator shared by the nodes running this job: a SQLite file on a shared file system, or a redis:// URL (default is no coordinator).', required=False)
+    parser.add_argument('--job', help='Name of the job in the coordinator, the same on every node (default is metadata).', required=False)
+    parser.add_argument('--lease', help=f'Seconds a WARC path stays leased to a node without news from it (default is {DEFAULT_LEASE}).', required=False)
+    parser.add_argument('--shard_id', help='Processes only the WARC paths of this shard (from 0 to --num_shards - 1), without a coordinator.', required=False)
+    parser.add_argument('--num_shards', help='Number of shards the WARC paths are split into with --shard_id.', required=False)
     parser.add_argument('--verbose', help='Activates verbose mode.', action='store_true')
 
     args = parser.parse_args()
 
     warcpaths = args.warcpaths
     dest = args.dest
+
+    if args.merge_counts:
+        parser.exit(0 if save_total_counts(warcpaths, dest) else 1)
     num_responses = int(args.num_responses) if args.num_responses != None else 0
     num_workers = int(args.num_workers) if args.num_workers != None else 1
+    num_downloaders = int(args.num_downloaders) if args.num_downloaders != None else None
+    prefetch = int(args.prefetch) if args.prefetch != None else 1
+
+    configure_client(max_connections=int(args.max_connections) if args.max_connections != None else 16,
+                     max_retries=int(args.max_retries) if args.max_retries != None else 5)
+    if args.cache_dir != None:
+        configure_cache(args.cache_dir, float(args.cache_size) if args.cache_size != None else DEFAULT_SIZE,
+                        verify=args.verify_cache)
     errors_file = args.errors_file
     without_decompression = args.without_decompression
     VERBOSE = args.verbose
 
+    if args.partial_fetch and num_responses == 0: parser.error('--partial_fetch requires --num_responses')
+
+    try:
+        fields = read_fields(args.fields) if args.fields != None else None
+        columns = metadata_columns(fields)
+    except ValueError as e:
+        parser.error(f'Invalid --fields: {e}')
+
+    joint = [tuple(group.split(',')) for group in args.joint or []]
+    for group in joint:
+        if not set(group) <= set(columns): parser.error(f'Invalid --joint columns: {",".join(group)}')
+
+    if (args.shard_id != None) != (args.num_shards != None): parser.error('--shard_id and --num_shards must be used together')
+    if args.shard_id != None and args.coordinator != None: parser.error('--shard_id cannot be used with --coordinator')
+    shard = (int(args.shard_id), int(args.num_shards)) if args.shard_id != None else None
+    coordinator = open_coordinator(args.coordinator, job=args.job or 'metadata',
+                                   lease_seconds=float(args.lease) if args.lease != None else DEFAULT_LEASE) if args.coordinator != None else None
+
     run_pipeline(warcpaths, dest_path=dest, errors=errors_file, max_count=num_responses,
-                 num_workers=num_workers, decompression=not without_decompression)
+                 num_workers=num_workers, decompression=not without_decompression, streaming=args.streaming,
+                 num_downloaders=num_downloaders, prefetch=prefetch, output_format=args.output_format, resume=args.resume,
+                 aggregate=args.aggregate_only, joint=joint,
+                 metrics_interval=float(args.metrics_interval) if args.metrics_interval != None else None,
+                 metrics_port=int(args.metrics_port) if args.metrics_port != None else None,
+                 partial_fetch=args.partial_fetch, coordinator=coordinator, shard=shard,
+                 decompress_threads=int(args.decompress_threads) if args.decompress_threads != None else None, fields=fields,
+                 tags_window=int(args.tags_window) if args.tags_window != None else TAGS_WINDOW)
@@ -1,125 +1,294 @@
-import pandas as pd
 import os
 import argparse
-import threading
 from utils import *
-from itertools import islice
-from fastwarc.warc import ArchiveIterator, WarcRecordType
+from functools import partial
+from scheduler import run_scheduler
+from sinks import open_sink, read_output, EXTENSIONS
+from manifest import Manifest, file_checksum, QUEUED, DOWNLOADED, WRITTEN, FAILED
+import metrics
+from metrics import PipelineMetrics, instrumented
+from coordinator import PathQueue
 
 ## Defaults ##
 TEST_PATH = None
 ## Defaults ##
 
-def get_text(wet_path, max_count=0, remove=False):
+CONTENT_COLUMNS = [
+    'WARC_File', 'WARC_Record_ID', 'WARC_Refers_To',
+    'WARC_Identified_Content_Language', 'Content', 'WARC_Offset', 'WARC_Length'
+]
+BATCH_SIZE = 1000
+
+# WARC headers read from every WET record.
+TEXT_HEADERS = {'Content-Type', 'WARC-Refers-To', 'WARC-Identified-Content-Language'}
+
+# SQLite file (inside the destination folder) recording the state of every WET path.
+MANIFEST_FILE = 'manifest.sqlite'
+
+def record_text(record, wet: str) -> tuple:
     """
-    Get content from a WET file path.
+    Extracts the text of a WET record (a fastwarc WarcRecord).
 
     Parameters:
-    - wet_path (str): WET file path to extract the content.
-    - max_count (int): Max number of responses to get from a WET path (default is 0).
-    - remove (bool): Wether you want to remove the .warc.wet file or not.
+    - record (WarcRecord): Record being read.
+    - wet (str): Name of the WET file.
 
     Returns:
-    list: The list of records found.
+    tuple: The text of the record as a row (CONTENT_COLUMNS without the range columns), or None if it is
+    not a text conversion. Identified languages are interned (see utils.intern_value).
+    """
+    # The headers are read in a single pass, instead of a scan per header.
+    headers = {}
+    for name, value in record.headers:
+        if name in TEXT_HEADERS: headers.setdefault(name, value)
+
+    if headers.get('Content-Type') != 'text/plain': return None
+
+    return (
+        wet,
+        record.record_id,
+        headers.get('WARC-Refers-To'),
+        intern_value(headers.get('WARC-Identified-Content-Language')),
+        record.reader.read().decode('utf-8', errors='replace')
+    )
+
+def iter_text_rows(wet_path, max_count=0, remove=False, streaming=False, errors=None, partial_fetch=False):
     """
-    wet = wet_path.split('.')[0].split('/')[-1] # second split in case that it's a folder path
+    Get content from a WET file path, yielding one row (a tuple with a value per column of CONTENT_COLUMNS)
+    at a time, written by the sinks without conversion (see iter_text for the parameters).
+    When the .gz file is parsed (streaming or without decompression), every record also gets the range of its
+    gzip member (WARC_Offset, WARC_Length), to fetch it again later (see recordreader.py).
+
+    Returns:
+    generator: The records found, as tuples (nothing is yielded in test mode).
+    """
+    from fastwarc.warc import ArchiveIterator
+
+    wet = wet_path.split('/')[-1].split('.')[0] # split the folder path first, CC segments contain dots
 
     if TEST_PATH:
         path = f'{TEST_PATH}/{wet}.csv'
+        if not os.path.exists(path):
+            path = f'{TEST_PATH}/{wet}.parquet'
         if not os.path.exists(path):
             print(f'"{path}" was not found. Finishing process...')
             exit()
-        
-        _records = pd.read_csv(path, index_col='WARC_Record_ID')
 
-    i = 0
-    records = []
-    with open(wet_path, 'rb') as stream:
+        _records = read_output(path, index_col='WARC_Record_ID')
+
+    def parse(stream):
+        i = 0
         for record in ArchiveIterator(stream):
-            if i >= max_count and max_count != 0: break
-            content_type = get_warc_header('Content-Type', record.headers)
-            if not content_type: continue
-            if content_type != 'text/plain': continue
-
-            warc_refers_to = get_warc_header('WARC-Refers-To', record.headers)
-            content = record.reader.read().decode('utf-8', errors='replace')
-
-            if not TEST_PATH:
-                warc_record_id = record.record_id
-                content_language = get_warc_header('WARC-Identified-Content-Language', record.headers)
-
-                records.append({
-                    'WARC_File': wet,
-                    'WARC_Record_ID': warc_record_id,
-                    'WARC_Refers_To': warc_refers_to,
-                    'WARC_Identified_Content_Language': content_language,
-                    'Content': content
-                })
-            else:
-                try:
-                    lang = _records.at[warc_refers_to, 'HTML_Language']
-                    print(f'"{content[:20]}" --> {lang}')
-                except KeyError:
-                    print('Key error')
-                    pass
-
-            i += 1
-
-    if remove:
+            if i >= max_count and max_count != 0:
+                yield None, record.stream_pos
+                return
+
+            text = record_text(record, wet)
+            if text is not None:
+                i += 1
+                if TEST_PATH:
+                    try:
+                        lang = _records.at[text[2], 'HTML_Language']
+                        print(f'"{text[4][:20]}" --> {lang}')
+                    except KeyError:
+                        print('Key error')
+                    text = None
+
+            yield text, record.stream_pos
+
+    with open_archive(wet_path, streaming, errors, partial_fetch=partial_fetch) as stream:
+        yield from with_record_ranges(parse(stream), stream, compressed=streaming or wet_path.endswith('.gz'))
+
+    if remove and not streaming:
         os.remove(wet_path)
 
-    return records
+def iter_text(wet_path, max_count=0, remove=False, streaming=False, errors=None, partial_fetch=False):
+    """
+    Get content from a WET file path, yielding one record at a time (memory does not grow with the file size).
+    When the .gz file is parsed (streaming or without decompression), every record also gets the range of its
+    gzip member (WARC_Offset, WARC_Length), to fetch it again later (see recordreader.py).
 
-def save_content(dest: str, records: list):
+    Parameters:
+    - wet_path (str): WET file path to extract the content (a CommonCrawl WET path if streaming is enabled).
+    - max_count (int): Max number of responses to get from a WET path (default is 0).
+    - remove (bool): Wether you want to remove the .warc.wet file or not.
+    - streaming (bool): Parse the records while they are downloaded, without touching disk (default is False).
+    - errors (str): Path to the errors file, used only when streaming (default is None).
+    - partial_fetch (bool): When streaming, fetch only the leading byte ranges of the file needed to find max_count records (default is False).
+
+    Returns:
+    generator: The records found, as dictionaries (nothing is yielded in test mode).
+    """
+    for row in iter_text_rows(wet_path, max_count, remove, streaming, errors, partial_fetch):
+        yield dict(zip(CONTENT_COLUMNS, row))
+
+def get_text(wet_path, max_count=0, remove=False, streaming=False, errors=None, partial_fetch=False):
+    """
+    Get content from a WET file path.
+
+    Parameters:
+    - wet_path (str): WET file path to extract the content (a CommonCrawl WET path if streaming is enabled).
+    - max_count (int): Max number of responses to get from a WET path (default is 0).
+    - remove (bool): Wether you want to remove the .warc.wet file or not.
+    - streaming (bool): Parse the records while they are downloaded, without touching disk (default is False).
+    - errors (str): Path to the errors file, used only when streaming (default is None).
+    - partial_fetch (bool): When streaming, fetch only the leading byte ranges of the file needed to find max_count records (default is False).
+
+    Returns:
+    list: The list of records found.
+    """
+    return list(iter_text(wet_path, max_count, remove, streaming, errors, partial_fetch))
+
+def save_content(dest: str, records, output_format='csv'):
     """
-    Saves the content to a CSV file.
+    Saves the content to a CSV (or Parquet) file, flushing every BATCH_SIZE records.
 
     Parameters:
-    - dest (str): Path to save the CSV file.
-    - records (list): List of records found in a WET path.
+    - dest (str): Path to save the output file.
+    - records: List or generator of records found in a WET path, either dictionaries (see iter_text)
+      or rows (see iter_text_rows).
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+
+    Returns:
+    int: Number of records written.
     """
-    df = pd.DataFrame(records)
+    with open_sink(dest, CONTENT_COLUMNS, output_format) as sink:
+        # Time spent producing a batch is parsing, time spent in the sink is writing.
+        for batch in metrics.timed(batched(records, BATCH_SIZE), 'parse'):
+            with metrics.stage('write'):
+                if isinstance(batch[0], tuple):
+                    sink.write_rows(batch)
+                else:
+                    sink.write(batch)
+            metrics.count('records', len(batch))
 
-    df.to_csv(dest, index=False)
+    return sink.rows
 
-def process(path, dest_path, errors, max_count, decompression=True):
+def fetch(path, dest_path, errors, streaming=False, output_format='csv', manifest=None, resume=False):
     """
-    Runs a single pipeline process.
+    I/O stage of a pipeline process: downloads a WET path into the destination folder.
 
     Parameters:
-    - path (str): Path to the .warc.wet.gz file that contains WET paths (contained in warc.paths).
+    - path (str): Path to the .warc.wet.gz file (contained in wet.paths).
     - dest_path (str): Path to the destionation where you want to save all the process.
     - errors (str): Path to the errors file.
-    - max_count (int): Max number of responses to get from a WET path.
+    - streaming (bool): Skip the download, the WET file will be streamed by the parse stage.
+    - output_format (str): Format of the content files, used to skip already processed paths.
+    - manifest (Manifest): Manifest where the state of the path is recorded (default is None).
+    - resume (bool): Decide from the manifest whether the path is complete, instead of checking if its output exists.
+
+    Returns:
+    str: The WET path to parse, or None if it was already processed or the download failed.
     """
     path = path.strip()
-    out = path.split('/')
-    file = out[-1]
+    file = path.split('/')[-1]
     name = file.removesuffix('.warc.wet.gz')
 
-    if os.path.exists(f'{dest_path}/{name}.wet.csv'):
+    if resume and manifest is not None:
+        if manifest.is_written(path):
+            print(f'Skipping process for {name} since it was already written.')
+            return None
+
+        # Downloads are atomic, but the file could still be a leftover from another run.
+        entry = manifest.get(path)
+        local_file = f'{dest_path}/{file}'
+        if os.path.exists(local_file) and (entry is None or entry['download_size'] != os.path.getsize(local_file)):
+            os.remove(local_file)
+    elif os.path.exists(f'{dest_path}/{name}.wet{EXTENSIONS[output_format]}'):
         print(f'Skipping process for {name} since it already exists.')
-        return
+        return None
+
+    if manifest is not None: manifest.mark(path, QUEUED)
+
+    if streaming: return path
 
     print(f'Downloading {file}...')
-    download(path, dest_path, errors)
+    local_file = download(path, dest_path, errors)
+
+    if local_file is None:
+        if manifest is not None: manifest.mark(path, FAILED, error='download failed')
+        return None
+
+    if manifest is not None: manifest.mark(path, DOWNLOADED, download_size=os.path.getsize(local_file))
+
+    return path
+
+def parse(path, dest_path, errors, max_count, decompression=True, streaming=False, output_format='csv', manifest=None, partial_fetch=False,
+          decompress_threads=1, minhash=False):
+    """
+    CPU stage of a pipeline process: decompresses a fetched WET file, extracts its content and saves it.
+
+    Parameters:
+    - path (str): Path to the .warc.wet.gz file, as returned by fetch.
+    - dest_path (str): Path to the destionation where you want to save all the process.
+    - errors (str): Path to the errors file.
+    - max_count (int): Max number of responses to get from a WET path.
+    - streaming (bool): Parse the WET file while it is downloaded, skipping download and decompression to disk.
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+    - manifest (Manifest): Manifest where the state of the path is recorded (default is None).
+    - partial_fetch (bool): When streaming, fetch only the leading byte ranges needed to find max_count records (default is False).
+    - decompress_threads (int): Number of threads decompressing the file (default is 1, see inflate.iter_inflate).
+    - minhash (bool): Also write the MinHash signature of every record, keyed by WARC_Refers_To, to '<name>.minhash.npy' (see dedup.py).
 
-    new_file = None
-    if decompression:
-        print(f'Decompressing {file}...')
-        new_file = decompress_gz(f'{dest_path}/{file}', extract_path=dest_path, remove=True)
-    
-    print(f'Getting content from {name}...')
-    records = get_text(new_file or f'{dest_path}/{file}', max_count=max_count, remove=True)
+    Returns:
+    int: Number of records written.
+    """
+    file = path.split('/')[-1]
+    name = file.removesuffix('.warc.wet.gz')
+    output = f'{dest_path}/{name}.wet{EXTENSIONS[output_format]}'
 
+    if streaming:
+        records = iter_text_rows(path, max_count=max_count, streaming=True, errors=errors, partial_fetch=partial_fetch)
+    else:
+        new_file = None
+        if decompression:
+            print(f'Decompressing {file}...')
+            new_file = decompress_gz(f'{dest_path}/{file}', extract_path=dest_path, remove=True, num_threads=decompress_threads)
+
+        records = iter_text_rows(new_file or f'{dest_path}/{file}', max_count=max_count, remove=True)
+
+    # Records are extracted lazily, while the sink writes them in batches.
     if not TEST_PATH:
-        print(f'Saving content from {name}...')
-        save_content(f'{dest_path}/{name}.wet.csv', records)
+        print(f'Getting and saving content from {name}...')
+        if minhash:
+            from dedup import SignatureWriter, SIGNATURE_SUFFIX
+
+            # Signatures are keyed by the WARC response record, like the metadata outputs.
+            with SignatureWriter(f'{dest_path}/{name}{SIGNATURE_SUFFIX}') as signatures:
+                count = save_content(output, signatures.track(records, id_index=2, text_index=4), output_format)
+        else:
+            count = save_content(output, records, output_format)
+
+        if manifest is not None:
+            manifest.mark(path, WRITTEN, records=count, output=output,
+                          size=os.path.getsize(output), checksum=file_checksum(output))
+
         print(f'Done writing content from {name}')
+        return count
     else:
+        for _ in records: pass
         print(f'Done testing for {name}')
 
-def run_pipeline(paths_file: str, dest_path='', errors=None, max_count=0, num_workers=1, decompression=True):
+def process(path, dest_path, errors, max_count, decompression=True, streaming=False, output_format='csv'):
+    """
+    Runs a single pipeline process (fetch and parse stages in the calling thread).
+
+    Parameters:
+    - path (str): Path to the .warc.wet.gz file that contains WET paths (contained in warc.paths).
+    - dest_path (str): Path to the destionation where you want to save all the process.
+    - errors (str): Path to the errors file.
+    - max_count (int): Max number of responses to get from a WET path.
+    - streaming (bool): Parse the WET file while it is downloaded, skipping download and decompression to disk.
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+    """
+    path = fetch(path, dest_path, errors, streaming, output_format)
+    if path is None: return
+
+    parse(path, dest_path, errors, max_count, decompression, streaming, output_format)
+
+def run_pipeline(paths_file: str, dest_path='', errors=None, max_count=0, num_workers=1, decompression=True, streaming=False,
+                 num_downloaders=None, prefetch=1, output_format='csv', resume=False, metrics_interval=None, metrics_port=None,
+                 partial_fetch=False, coordinator=None, shard=None, decompress_threads=None, minhash=False):
     """
     Runs the whole extraction pipeline.
 
@@ -128,34 +297,105 @@ def run_pipeline(paths_file: str, dest_path='', errors=None, max_count=0, num_wo
     - dest_path (str): Destination path to save all the process (defaults to the current directory).
     - errors (str): Path to the errors file (defaults to None, that means no errors file)
     - max_count (int): Max number of responses to get from a WET path (default is 0).
-    - num_workers (int): Number of workers to run the pipeline (default is 1).
+    - num_workers (int): Number of worker processes parsing WET files (default is 1).
+    - streaming (bool): Parse WET files while they are downloaded, without temporary files (default is False).
+    - num_downloaders (int): Number of download threads (defaults to num_workers).
+    - prefetch (int): Number of WET files downloaded ahead of the parsing workers (default is 1, none with a coordinator).
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+    - resume (bool): Restart only the paths that the manifest does not record as written (default is False).
+    - metrics_interval (float): Print the pipeline metrics as a JSON line every metrics_interval seconds, and a JSON
+      line with the stages of every finished file (default is None, that means no metrics are printed).
+    - metrics_port (int): Serve the pipeline metrics at http://127.0.0.1:<metrics_port>/metrics in the Prometheus
+      text format (default is None).
+    - partial_fetch (bool): Stream every WET file fetching only the leading byte ranges needed to find max_count
+      records, in Range requests of growing size (default is False). Requires max_count.
+    - coordinator (Coordinator): Coordinator handing out the paths to the nodes running this job (see coordinator.py).
+      Every path of paths_file is added to it, and this node only processes the paths it leases (default is None).
+    - shard (tuple): (shard_id, num_shards) to process only the paths of one shard, without a coordinator (default is None).
+    - decompress_threads (int): Number of threads decompressing every WET file, see inflate.py (default is 1).
+    - minhash (bool): Also write the MinHash signatures of the records of every WET file, to find near-duplicates
+      across files with dedup.py (default is False).
     """
+    # Partial fetches are streamed, nothing is downloaded to disk.
+    streaming = streaming or partial_fetch
+    # The workers already use the CPUs, more threads only when asked for (see WINDOW_SIZE in inflate.py).
+    decompress_threads = decompress_threads or 1
+    manifest = Manifest(f'{dest_path or "."}/{MANIFEST_FILE}')
+
+    queue = PathQueue(paths_file, coordinator, shard)
+    monitor = PipelineMetrics(queue.total, num_workers, log_files=metrics_interval is not None)
+
+    def on_done(path, result, error):
+        skipped = result is None and error is None
+        result, record = result if result is not None else (None, None)
+        monitor.file_done(path, record, error, skipped)
+
+        # A failed download is finished as skipped, its error is in the manifest.
+        entry = manifest.get(path) if skipped else None
+        queue.done(path, error if entry is None or entry['state'] != FAILED else entry['error'])
+
+        if error is not None:
+            manifest.mark(path, FAILED, error=str(error))
+            print(f"Error: {error}")
+            return
+
+        print(monitor.progress())
+
+    if metrics_interval is not None: monitor.start_reporter(metrics_interval)
+    if metrics_port is not None: monitor.serve(metrics_port)
+
     try:
-        with open(paths_file, 'r') as file:
-            while True:
-                batch = list(islice(file, num_workers))
-                if not batch: break
-
-                workers = []
-                for line in batch:
-                    worker = threading.Thread(target=process, args=(line, dest_path, errors, max_count, decompression))
-                    workers.append(worker)
-                    worker.start()
-
-                for work in workers: work.join()
+        # With a coordinator, another round starts when paths leased by a node that stopped become claimable again.
+        for paths in queue.rounds():
+            run_scheduler(paths,
+                          work=partial(instrumented, partial(parse, dest_path=dest_path, errors=errors, max_count=max_count,
+                                                             decompression=decompression, streaming=streaming, output_format=output_format,
+                                                             manifest=manifest, partial_fetch=partial_fetch, decompress_threads=decompress_threads,
+                                                             minhash=minhash)),
+                          fetch=partial(monitor.fetch, partial(fetch, dest_path=dest_path, errors=errors, streaming=streaming,
+                                                               output_format=output_format, manifest=manifest, resume=resume)),
+                          num_workers=num_workers, num_fetchers=num_downloaders or num_workers,
+                          prefetch=queue.prefetch(prefetch), on_done=on_done, on_state=monitor.set_queues)
     except Exception as e:
         print(f'[Pipeline] An error ocurred: {e}')
+    finally:
+        queue.close()
+        monitor.close()
 
 
 if __name__ == "__main__":
+    from client import configure_client
+    from cache import configure_cache, DEFAULT_SIZE
+    from coordinator import open_coordinator, DEFAULT_LEASE
+
     parser = argparse.ArgumentParser(description='Get all metadata from WARC files from CommonCrawl.')
 
     parser.add_argument('wetpaths', help="'wet.paths' file.")
     parser.add_argument('dest', help='Folder path to save content.')
     parser.add_argument('--num_responses', help='Number of responses to save per record (default is no limit).', required=False)
-    parser.add_argument('--num_workers', help='Number of workers to process the pipeline (default is 1).', required=False)
+    parser.add_argument('--num_workers', help='Number of worker processes to process the pipeline (default is 1).', required=False)
+    parser.add_argument('--num_downloaders', help='Number of download threads (default is num_workers).', required=False)
+    parser.add_argument('--prefetch', help='Number of WET files downloaded ahead of the workers (default is 1).', required=False)
     parser.add_argument('--errors_file', help='File to save which files failed while processing.', required=False)
     parser.add_argument('--without_decompression', help='Removes decompression from pipeline.', action='store_true')
+    parser.add_argument('--decompress_threads', help='Number of threads decompressing every WET file (default is 1).', required=False)
+    parser.add_argument('--minhash', help="Writes the MinHash signatures of the records of every WET file ('<name>.minhash.npy'), to find near-duplicates with dedup.py.", action='store_true')
+    parser.add_argument('--streaming', help='Parses WET files while downloading them, without writing them to disk.', action='store_true')
+    parser.add_argument('--partial_fetch', help='With --num_responses, fetches only the first byte ranges of every WET file needed to find them.', action='store_true')
+    parser.add_argument('--output_format', help='Format of the content files (default is csv).', choices=list(EXTENSIONS), default='csv')
+    parser.add_argument('--max_connections', help='Max number of simultaneous HTTP requests per process (default is 16).', required=False)
+    parser.add_argument('--max_retries', help='Max number of retries per request or dropped connection (default is 5).', required=False)
+    parser.add_argument('--cache_dir', help='Folder of a download cache shared by every run on this machine (default is no cache).', required=False)
+    parser.add_argument('--cache_size', help=f'Size budget of the download cache in GiB (default is {DEFAULT_SIZE}).', required=False)
+    parser.add_argument('--verify_cache', help='Checks the SHA-1 of every cached file before using it, not only its size (reads it once more).', action='store_true')
+    parser.add_argument('--metrics_interval', help='Prints the pipeline metrics as JSON lines every N seconds (and one line per finished file).', required=False)
+    parser.add_argument('--metrics_port', help='Serves the pipeline metrics in the Prometheus text format at http://127.0.0.1:<port>/metrics.', required=False)
+    parser.add_argument('--resume', help='Restarts only the WET paths that the manifest does not record as written.', action='store_true')
+    parser.add_argument('--coordinator', help='Coordinator shared by the nodes running this job: a SQLite file on a shared file system, or a redis:// URL (default is no coordinator).', required=False)
+    parser.add_argument('--job', help='Name of the job in the coordinator, the same on every node (default is text).', required=False)
+    parser.add_argument('--lease', help=f'Seconds a WET path stays leased to a node without news from it (default is {DEFAULT_LEASE}).', required=False)
+    parser.add_argument('--shard_id', help='Processes only the WET paths of this shard (from 0 to --num_shards - 1), without a coordinator.', required=False)
+    parser.add_argument('--num_shards', help='Number of shards the WET paths are split into with --shard_id.', required=False)
     parser.add_argument('--test', help='Activates test mode. This option disables saving and only check if WARC_Refers_To fields (WET) match WARC-Record-ID in WARC files. Requires a path folder containing WARC CSV files.', required=False)
 
     args = parser.parse_args()
@@ -164,9 +404,31 @@ if __name__ == "__main__":
     dest = args.dest
     num_responses = int(args.num_responses) if args.num_responses != None else 0
     num_workers = int(args.num_workers) if args.num_workers != None else 1
+    num_downloaders = int(args.num_downloaders) if args.num_downloaders != None else None
+    prefetch = int(args.prefetch) if args.prefetch != None else 1
+
+    configure_client(max_connections=int(args.max_connections) if args.max_connections != None else 16,
+                     max_retries=int(args.max_retries) if args.max_retries != None else 5)
+    if args.cache_dir != None:
+        configure_cache(args.cache_dir, float(args.cache_size) if args.cache_size != None else DEFAULT_SIZE,
+                        verify=args.verify_cache)
     errors_file = args.errors_file
     without_decompression = args.without_decompression
     TEST_PATH = args.test
 
+    if args.partial_fetch and num_responses == 0: parser.error('--partial_fetch requires --num_responses')
+
+    if (args.shard_id != None) != (args.num_shards != None): parser.error('--shard_id and --num_shards must be used together')
+    if args.shard_id != None and args.coordinator != None: parser.error('--shard_id cannot be used with --coordinator')
+    shard = (int(args.shard_id), int(args.num_shards)) if args.shard_id != None else None
+    coordinator = open_coordinator(args.coordinator, job=args.job or 'text',
+                                   lease_seconds=float(args.lease) if args.lease != None else DEFAULT_LEASE) if args.coordinator != None else None
+
     run_pipeline(wetpaths, dest_path=dest, errors=errors_file, max_count=num_responses,
-                 num_workers=num_workers, decompression=not without_decompression)
+                 num_workers=num_workers, decompression=not without_decompression, streaming=args.streaming,
+                 num_downloaders=num_downloaders, prefetch=prefetch, output_format=args.output_format, resume=args.resume,
+                 metrics_interval=float(args.metrics_interval) if args.metrics_interval != None else None,
+                 metrics_port=int(args.metrics_port) if args.metrics_port != None else None,
+                 partial_fetch=args.partial_fetch, coordinator=coordinator, shard=shard,
+                 decompress_threads=int(args.decompress_threads) if args.decompress_threads != None else None,
+                 minhash=args.minhash)
@@ -0,0 +1,212 @@
+import os
+import re
+from html import unescape
+from functools import lru_cache
+from utils import extract_tags, get_domain_from_url, intern_value, _wide_charsets
+import metrics
+
+# Where the value of a field comes from.
+WARC_HEADER = 'warc'       # a WARC header (exact name)
+HTTP_HEADER = 'http'       # an HTTP header (name in any case)
+HTML_TAG = 'html'          # an attribute of the <html> start tag (see utils.extract_tags)
+HEAD_ELEMENT = 'head'      # <title> or <meta name=description> (see extract_head)
+RECORD = 'record'          # a value known by the parser (file name, record ID, charset, payload length without HTTP headers)
+DOMAIN = 'domain'          # top-level domain of WARC-Target-URI
+
+# Fields that can be extracted from every HTML response: (source, key, interned). Interned fields have few
+# distinct values (see utils.intern_value). Any other header is requested as 'warc:<Name>' or 'http:<Name>'.
+FIELDS = {
+    'WARC_File': (RECORD, 'file', False),
+    'WARC_Record_ID': (RECORD, 'record_id', False),
+    'WARC_Target_URI': (WARC_HEADER, 'WARC-Target-URI', False),
+    'WARC_Date': (WARC_HEADER, 'WARC-Date', False),
+    'Domain': (DOMAIN, 'WARC-Target-URI', True),
+    'Content_Language': (HTTP_HEADER, 'content-language', True),
+    'Server': (HTTP_HEADER, 'server', True),
+    'Last_Modified': (HTTP_HEADER, 'last-modified', False),
+    'Charset': (RECORD, 'charset', True),
+    'Payload_Length': (RECORD, 'payload_length', False),
+    'HTML_Language': (HTML_TAG, 'lang', True),
+    'HTML_Dir': (HTML_TAG, 'dir', True),
+    'HTML_Title': (HEAD_ELEMENT, 'title', False),
+    'HTML_Description': (HEAD_ELEMENT, 'description', False),
+}
+
+# Fields of the metadata outputs when no plan is given (see extract_metadata.METADATA_COLUMNS).
+DEFAULT_FIELDS = [
+    'WARC_File', 'WARC_Record_ID', 'WARC_Target_URI', 'Domain',
+    'Content_Language', 'HTML_Language', 'HTML_Dir'
+]
+
+# <title> and <meta> start tags of the head, found in a single scan of the payload window.
+_head_element = re.compile(rb'<title(?:\s[^>]*)?>([^<]*)|<meta\s([^>]*)>', re.IGNORECASE)
+_meta_attribute = re.compile(rb"""([\w:-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+
+def extract_head(html_xml: bytes, elements: list, charset) -> dict:
+    """
+    Extracts the title and/or the description (<meta name="description" content="...">) of an HTML payload.
+    Like extract_tags, the bytes are scanned once without parsing nor decoding them, and only the values
+    found are decoded (entities unescaped and whitespace collapsed).
+
+    Parameters:
+    - html_xml (bytes): Usually the first bytes of the payload.
+    - elements (list): Elements to be extracted ('title' and/or 'description').
+    - charset: Encoding of the payload.
+
+    Returns:
+    dict: The value of every requested element, or None if it was not found.
+    """
+    if charset.lower() in _wide_charsets:
+        html_xml, charset = html_xml.decode(charset, errors='replace').encode('utf-8'), 'utf-8'
+
+    found = {}
+    for match in _head_element.finditer(html_xml):
+        title, meta = match.groups()
+        if title is not None:
+            found.setdefault('title', title)
+        else:
+            attributes = {name.lower(): a or b or c for name, a, b, c in _meta_attribute.findall(meta)}
+            if attributes.get(b'name', b'').lower() == b'description' and b'content' in attributes:
+                found.setdefault('description', attributes[b'content'])
+
+        if len(found) == len(elements): break
+
+    result = {}
+    for element in elements:
+        value = found.get(element)
+        if value is not None:
+            value = ' '.join(unescape(value.decode(charset, errors='replace')).split()) or None
+        result[element] = value
+
+    return result
+
+def field_source(name: str) -> tuple:
+    """
+    Returns where a field comes from, (source, key, interned), see FIELDS. 'warc:<Name>' and 'http:<Name>'
+    request any WARC or HTTP header.
+    """
+    if name in FIELDS: return FIELDS[name]
+
+    source, _, header = name.partition(':')
+    if header and source.lower() == WARC_HEADER: return (WARC_HEADER, header, False)
+    if header and source.lower() == HTTP_HEADER: return (HTTP_HEADER, header.lower(), False)
+
+    raise ValueError(f"Unknown field '{name}'. Available fields are {list(FIELDS)}, or any header as 'warc:<Name>' or 'http:<Name>'.")
+
+def column_name(name: str) -> str:
+    """
+    Returns the output column of a field: its own name, or the header name with '_' instead of '-'
+    (e.g. 'http:X-Powered-By' is written as 'X_Powered_By', like Content-Language as Content_Language).
+    """
+    return name if name in FIELDS else name.partition(':')[2].replace('-', '_')
+
+def read_fields(value: str) -> list:
+    """
+    Reads the fields of a plan from a comma-separated list or from a file listing them (one or more per
+    line, comma-separated, '#' starting a comment).
+    """
+    if os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8') as file:
+            value = ','.join(line.split('#')[0] for line in file)
+
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+class ExtractionPlan:
+    """
+    Fields extracted from every HTML response, compiled once: the headers they need are grouped by source,
+    so a record is read in a single pass over its WARC headers, a single pass over its HTTP headers and a
+    single read of the first bytes of its payload (only if an HTML field is requested), however many
+    fields there are.
+
+    Parameters:
+    - fields (list): Names of the fields (see FIELDS), in the order of the output columns.
+    """
+    def __init__(self, fields: list):
+        self.fields = list(fields)
+        self.columns = [column_name(name) for name in self.fields]
+        if len(set(self.columns)) != len(self.columns):
+            raise ValueError(f'Repeated fields in {self.fields}.')
+
+        self.slots = [field_source(name) for name in self.fields]
+        self.warc_headers = {key for source, key, _ in self.slots if source in (WARC_HEADER, DOMAIN)}
+        self.http_headers = {key for source, key, _ in self.slots if source == HTTP_HEADER}
+        self.tags = [key for source, key, _ in self.slots if source == HTML_TAG]
+        self.head = [key for source, key, _ in self.slots if source == HEAD_ELEMENT]
+
+    def extract(self, record, warc: str, window: int) -> tuple:
+        """
+        Extracts the fields of an HTML response (a fastwarc WarcRecord whose HTTP headers are parsed).
+
+        Parameters:
+        - record (WarcRecord): Record being read.
+        - warc (str): Name of the WARC file.
+        - window (int): Number of payload bytes scanned for HTML fields.
+
+        Returns:
+        tuple: The value of every field, in order.
+        """
+        warc_values = {}
+        if self.warc_headers:
+            wanted = self.warc_headers
+            for name, value in record.headers:
+                if name in wanted: warc_values.setdefault(name, value)
+
+        http_values = {}
+        if self.http_headers:
+            wanted = self.http_headers
+            for name, value in record.http_headers:
+                name = name.lower()
+                if name in wanted: http_values.setdefault(name, value)
+
+        tags = head = None
+        if self.tags or self.head:
+            content = record.reader.read(window)
+            charset = record.http_charset or 'utf-8'
+            with metrics.stage('tags'):
+                if self.tags: tags = extract_tags(content, self.tags, charset)
+                if self.head: head = extract_head(content, self.head, charset)
+
+        row = []
+        for source, key, interned in self.slots:
+            if source == WARC_HEADER:
+                value = warc_values.get(key)
+            elif source == HTTP_HEADER:
+                value = http_values.get(key)
+            elif source == HTML_TAG:
+                value = tags[key]
+            elif source == HEAD_ELEMENT:
+                value = head[key]
+            elif source == DOMAIN:
+                uri = warc_values.get(key)
+                value = get_domain_from_url(uri).split('.')[-1] if uri is not None else None
+            elif key == 'file':
+                value = warc
+            elif key == 'record_id':
+                value = record.record_id
+            elif key == 'charset':
+                value = record.http_charset
+            else:
+                # The WARC Content-Length is the whole block (HTTP headers included), but once the HTTP headers
+                # are parsed fastwarc counts only the bytes left after them: the payload.
+                if record.http_headers is None: record.parse_http()
+                value = str(record.content_length)
+
+            row.append(intern_value(value) if interned else value)
+
+        return tuple(row)
+
+@lru_cache(maxsize=None)
+def _compile(fields: tuple) -> ExtractionPlan:
+    return ExtractionPlan(fields)
+
+def compile_plan(fields=None) -> ExtractionPlan:
+    """
+    Returns the extraction plan of some fields, compiled once per process.
+
+    Parameters:
+    - fields (list): Names of the fields (default is DEFAULT_FIELDS).
+
+    Returns:
+    ExtractionPlan: The compiled plan.
+    """
+    return _compile(tuple(fields or DEFAULT_FIELDS))
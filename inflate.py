@@ -0,0 +1,193 @@
+import os
+import zlib
+import importlib
+from collections import deque
+
+# Faster drop-in replacements of the zlib module, used when installed (pip install zlib-ng or isal).
+BACKENDS = ['zlib_ng.zlib_ng', 'isal.isal_zlib']
+
+# Compressed bytes read from the file at a time.
+READ_SIZE = 1 << 20
+
+# Compressed bytes fed to the inflater at a time. Every finished member copies what is left of its input,
+# and members of CommonCrawl files are a few KB, so small slices keep that copy small.
+FEED_SIZE = 1 << 14
+
+# Compressed bytes inflated by a thread at a time: the file is split at the first member after every multiple.
+CHUNK_SIZE = 1 << 23
+
+# Compressed bytes inflated ahead of the output (about 5 times as much once inflated, held in memory). With
+# many threads, chunks are made smaller so that the threads still have 2 chunks each within this budget.
+WINDOW_SIZE = 1 << 25
+
+# Bytes searched after every multiple of CHUNK_SIZE for the start of a member.
+SCAN_SIZE = 1 << 20
+
+# First bytes of a gzip member (magic number and deflate method).
+GZIP_MAGIC = b'\x1f\x8b\x08'
+
+_backend = None
+
+def inflate_backend():
+    """
+    Returns the module used to inflate: the first installed module of BACKENDS, or zlib.
+    """
+    global _backend
+    if _backend is None:
+        for name in BACKENDS:
+            try:
+                _backend = importlib.import_module(name)
+                break
+            except ImportError:
+                continue
+        else:
+            _backend = zlib
+
+    return _backend
+
+def _is_member(window: bytes, i: int, at_end: bool, backend) -> bool:
+    # A member starts at i if it inflates completely (its CRC is checked by the inflater) and is followed
+    # by another member or by the end of the file.
+    if i + 3 >= len(window) or window[i + 3] & 0xE0: return False
+    inflater = backend.decompressobj(31)
+    try:
+        inflater.decompress(memoryview(window)[i:])
+    except backend.error:
+        return False
+
+    return inflater.eof and (inflater.unused_data.startswith(GZIP_MAGIC) or (at_end and not inflater.unused_data))
+
+def find_member_starts(fd: int, size: int, chunk_size=CHUNK_SIZE, backend=None) -> list:
+    """
+    Finds where to split a multi-member gzip file: the first member starting after every multiple of chunk_size.
+    Nothing is inflated except the members probed, so it only reads a window per split point.
+
+    Parameters:
+    - fd (int): File descriptor of the .gz file.
+    - size (int): Size of the file.
+    - chunk_size (int): Approximate number of compressed bytes between two split points (default is CHUNK_SIZE).
+    - backend: Module used to inflate (default is inflate_backend()).
+
+    Returns:
+    list: Offsets of member starts, in order, starting with 0. A file with a single member (or with members
+    larger than SCAN_SIZE) is not split.
+    """
+    backend = backend or inflate_backend()
+    starts = [0]
+    for target in range(chunk_size, size, chunk_size):
+        if target <= starts[-1]: continue
+
+        window = os.pread(fd, SCAN_SIZE, target)
+        at_end = target + len(window) >= size
+        i = window.find(GZIP_MAGIC)
+        while i != -1 and not _is_member(window, i, at_end, backend):
+            i = window.find(GZIP_MAGIC, i + 1)
+
+        if i != -1: starts.append(target + i)
+
+    return starts
+
+def _inflate(fd: int, start: int, end: int, backend):
+    # Inflates the members starting at 'start' until one starts at or after 'end', yielding the output as it
+    # comes and returning where the next member starts. If 'end' is not a member start, the last member goes on after it.
+    position = start
+    data, base = b'', start
+    offset = 0
+    while position < end:
+        if offset >= len(data):
+            data, base, offset = os.pread(fd, READ_SIZE, position), position, 0
+            if not data: break
+
+        # Files may be padded with zeros after the last member.
+        if data[offset] == 0:
+            padding = len(data) - offset - len(data[offset:].lstrip(b'\x00'))
+            offset += padding
+            position += padding
+            continue
+
+        inflater = backend.decompressobj(31)
+        while not inflater.eof:
+            if offset >= len(data):
+                data, base, offset = os.pread(fd, READ_SIZE, base + len(data)), base + len(data), 0
+                if not data: raise EOFError('Compressed file ended before the end-of-stream marker was reached')
+
+            piece = memoryview(data)[offset:offset + FEED_SIZE]
+            output = inflater.decompress(piece)
+            if output: yield output
+            offset += len(piece)
+
+        offset -= len(inflater.unused_data)
+        position = base + offset
+
+    return position
+
+def _inflate_chunk(fd: int, start: int, end: int, backend) -> tuple:
+    chunks = []
+    inflating = _inflate(fd, start, end, backend)
+    while True:
+        try:
+            chunks.append(next(inflating))
+        except StopIteration as stop:
+            return chunks, stop.value
+
+def _window(num_threads: int, chunk_size: int, window_size: int) -> tuple:
+    # Size of the chunks and number of chunks inflated ahead, so that at most window_size compressed bytes are.
+    chunk_size = max(1, min(chunk_size, window_size // (2 * num_threads)))
+    return chunk_size, max(1, min(2 * num_threads, window_size // chunk_size))
+
+def iter_inflate(file_path: str, num_threads=1, chunk_size=CHUNK_SIZE, window_size=WINDOW_SIZE):
+    """
+    Inflates a gzip file, yielding its output in order. CommonCrawl files are concatenated gzip members (one
+    per record), so with several threads the file is split at member starts (see find_member_starts) and the
+    chunks are inflated at the same time (the inflater releases the GIL), at most window_size compressed bytes
+    ahead of the chunk being yielded (see WINDOW_SIZE), so memory does not grow with the number of threads. A
+    split point that turns out not to be a member start is inflated again from the end of the previous chunk,
+    so the output is always the same as inflating the file from start to end.
+
+    Parameters:
+    - file_path (str): .gz file (single or multi-member).
+    - num_threads (int): Number of threads inflating chunks (default is 1, that means no split).
+    - chunk_size (int): Approximate number of compressed bytes per chunk (default is CHUNK_SIZE, smaller if
+      2 * num_threads chunks do not fit in window_size).
+    - window_size (int): Max number of compressed bytes inflated ahead of the output (default is WINDOW_SIZE).
+
+    Returns:
+    generator: Inflated bytes, in order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    backend = inflate_backend()
+    chunk_size, ahead = _window(num_threads, chunk_size, window_size)
+    with open(file_path, 'rb') as file:
+        fd = file.fileno()
+        size = os.fstat(fd).st_size
+        starts = find_member_starts(fd, size, chunk_size, backend) if num_threads > 1 else [0]
+
+        if len(starts) == 1:
+            yield from _inflate(fd, 0, size, backend)
+            return
+
+        chunks = iter(zip(starts, starts[1:] + [size]))
+        with ThreadPoolExecutor(max_workers=num_threads) as pool:
+            window = deque()
+            def submit():
+                for start, end in chunks:
+                    window.append((start, end, pool.submit(_inflate_chunk, fd, start, end, backend)))
+                    return
+
+            for _ in range(ahead): submit()
+
+            position = 0
+            while window:
+                start, end, future = window.popleft()
+                submit()
+
+                if start == position:
+                    output, position = future.result()
+                    yield from output
+                elif position < end:
+                    # The chunk did not start at a member, or the previous one went past its end.
+                    future.exception()
+                    position = yield from _inflate(fd, position, end, backend)
+                else:
+                    future.exception()
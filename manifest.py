@@ -0,0 +1,117 @@
+import sqlite3
+import hashlib
+import time
+import os
+
+# States a path goes through. Only 'written' means that its output is complete.
+QUEUED = 'queued'
+DOWNLOADED = 'downloaded'
+WRITTEN = 'written'
+FAILED = 'failed'
+
+def file_checksum(file_path: str, chunk_size=1 << 20) -> str:
+    """
+    Computes the SHA-1 checksum of a file, reading it in chunks.
+
+    Parameters:
+    - file_path (str): File to hash.
+    - chunk_size (int): Number of bytes read at a time (default is 1 MiB).
+
+    Returns:
+    str: Hexadecimal digest.
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        while chunk := file.read(chunk_size):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+class Manifest:
+    """
+    Durable record of the state of every path of a pipeline run, stored in a SQLite database.
+    Every call opens its own short-lived connection, so the same Manifest can be used from the
+    download threads and from the worker processes at the same time.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS paths (
+                    path TEXT PRIMARY KEY,
+                    state TEXT NOT NULL,
+                    download_size INTEGER,
+                    size INTEGER,
+                    records INTEGER,
+                    checksum TEXT,
+                    output TEXT,
+                    error TEXT,
+                    updated REAL
+                )
+            """)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=60)
+        conn.execute('PRAGMA journal_mode=WAL')
+        return conn
+
+    def mark(self, path: str, state: str, **fields):
+        """
+        Updates the state of a path (and optionally its download_size, size, records, checksum, output or error).
+        'size' and 'checksum' always refer to the output file.
+
+        Parameters:
+        - path (str): Path from warc.paths (or wet.paths).
+        - state (str): New state (QUEUED, DOWNLOADED, WRITTEN or FAILED).
+        """
+        path = path.strip()
+        fields = {'state': state, 'updated': time.time(), **fields}
+        columns = ', '.join(fields)
+        placeholders = ', '.join('?' for _ in fields)
+        updates = ', '.join(f'{column}=excluded.{column}' for column in fields)
+
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f'INSERT INTO paths (path, {columns}) VALUES (?, {placeholders}) '
+                             f'ON CONFLICT(path) DO UPDATE SET {updates}', (path, *fields.values()))
+        finally:
+            conn.close()
+
+    def get(self, path: str) -> dict:
+        """
+        Returns the stored entry of a path as a dictionary, or None if the path was never seen.
+        """
+        conn = self._connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute('SELECT * FROM paths WHERE path = ?', (path.strip(),)).fetchone()
+        finally:
+            conn.close()
+
+        return dict(row) if row is not None else None
+
+    def is_written(self, path: str) -> bool:
+        """
+        Returns whether a path was completely written and its output file is still there, unchanged in size.
+        """
+        entry = self.get(path)
+        if entry is None or entry['state'] != WRITTEN: return False
+
+        output = entry['output']
+        return output is not None and os.path.exists(output) and os.path.getsize(output) == entry['size']
+
+    def counts(self) -> dict:
+        """
+        Returns the number of paths in every state.
+        """
+        conn = self._connect()
+        try:
+            return dict(conn.execute('SELECT state, COUNT(*) FROM paths GROUP BY state').fetchall())
+        finally:
+            conn.close()
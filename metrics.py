@@ -0,0 +1,323 @@
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Stages reported for every file. Time outside them (e.g. updating the manifest) is only part of the file total.
+STAGES = ['download', 'decompress', 'parse', 'tags', 'minhash', 'write']
+
+_local = threading.local()
+
+class FileRecord:
+    """
+    Time spent in every stage and counters (bytes, records) of a single file. Stages are exclusive:
+    while a nested stage runs (e.g. 'tags' inside 'parse'), the outer one is paused.
+    """
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self._stack = []
+        self._mark = None
+
+    def enter(self, name: str):
+        now = time.perf_counter()
+        if self._stack:
+            self.stages[self._stack[-1]] = self.stages.get(self._stack[-1], 0.0) + now - self._mark
+        self._stack.append(name)
+        self._mark = now
+
+    def exit(self):
+        now = time.perf_counter()
+        name = self._stack.pop()
+        self.stages[name] = self.stages.get(name, 0.0) + now - self._mark
+        self._mark = now
+
+    def to_dict(self) -> dict:
+        return {'stages': self.stages, 'counters': self.counters}
+
+class _NullStage:
+    def __enter__(self): pass
+    def __exit__(self, *exc): pass
+
+_null_stage = _NullStage()
+
+class _Stage:
+    __slots__ = ('record', 'name')
+
+    def __init__(self, record: FileRecord, name: str):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.record.enter(self.name)
+
+    def __exit__(self, *exc):
+        self.record.exit()
+
+def stage(name: str):
+    """
+    Context manager timing a stage of the file being processed by the current thread.
+    Outside of record_file it does nothing, so instrumented code costs almost nothing when unused.
+    """
+    record = getattr(_local, 'record', None)
+    return _Stage(record, name) if record is not None else _null_stage
+
+def count(name: str, value=1):
+    """
+    Adds value to a counter (e.g. 'records' or 'download_bytes') of the file being processed by the current thread.
+    """
+    record = getattr(_local, 'record', None)
+    if record is not None: record.counters[name] = record.counters.get(name, 0) + value
+
+def timed(iterable, name: str):
+    """
+    Iterates over an iterable timing every step (e.g. a record generator) as the stage 'name'.
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+@contextmanager
+def record_file():
+    """
+    Records the stages and counters of the code run inside it (in the current thread).
+
+    Returns:
+    FileRecord: The record being filled.
+    """
+    previous = getattr(_local, 'record', None)
+    record = FileRecord()
+    _local.record = record
+    begin = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.stages['total'] = time.perf_counter() - begin
+        _local.record = previous
+
+def instrumented(func, *args, **kwargs) -> tuple:
+    """
+    Runs func recording its stages. Used to wrap the pipeline stages, e.g. in worker processes,
+    so that their record travels back to the parent process with the result.
+
+    Returns:
+    tuple: The result of func and its record as a dictionary.
+    """
+    with record_file() as record:
+        result = func(*args, **kwargs)
+
+    return result, record.to_dict()
+
+def count_paths(paths_file: str) -> int:
+    """
+    Returns the number of (non-empty) paths in a paths file.
+    """
+    with open(paths_file, 'rb') as file:
+        return sum(1 for line in file if line.strip())
+
+class PipelineMetrics:
+    """
+    Live metrics of a pipeline run, kept in the parent process: totals per stage, bytes and records,
+    files done/failed/skipped, queue depths and worker utilization, throughput and ETA. They can be
+    printed as periodic JSON lines and/or served in the Prometheus text format.
+
+    Parameters:
+    - total_files (int): Number of paths of the run (e.g. count_paths('warc.paths')).
+    - num_workers (int): Number of worker processes (used for the utilization).
+    - log_files (bool): Print a JSON line with the record of every finished file (default is False).
+    - stream: Where JSON lines are printed (default is sys.stdout).
+    """
+    def __init__(self, total_files: int, num_workers=1, log_files=False, stream=None):
+        self.total_files = total_files
+        self.num_workers = num_workers
+        self.log_files = log_files
+        self.stream = stream or sys.stdout
+
+        self.begin = time.time()
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.stages = {name: 0.0 for name in STAGES}
+        self.counters = {}
+        self.queues = {'fetching': 0, 'ready': 0, 'working': 0}
+        self.busy_seconds = 0.0
+
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._reporter = None
+        self._stop = threading.Event()
+        self._server = None
+
+    def _merge(self, record: dict):
+        for name, seconds in record['stages'].items():
+            if name != 'total': self.stages[name] = self.stages.get(name, 0.0) + seconds
+        for name, value in record['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def fetch(self, func, path, *args, **kwargs):
+        """
+        Runs the fetch stage of a path (in the calling thread) recording its stages.
+        """
+        with record_file() as record:
+            result = func(path, *args, **kwargs)
+
+        with self._lock:
+            self._pending[path] = record.to_dict()
+
+        return result
+
+    def set_queues(self, fetching: int, ready: int, working: int):
+        self.queues = {'fetching': fetching, 'ready': ready, 'working': working}
+
+    def file_done(self, path, record=None, error=None, skipped=False):
+        """
+        Adds a finished path (with the record returned by its work stage, if any).
+        """
+        with self._lock:
+            fetch_record = self._pending.pop(path, None)
+            for r in (fetch_record, record):
+                if r is not None: self._merge(r)
+            if record is not None: self.busy_seconds += record['stages'].get('total', 0.0)
+
+            # A fetch stage that returns nothing skips the path, unless its download failed.
+            if skipped and fetch_record is not None and fetch_record['counters'].get('download_errors'):
+                skipped = False
+                error = 'download failed'
+
+            if error is not None:
+                self.failed += 1
+            elif skipped:
+                self.skipped += 1
+            else:
+                self.done += 1
+
+        if self.log_files and not skipped:
+            stages = {**(fetch_record or {}).get('stages', {}), **(record or {}).get('stages', {})}
+            stages.pop('total', None)
+            counters = {**(fetch_record or {}).get('counters', {}), **(record or {}).get('counters', {})}
+            self._print({'event': 'file', 'path': path.strip(), 'error': None if error is None else str(error),
+                         'stages': {name: round(seconds, 4) for name, seconds in stages.items()}, 'counters': counters})
+
+    def snapshot(self) -> dict:
+        """
+        Returns the current metrics as a dictionary.
+        """
+        with self._lock:
+            elapsed = time.time() - self.begin
+            finished = self.done + self.failed + self.skipped
+            processed = self.done + self.failed
+            remaining = max(0, self.total_files - finished)
+
+            # Skipped paths take no time, so the rate only counts the processed ones.
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            eta = remaining / rate if rate > 0 else None
+
+            return {
+                'event': 'progress',
+                'elapsed': round(elapsed, 1),
+                'total_files': self.total_files,
+                'done': self.done,
+                'failed': self.failed,
+                'skipped': self.skipped,
+                'files_per_s': round(rate, 4),
+                'eta_seconds': round(eta, 1) if eta is not None else None,
+                'stages': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                'counters': dict(self.counters),
+                'download_mb_per_s': round(self.counters.get('download_bytes', 0) / 2**20 / elapsed, 3) if elapsed > 0 else 0.0,
+                'records_per_s': round(self.counters.get('records', 0) / elapsed, 1) if elapsed > 0 else 0.0,
+                'queues': dict(self.queues),
+                'worker_utilization': round(min(1.0, self.busy_seconds / (elapsed * self.num_workers)), 3) if elapsed > 0 else 0.0
+            }
+
+    def progress(self) -> str:
+        """
+        Returns a one line summary of the progress, e.g. 'Progress: 10/90000 (ETA 3h 20m)'.
+        """
+        snapshot = self.snapshot()
+        finished = snapshot['done'] + snapshot['failed'] + snapshot['skipped']
+        eta = snapshot['eta_seconds']
+        eta = f'{int(eta // 3600)}h {int(eta % 3600 // 60)}m {int(eta % 60)}s' if eta is not None else '-'
+        return f'Progress: {finished}/{self.total_files} (ETA {eta})'
+
+    def _print(self, data: dict):
+        print(json.dumps(data), file=self.stream, flush=True)
+
+    def start_reporter(self, interval: float):
+        """
+        Prints a JSON line with the snapshot every 'interval' seconds, from a background thread.
+        """
+        def report():
+            while not self._stop.wait(interval):
+                self._print(self.snapshot())
+
+        self._reporter = threading.Thread(target=report, daemon=True)
+        self._reporter.start()
+
+    def prometheus(self) -> str:
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        snapshot = self.snapshot()
+        lines = [
+            '# TYPE cc_files gauge',
+            *(f'cc_files{{state="{state}"}} {snapshot[state]}' for state in ('done', 'failed', 'skipped')),
+            f'cc_files{{state="total"}} {snapshot["total_files"]}',
+            '# TYPE cc_stage_seconds_total counter',
+            *(f'cc_stage_seconds_total{{stage="{name}"}} {seconds}' for name, seconds in snapshot['stages'].items()),
+            '# TYPE cc_counter_total counter',
+            *(f'cc_counter_total{{name="{name}"}} {value}' for name, value in snapshot['counters'].items()),
+            '# TYPE cc_queue_depth gauge',
+            *(f'cc_queue_depth{{queue="{name}"}} {value}' for name, value in snapshot['queues'].items()),
+            '# TYPE cc_worker_utilization gauge',
+            f'cc_worker_utilization {snapshot["worker_utilization"]}',
+            '# TYPE cc_elapsed_seconds gauge',
+            f'cc_elapsed_seconds {snapshot["elapsed"]}',
+        ]
+        if snapshot['eta_seconds'] is not None:
+            lines += ['# TYPE cc_eta_seconds gauge', f'cc_eta_seconds {snapshot["eta_seconds"]}']
+
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port: int, host='127.0.0.1'):
+        """
+        Serves the metrics at http://host:port/metrics (Prometheus text format) from a background thread.
+        """
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = metrics.prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args): pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    def close(self):
+        """
+        Stops the reporter and the server, printing a last snapshot if the reporter was running.
+        """
+        self._stop.set()
+        if self._reporter is not None:
+            self._reporter.join()
+            self._print(self.snapshot())
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
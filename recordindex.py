@@ -0,0 +1,469 @@
+import io
+import os
+import csv
+import json
+import argparse
+import numpy as np
+from collections import defaultdict
+from sinks import EXTENSIONS
+from wetstore import record_key
+
+# Entries of the record ID space: hash of the ID, file (position in the catalog) and where its row starts
+# (byte offset in a CSV file, row number in a Parquet file).
+ID_DTYPE = np.dtype([('key', '<u8'), ('file', '<u4'), ('offset', '<u8')])
+
+# Entries of the URL space also keep the hash of the record ID, so a record found in several outputs counts once.
+URL_DTYPE = np.dtype([('key', '<u8'), ('record', '<u8'), ('file', '<u4'), ('offset', '<u8')])
+
+# Entries are sharded by the top bits of their key, so every shard is a key range.
+NUM_SHARDS = 256
+
+# A shard is compacted (its segments merged into one) when it has more segments than this.
+MAX_SEGMENTS = 16
+
+CATALOG_FILE = 'catalog.json'
+
+# Kinds of output files, the column holding the (WARC response) record ID, and the URL column if any.
+KINDS = {
+    'metadata': ('WARC_Record_ID', 'WARC_Target_URI'),
+    'content': ('WARC_Refers_To', None),
+    'joined': ('WARC_Record_ID', 'WARC_Target_URI')
+}
+
+# Columns taken from content files (the other ones describe the WET record, not the WARC response).
+TEXT_COLUMNS = ['WARC_Identified_Content_Language', 'Content']
+
+def file_kind(path: str) -> str:
+    """
+    Returns the kind of an output file from its name ('<name>.csv' metadata, '<name>.wet.csv' content,
+    '<name>.joined.csv' joined, same with .parquet), or None if it is not an output file.
+    """
+    name, ext = os.path.splitext(os.path.basename(path))
+    if ext not in EXTENSIONS.values(): return None
+    if '.' not in name: return 'metadata'
+
+    suffix = name.rsplit('.', 1)[1]
+    if suffix == 'wet': return 'content'
+    if suffix == 'joined': return 'joined'
+    return None
+
+def iter_csv_rows(file, offset=0):
+    """
+    Iterates over the rows of a CSV file opened in binary mode, from a byte offset where a row starts.
+    Quoted fields may contain line breaks (e.g. Content), so a row ends at the first line break outside quotes.
+
+    Returns:
+    generator: Pairs of (offset of the row, list of fields).
+    """
+    file.seek(offset)
+    lines, quotes = [], 0
+    start = offset
+    for line in file:
+        lines.append(line)
+        quotes += line.count(b'"')
+        offset += len(line)
+        if quotes % 2: continue
+
+        text = b''.join(lines).decode('utf-8')
+        yield start, next(csv.reader(io.StringIO(text, newline='')), [])
+        lines, quotes = [], 0
+        start = offset
+
+def _csv_offsets(path: str, columns: list) -> tuple:
+    """
+    Returns the row offsets of a CSV output and the values of some of its columns.
+    """
+    with open(path, 'rb') as file:
+        rows = iter_csv_rows(file)
+        _, header = next(rows, (0, []))
+        positions = [header.index(column) for column in columns]
+
+        offsets, values = [], [[] for _ in columns]
+        for offset, row in rows:
+            offsets.append(offset)
+            for position, column_values in zip(positions, values):
+                column_values.append(row[position])
+
+    return offsets, values
+
+def _parquet_offsets(path: str, columns: list) -> tuple:
+    """
+    Returns the row numbers of a Parquet output and the values of some of its columns.
+    """
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=columns)
+    values = [[value or '' for value in table.column(column).to_pylist()] for column in columns]
+    return list(range(table.num_rows)), values
+
+def scan_file(path: str, kind: str) -> tuple:
+    """
+    Computes the index entries of an output file (without the file number, set when it is added).
+
+    Parameters:
+    - path (str): Path to an output file.
+    - kind (str): Kind of the file (see file_kind).
+
+    Returns:
+    tuple: Arrays of record ID keys, URL keys (None if the file has no URLs) and row offsets.
+    """
+    id_column, url_column = KINDS[kind]
+    columns = [id_column] + ([url_column] if url_column is not None else [])
+
+    if path.endswith(EXTENSIONS['parquet']):
+        offsets, values = _parquet_offsets(path, columns)
+    else:
+        offsets, values = _csv_offsets(path, columns)
+
+    ids = np.fromiter((record_key(value) for value in values[0]), dtype='<u8', count=len(offsets))
+    urls = np.fromiter((record_key(value) for value in values[1]), dtype='<u8', count=len(offsets)) if url_column is not None else None
+    return ids, urls, np.asarray(offsets, dtype='<u8')
+
+def _scan(item):
+    return scan_file(*item)
+
+class RecordIndex:
+    """
+    Index of the record IDs and URLs of every output (metadata, content and joined files) of a crawl,
+    mapping the hash of a WARC_Record_ID or WARC_Target_URI to the file and offset of its rows.
+
+    Entries are split in NUM_SHARDS shards by key range, and every shard is a list of sorted segments
+    (NumPy files, memory-mapped on read). Adding files writes new segments, and a shard with too many
+    segments is compacted: its segments are merged, entries of replaced files are dropped, and entries
+    repeated across outputs are kept once. A lookup sorts the requested keys by shard and does one
+    binary search per shard segment, then reads the rows file by file in offset order.
+
+    The catalog ('catalog.json') records the indexed files with their size and modification time, so
+    adding a folder again only scans new or rewritten files. Only one process may add files at a time.
+
+    Parameters:
+    - index_dir (str): Folder of the index.
+    - num_shards (int): Number of shards, only used when the index is created (default is NUM_SHARDS).
+    """
+    def __init__(self, index_dir: str, num_shards=NUM_SHARDS):
+        self.index_dir = index_dir
+        self.catalog_path = f'{index_dir}/{CATALOG_FILE}'
+
+        if os.path.exists(self.catalog_path):
+            with open(self.catalog_path, 'r') as file:
+                self.catalog = json.load(file)
+        else:
+            if num_shards & (num_shards - 1): raise ValueError('num_shards must be a power of 2.')
+            self.catalog = {'num_shards': num_shards, 'next_segment': 0, 'files': [],
+                            'shards': {'id': {}, 'url': {}}}
+
+        self.num_shards = self.catalog['num_shards']
+        self._shift = 64 - (self.num_shards.bit_length() - 1)
+        self._segments = {}
+
+    def _save_catalog(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(f'{self.catalog_path}.tmp', 'w') as file:
+            json.dump(self.catalog, file)
+        os.replace(f'{self.catalog_path}.tmp', self.catalog_path)
+
+    def _shard_of(self, keys: np.ndarray) -> np.ndarray:
+        return (keys >> np.uint64(self._shift)).astype(np.int64) if self._shift < 64 else np.zeros(len(keys), dtype=np.int64)
+
+    def _alive(self) -> np.ndarray:
+        return np.array([entry['alive'] for entry in self.catalog['files']] or [False], dtype=bool)
+
+    def _load_segment(self, space: str, name: str) -> np.ndarray:
+        if (space, name) not in self._segments:
+            self._segments[space, name] = np.load(f'{self.index_dir}/{space}/{name}', mmap_mode='r')
+        return self._segments[space, name]
+
+    def _write_entries(self, space: str, entries: np.ndarray, segment: int):
+        """
+        Splits sorted entries by shard and writes one segment file per non-empty shard.
+        """
+        os.makedirs(f'{self.index_dir}/{space}', exist_ok=True)
+        shards = self._shard_of(entries['key'])
+        bounds = np.searchsorted(shards, np.arange(self.num_shards + 1))
+
+        for shard in np.flatnonzero(np.diff(bounds)):
+            name = f'{shard:04d}-{segment:06d}.npy'
+            with open(f'{self.index_dir}/{space}/{name}.tmp', 'wb') as file:
+                np.save(file, entries[bounds[shard]:bounds[shard + 1]])
+            os.replace(f'{self.index_dir}/{space}/{name}.tmp', f'{self.index_dir}/{space}/{name}')
+            self.catalog['shards'][space].setdefault(str(shard), []).append(name)
+
+    def add(self, paths, num_workers=1, files_per_segment=64) -> int:
+        """
+        Adds output files (or every output file of some folders) to the index. Files already indexed
+        are skipped unless they changed since, in which case their old entries are replaced.
+
+        Parameters:
+        - paths (list): Output files and/or folders containing them.
+        - num_workers (int): Number of processes scanning files (default is 1).
+        - files_per_segment (int): Files scanned before their entries are written, which bounds the memory used (default is 64).
+
+        Returns:
+        int: Number of files added.
+        """
+        from concurrent.futures import ProcessPoolExecutor
+
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files += sorted(f'{path}/{name}' for name in os.listdir(path) if file_kind(name) is not None)
+            elif file_kind(path) is not None:
+                files.append(path)
+
+        known = {entry['path']: (number, entry) for number, entry in enumerate(self.catalog['files']) if entry['alive']}
+        pending = []
+        for path in files:
+            path = os.path.abspath(path)
+            stat = os.stat(path)
+            version = [stat.st_size, stat.st_mtime_ns]
+            if path in known:
+                number, entry = known[path]
+                if entry['version'] == version: continue
+                entry['alive'] = False
+            pending.append((path, file_kind(path), version))
+
+        pool = ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+        try:
+            for begin in range(0, len(pending), files_per_segment):
+                batch = pending[begin:begin + files_per_segment]
+                scans = pool.map(_scan, [(path, kind) for path, kind, _ in batch]) if pool is not None else map(_scan, [(path, kind) for path, kind, _ in batch])
+
+                id_parts, url_parts = [], []
+                for (path, kind, version), (ids, urls, offsets) in zip(batch, scans):
+                    number = len(self.catalog['files'])
+                    self.catalog['files'].append({'path': path, 'kind': kind, 'version': version, 'alive': True})
+
+                    part = np.empty(len(ids), dtype=ID_DTYPE)
+                    part['key'], part['file'], part['offset'] = ids, number, offsets
+                    id_parts.append(part)
+
+                    if urls is not None:
+                        part = np.empty(len(urls), dtype=URL_DTYPE)
+                        part['key'], part['record'], part['file'], part['offset'] = urls, ids, number, offsets
+                        url_parts.append(part)
+
+                segment = self.catalog['next_segment']
+                self.catalog['next_segment'] += 1
+                for space, parts in (('id', id_parts), ('url', url_parts)):
+                    if not parts: continue
+                    entries = np.concatenate(parts)
+                    entries.sort(order='key', kind='stable')
+                    self._write_entries(space, entries, segment)
+
+                # Segments are written before the catalog, so a crash only leaves unreferenced files behind.
+                self._save_catalog()
+        finally:
+            if pool is not None: pool.shutdown()
+
+        self.compact(max_segments=MAX_SEGMENTS)
+        return len(pending)
+
+    def _shard_entries(self, space: str, shard: int) -> np.ndarray:
+        """
+        Returns the entries of a shard (every segment) that belong to files still indexed.
+        """
+        names = self.catalog['shards'][space].get(str(shard), [])
+        if not names: return np.empty(0, dtype=ID_DTYPE if space == 'id' else URL_DTYPE)
+
+        entries = np.concatenate([self._load_segment(space, name) for name in names])
+        return entries[self._alive()[entries['file']]]
+
+    def compact(self, max_segments=1):
+        """
+        Merges the segments of every shard with more than max_segments segments into a single one,
+        dropping entries of replaced files and keeping a single entry per record ID and file kind
+        (ID space) or per URL and record ID (URL space).
+        """
+        kinds = np.array([list(KINDS).index(entry['kind']) for entry in self.catalog['files']] or [0])
+        changed = False
+
+        for space in ('id', 'url'):
+            for shard, names in list(self.catalog['shards'][space].items()):
+                if len(names) <= max_segments: continue
+
+                entries = self._shard_entries(space, int(shard))
+                second = entries['record'] if space == 'url' else kinds[entries['file']]
+                order = np.lexsort((entries['offset'], entries['file'], second, entries['key']))
+                entries, second = entries[order], second[order]
+                keep = np.ones(len(entries), dtype=bool)
+                keep[1:] = (entries['key'][1:] != entries['key'][:-1]) | (second[1:] != second[:-1])
+                entries = entries[keep]
+
+                segment = self.catalog['next_segment']
+                self.catalog['next_segment'] += 1
+                self.catalog['shards'][space][shard] = []
+                if len(entries): self._write_entries(space, entries, segment)
+                if not self.catalog['shards'][space][shard]: del self.catalog['shards'][space][shard]
+
+                self._save_catalog()
+                for name in names:
+                    self._segments.pop((space, name), None)
+                    os.remove(f'{self.index_dir}/{space}/{name}')
+                changed = True
+
+        return changed
+
+    def _find(self, space: str, values: list) -> dict:
+        """
+        Returns the entries of some values (record IDs or URLs), grouped by file: {file: [(offset, value), ...]}.
+        """
+        keys = np.fromiter((record_key(value) for value in values), dtype='<u8', count=len(values))
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        shards = self._shard_of(keys)
+        alive = self._alive()
+
+        found = defaultdict(list)
+        for shard in np.unique(shards):
+            positions = np.flatnonzero(shards == shard)
+            shard_keys = keys[positions]
+            for name in self.catalog['shards'][space].get(str(shard), []):
+                segment = self._load_segment(space, name)
+                lefts = np.searchsorted(segment['key'], shard_keys, side='left')
+                rights = np.searchsorted(segment['key'], shard_keys, side='right')
+                for position, left, right in zip(positions, lefts, rights):
+                    for entry in segment[left:right]:
+                        if alive[entry['file']]:
+                            found[int(entry['file'])].append((int(entry['offset']), values[order[position]]))
+
+        return found
+
+    def _read_rows(self, file: int, offsets: list) -> dict:
+        """
+        Reads the rows of a file at some offsets.
+
+        Returns:
+        dict: Row (as a dictionary) of every offset.
+        """
+        path = self.catalog['files'][file]['path']
+        rows = {}
+
+        if path.endswith(EXTENSIONS['parquet']):
+            import pyarrow.parquet as pq
+
+            parquet = pq.ParquetFile(path)
+            starts = np.cumsum([0] + [parquet.metadata.row_group(i).num_rows for i in range(parquet.num_row_groups)])
+            groups = defaultdict(list)
+            for offset in offsets:
+                groups[int(np.searchsorted(starts, offset, side='right')) - 1].append(offset)
+            for group, group_offsets in groups.items():
+                records = parquet.read_row_group(group).to_pylist()
+                for offset in group_offsets:
+                    rows[offset] = {column: value or '' for column, value in records[offset - starts[group]].items()}
+            return rows
+
+        with open(path, 'rb') as handle:
+            _, header = next(iter_csv_rows(handle), (0, []))
+            for offset in sorted(set(offsets)):
+                _, row = next(iter_csv_rows(handle, offset))
+                rows[offset] = dict(zip(header, row))
+
+        return rows
+
+    def lookup(self, record_ids: list) -> dict:
+        """
+        Returns the metadata and text of a batch of record IDs (WARC_Record_ID of the WARC responses).
+
+        Parameters:
+        - record_ids (list): Record IDs to look up.
+
+        Returns:
+        dict: For every record ID found, a dictionary with its metadata columns and, if its text is
+        indexed, WARC_Identified_Content_Language and Content.
+        """
+        results = {}
+        for file, matches in self._find('id', list(record_ids)).items():
+            kind = self.catalog['files'][file]['kind']
+            id_column = KINDS[kind][0]
+            rows = self._read_rows(file, [offset for offset, _ in matches])
+
+            for offset, record_id in matches:
+                row = rows[offset]
+                # Hash collisions are told apart by the stored ID.
+                if row.get(id_column) != record_id: continue
+
+                result = results.setdefault(record_id, {})
+                if kind == 'content':
+                    for column in TEXT_COLUMNS: result.setdefault(column, row[column])
+                else:
+                    for column, value in row.items(): result.setdefault(column, value)
+
+        return results
+
+    def lookup_urls(self, urls: list) -> dict:
+        """
+        Returns the metadata records of a batch of URLs (WARC_Target_URI).
+
+        Returns:
+        dict: For every URL found, the list of its records (one per record ID).
+        """
+        results = defaultdict(dict)
+        for file, matches in self._find('url', list(urls)).items():
+            rows = self._read_rows(file, [offset for offset, _ in matches])
+            for offset, url in matches:
+                row = rows[offset]
+                if row.get('WARC_Target_URI') != url: continue
+                results[url].setdefault(row['WARC_Record_ID'], row)
+
+        return {url: list(records.values()) for url, records in results.items()}
+
+    def url_stats(self) -> dict:
+        """
+        Computes URL-level duplication statistics over the whole index, one shard at a time.
+
+        Returns:
+        dict: Number of records, distinct URLs, URLs seen in more than one record, records that repeat
+        an already seen URL and the largest number of records of a single URL.
+        """
+        stats = {'records': 0, 'urls': 0, 'duplicated_urls': 0, 'duplicate_records': 0, 'max_records_per_url': 0}
+
+        for shard in range(self.num_shards):
+            entries = self._shard_entries('url', shard)
+            if not len(entries): continue
+
+            # Records indexed from several outputs (e.g. metadata and joined files) count once.
+            pairs = np.unique(np.stack([entries['key'], entries['record']], axis=1), axis=0)
+            _, counts = np.unique(pairs[:, 0], return_counts=True)
+
+            stats['records'] += len(pairs)
+            stats['urls'] += len(counts)
+            stats['duplicated_urls'] += int((counts > 1).sum())
+            stats['duplicate_records'] += int((counts - 1).sum())
+            stats['max_records_per_url'] = max(stats['max_records_per_url'], int(counts.max()))
+
+        return stats
+
+    def __len__(self) -> int:
+        return sum(1 for entry in self.catalog['files'] if entry['alive'])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build and query an index of the record IDs and URLs of the extracted outputs.')
+
+    parser.add_argument('index', help='Folder of the index.')
+    parser.add_argument('--add', help='Output files or folders (metadata, content or joined files) to add to the index.', nargs='+', required=False)
+    parser.add_argument('--num_workers', help='Number of worker processes scanning files (default is 1).', required=False)
+    parser.add_argument('--num_shards', help=f'Number of shards of a new index, a power of 2 (default is {NUM_SHARDS}).', required=False)
+    parser.add_argument('--compact', help='Merges the segments of every shard.', action='store_true')
+    parser.add_argument('--lookup', help='Record IDs to look up (prints their records as JSON lines).', nargs='+', required=False)
+    parser.add_argument('--lookup_urls', help='URLs to look up (prints their records as JSON lines).', nargs='+', required=False)
+    parser.add_argument('--url_stats', help='Prints URL duplication statistics.', action='store_true')
+
+    args = parser.parse_args()
+
+    index = RecordIndex(args.index, int(args.num_shards) if args.num_shards != None else NUM_SHARDS)
+    num_workers = int(args.num_workers) if args.num_workers != None else 1
+
+    if args.add:
+        added = index.add(args.add, num_workers=num_workers)
+        print(f'Added {added} files ({len(index)} indexed)')
+    if args.compact:
+        index.compact()
+    if args.lookup:
+        for record_id, record in index.lookup(args.lookup).items():
+            print(json.dumps({'WARC_Record_ID': record_id, **record}))
+    if args.lookup_urls:
+        for url, records in index.lookup_urls(args.lookup_urls).items():
+            for record in records: print(json.dumps(record))
+    if args.url_stats:
+        print(json.dumps(index.url_stats()))
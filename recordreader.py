@@ -0,0 +1,155 @@
+import io
+import json
+import gzip
+import utils
+
+# Ranges closer than this (in bytes) are fetched with a single request, the bytes between them are discarded.
+MAX_GAP = 1 << 16
+
+def parse_cdx_line(line: str) -> dict:
+    """
+    Parses a line of a CommonCrawl CDX index ('<surt> <timestamp> <json fields>').
+
+    Returns:
+    dict: The JSON fields of the line ('url', 'filename', 'offset', 'length', 'mime', 'status', ...),
+    with 'offset' and 'length' as integers.
+    """
+    _, _, fields = line.strip().split(' ', 2)
+    entry = json.loads(fields)
+    entry['offset'] = int(entry['offset'])
+    entry['length'] = int(entry['length'])
+    return entry
+
+def iter_cdx(path: str):
+    """
+    Iterates over the entries of a CDX index file (gzipped or not), see parse_cdx_line.
+    """
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as file:
+        for line in file:
+            if line.strip(): yield parse_cdx_line(line)
+
+def coalesce_ranges(ranges, max_gap=MAX_GAP) -> list:
+    """
+    Sorts (offset, length) ranges and groups the ones closer than max_gap bytes.
+
+    Returns:
+    list: (start, end, ranges) spans, end excluded.
+    """
+    spans = []
+    for offset, length in sorted(set(ranges)):
+        if spans and offset - spans[-1][1] <= max_gap:
+            start, end, members = spans[-1]
+            spans[-1] = (start, max(end, offset + length), members + [(offset, length)])
+        else:
+            spans.append((offset, offset + length, [(offset, length)]))
+
+    return spans
+
+def read_ranges(path: str, ranges, streaming=False, max_gap=MAX_GAP):
+    """
+    Reads byte ranges of a local file or, if streaming is enabled, of a CommonCrawl path. Remote ranges
+    closer than max_gap are fetched with a single Range request, and a path found in the download cache
+    (see cache.py) is read from disk.
+
+    Parameters:
+    - path (str): Local file path, or CommonCrawl path (without base URL) if streaming is enabled.
+    - ranges (list): (offset, length) pairs.
+    - streaming (bool): Whether path must be read over HTTP (default is False).
+    - max_gap (int): Max number of bytes between two ranges fetched together (default is MAX_GAP).
+
+    Returns:
+    generator: ((offset, length), bytes) pairs, in offset order.
+    """
+    if streaming:
+        from cache import get_cache
+
+        cache = get_cache()
+        cached = cache.get(path) if cache is not None else None
+        if cached is not None:
+            path, streaming = cached, False
+
+    if not streaming:
+        with open(path, 'rb') as file:
+            for offset, length in sorted(set(ranges)):
+                file.seek(offset)
+                yield (offset, length), file.read(length)
+        return
+
+    from client import get_client # deferred, it imports requests
+
+    client = get_client()
+    for start, end, members in coalesce_ranges(ranges, max_gap):
+        data = client.read_range(utils.BASE_URL + path, start, end - 1)
+        for offset, length in members:
+            yield (offset, length), data[offset - start:offset - start + length]
+
+def iter_records(path: str, ranges, streaming=False, max_gap=MAX_GAP):
+    """
+    Reads the WARC record starting at every range of a .gz file (e.g. a WARC_Offset and WARC_Length
+    pair, or the offset and length of a CDX entry), without reading the rest of the file.
+
+    Parameters:
+    - path (str): Local .warc.gz/.warc.wet.gz file, or CommonCrawl path (without base URL) if streaming is enabled.
+    - ranges (list): (offset, length) pairs.
+    - streaming (bool): Whether path must be read over HTTP (default is False).
+    - max_gap (int): Max number of bytes between two ranges fetched together (default is MAX_GAP).
+
+    Returns:
+    generator: ((offset, length), WarcRecord) pairs, in offset order. A record can only be read before the next one is requested.
+    """
+    from fastwarc.warc import ArchiveIterator
+
+    for member, data in read_ranges(path, ranges, streaming, max_gap):
+        for record in ArchiveIterator(io.BytesIO(data), parse_http=False):
+            yield member, record
+            break
+
+def get_metadata_at(warc_path: str, ranges, streaming=False) -> list:
+    """
+    Extracts the metadata (see extract_metadata.iter_metadata) of the responses at some ranges of a WARC file.
+
+    Parameters:
+    - warc_path (str): Local .warc.gz file, or CommonCrawl WARC path if streaming is enabled.
+    - ranges (list): (offset, length) pairs, e.g. the WARC_Offset and WARC_Length of a metadata output.
+    - streaming (bool): Whether warc_path must be read over HTTP (default is False).
+
+    Returns:
+    list: The metadata records found, in offset order (ranges that are not HTML responses are skipped).
+    """
+    from extract_metadata import record_metadata, METADATA_COLUMNS
+
+    warc = warc_path.split('/')[-1].split('.')[0]
+    records = []
+    for (offset, length), record in iter_records(warc_path, ranges, streaming):
+        metadata = record_metadata(record, warc)
+        if metadata is None: continue
+
+        records.append(dict(zip(METADATA_COLUMNS, metadata + (str(offset), str(length)))))
+
+    return records
+
+def get_text_at(wet_path: str, ranges, streaming=False) -> list:
+    """
+    Extracts the text (see extract_text.iter_text) of the records at some ranges of a WET file.
+
+    Parameters:
+    - wet_path (str): Local .warc.wet.gz file, or CommonCrawl WET path if streaming is enabled.
+    - ranges (list): (offset, length) pairs, e.g. the WARC_Offset and WARC_Length of a content output
+      (or WET_Offset and WET_Length of a joined output).
+    - streaming (bool): Whether wet_path must be read over HTTP (default is False).
+
+    Returns:
+    list: The content records found, in offset order (ranges that are not text conversions are skipped).
+    """
+    from extract_text import record_text, CONTENT_COLUMNS
+
+    wet = wet_path.split('/')[-1].split('.')[0]
+    records = []
+    for (offset, length), record in iter_records(wet_path, ranges, streaming):
+        text = record_text(record, wet)
+        if text is None: continue
+
+        records.append(dict(zip(CONTENT_COLUMNS, text + (str(offset), str(length)))))
+
+    return records
@@ -0,0 +1,289 @@
+import os
+import json
+import argparse
+from collections import Counter
+from functools import partial
+from sinks import open_sink, read_output, EXTENSIONS
+from stats import normalize_languages, get_output_files, LANGUAGE_COLUMNS
+
+# Records kept per stratum when no target is given.
+SAMPLE_SIZE = 1000
+
+# Seed of the random priorities: the same seed selects the same records, whatever the order of the files
+# and the number of workers.
+SEED = 0
+
+# Candidates buffered by the main process before they are reduced to the reservoirs (as many rows at least
+# as the reservoirs themselves).
+MERGE_ROWS = 1 << 18
+
+# Columns added to the sampled records, and the ones taken from the content outputs.
+STRATUM_COLUMN = 'Stratum'
+TEXT_COLUMNS = ['WARC_Identified_Content_Language', 'Content']
+
+def read_targets(value: str) -> dict:
+    """
+    Reads the target size of some strata from a comma-separated list or from a file listing them (one or more
+    per line, comma-separated, '#' starting a comment), as 'stratum' or 'stratum=size'. Strata without size get None.
+    """
+    if os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8') as file:
+            value = ','.join(line.split('#')[0] for line in file)
+
+    targets = {}
+    for entry in value.split(','):
+        entry = entry.strip()
+        stratum, _, size = entry.rpartition('=') if '=' in entry else (entry, '', '')
+        if stratum: targets[stratum] = int(size) if size else None
+
+    return targets
+
+def stratum_values(df: 'pd.DataFrame', columns: list) -> 'pd.Series':
+    """
+    Returns the stratum of every record: the values of some columns joined with '|' (like the joint counts
+    of stats.py), language columns normalized (e.g. 'es_CL' as 'es-cl'). Missing values count as ''.
+    """
+    strata = None
+    for column in columns:
+        values = df[column].fillna('')
+        if column in LANGUAGE_COLUMNS:
+            # Raw values repeat a lot, so only the distinct ones are normalized.
+            values = values.map({value: ','.join(normalize_languages(value)) for value in values.unique()})
+        strata = values if strata is None else strata + '|' + values
+
+    return strata
+
+def normalize_targets(targets: dict, columns: list) -> dict:
+    """
+    Normalizes the strata of some targets like stratum_values, so that they match the strata of the records
+    (e.g. 'es_CL' as 'es-cl' when the strata are HTML_Language values).
+    """
+    normalized = {}
+    for stratum, target in targets.items():
+        values = stratum.split('|')
+        if len(values) == len(columns):
+            values = [','.join(normalize_languages(value)) if column in LANGUAGE_COLUMNS else value
+                      for value, column in zip(values, columns)]
+        normalized['|'.join(values)] = target
+
+    return normalized
+
+def _sizes(targets: dict, size: int) -> dict:
+    # Size of every target stratum, None if every stratum is sampled with the same size.
+    return {stratum: size if target is None else target for stratum, target in targets.items()} if targets else None
+
+def _reduce(df: 'pd.DataFrame', size: int, targets: dict) -> 'pd.DataFrame':
+    # Keeps the records with the smallest priorities of every stratum (a record found in several files once).
+    # Records are ranked on the priority, stratum and ID columns only, and the kept rows are taken at the end.
+    import numpy as np
+
+    order = np.argsort(df['_priority'].to_numpy(), kind='stable')
+    order = order[~df['WARC_Record_ID'].take(order).duplicated().to_numpy()]
+    strata = df[STRATUM_COLUMN].take(order).reset_index(drop=True)
+
+    rank = strata.groupby(strata, sort=False).cumcount().to_numpy()
+    limit = strata.map(targets).fillna(size).to_numpy() if targets else size
+
+    return df.take(order[rank < limit])
+
+def sample_file(path: str, columns: list, size=SAMPLE_SIZE, targets=None, query=None, seed=SEED) -> tuple:
+    """
+    Samples the records of a metadata output file. Every record gets a random priority (a seeded hash of its
+    record ID) and only the records with the smallest priorities of every stratum are kept: a uniform sample
+    without replacement, and merging the samples of several files keeps the smallest of all of them, which is
+    the sample of the union (see merge_samples).
+
+    Parameters:
+    - path (str): Path to a .csv or .parquet metadata file.
+    - columns (list): Columns defining the strata (e.g. ['HTML_Language']).
+    - size (int): Records kept per stratum (default is SAMPLE_SIZE).
+    - targets (dict): Size of some strata (None for size), the other strata are left out (default is every stratum).
+      Strata are normalized as in normalize_targets.
+    - query (str): pandas query selecting the records to sample from (default is None, that means every record).
+    - seed (int): Seed of the priorities (default is SEED).
+
+    Returns:
+    tuple: The sampled records (a DataFrame with their stratum and priority), and a Counter of the records of every stratum.
+    """
+    from pandas.util import hash_array
+
+    df = read_output(path)
+    if query is not None: df = df.query(query)
+    if targets: targets = normalize_targets(targets, columns)
+
+    df = df.assign(**{STRATUM_COLUMN: stratum_values(df, columns)})
+    if targets: df = df[df[STRATUM_COLUMN].isin(list(targets))]
+
+    population = Counter(df[STRATUM_COLUMN].value_counts().to_dict())
+
+    priorities = hash_array(df['WARC_Record_ID'].to_numpy(dtype=object), hash_key=f'{seed:016d}'[-16:], categorize=False)
+    df = df.assign(_priority=priorities)
+
+    return _reduce(df, size, _sizes(targets, size)), population
+
+def merge_samples(samples: list, size=SAMPLE_SIZE, targets=None) -> 'pd.DataFrame':
+    """
+    Merges the samples of several files (see sample_file) into the sample of all of them.
+    """
+    import pandas as pd
+
+    return _reduce(pd.concat(samples, ignore_index=True), size, _sizes(targets, size))
+
+def sample_outputs(paths, columns: list, size=SAMPLE_SIZE, targets=None, query=None, seed=SEED, num_workers=1) -> tuple:
+    """
+    Samples the records of every metadata output of some folders in a single pass. Files are sampled on their
+    own in a pool of processes (see sample_file), and the main process merges their samples as they come, so
+    memory only grows with the size of the reservoirs, not with the number of records nor of files.
+
+    Parameters:
+    - paths (list): Metadata files and/or folders containing them (see stats.get_output_files).
+    - columns (list): Columns defining the strata.
+    - size (int): Records kept per stratum (default is SAMPLE_SIZE).
+    - targets (dict): Size of some strata (None for size), the other strata are left out (default is every stratum).
+      Strata are normalized as in normalize_targets.
+    - query (str): pandas query selecting the records to sample from (default is None, that means every record).
+    - seed (int): Seed of the priorities (default is SEED).
+    - num_workers (int): Number of worker processes (default is 1).
+
+    Returns:
+    tuple: The sampled records (a DataFrame, by stratum and priority), and a Counter of the records of every stratum.
+    """
+    import pandas as pd
+    from concurrent.futures import ProcessPoolExecutor
+
+    files = []
+    for path in paths:
+        files += get_output_files(path) if os.path.isdir(path) else [path]
+    if targets: targets = normalize_targets(targets, columns)
+
+    sample = partial(sample_file, columns=columns, size=size, targets=targets, query=query, seed=seed)
+
+    population = Counter()
+    pending, rows = [], 0
+    def merge(result):
+        nonlocal pending, rows
+        records, counts = result
+        population.update(counts)
+        pending.append(records)
+        rows += len(records)
+        if rows > MERGE_ROWS and len(pending) > 1:
+            pending = [merge_samples(pending, size, targets)]
+            rows = len(pending[0])
+
+    if num_workers <= 1:
+        for result in map(sample, files): merge(result)
+    else:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            for result in pool.map(sample, files, chunksize=max(1, len(files) // (num_workers * 16))): merge(result)
+
+    if not pending: return pd.DataFrame(columns=['WARC_Record_ID', STRATUM_COLUMN]), population
+
+    records = merge_samples(pending, size, targets)
+    records = records.sort_values([STRATUM_COLUMN, '_priority'], kind='stable').drop(columns='_priority')
+    return records.reset_index(drop=True), population
+
+def _content_file(text_dest: str, warc_file: str):
+    for ext in EXTENSIONS.values():
+        path = f'{text_dest}/{warc_file}.wet{ext}'
+        if os.path.exists(path): return path
+
+    return None
+
+def _read_texts(item) -> dict:
+    # Texts of some record IDs found in the content output of a file.
+    path, record_ids = item
+    df = read_output(path, columns=['WARC_Refers_To'] + TEXT_COLUMNS)
+    df = df[df['WARC_Refers_To'].isin(record_ids)].drop_duplicates('WARC_Refers_To')
+
+    return {row[0]: row[1:] for row in df.itertuples(index=False)}
+
+def fetch_texts(records: 'pd.DataFrame', text_dest=None, index=None, num_workers=1) -> 'pd.DataFrame':
+    """
+    Adds the text (WARC_Identified_Content_Language and Content) of the sampled records, either from the
+    content outputs of extract_text.py (only the files of sampled records are read) or from a record index
+    (see recordindex.py, only the rows of sampled records are read). Records without text get empty values.
+
+    Parameters:
+    - records (pd.DataFrame): Sampled records (see sample_outputs).
+    - text_dest (str): Folder containing the content outputs ('<WARC_File>.wet.csv' or .parquet).
+    - index (str): Folder of a record index, used instead of text_dest.
+    - num_workers (int): Number of worker processes reading content outputs (default is 1).
+
+    Returns:
+    pd.DataFrame: The records with their text.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    texts = {}
+    if index is not None:
+        from recordindex import RecordIndex
+
+        for record_id, record in RecordIndex(index).lookup(records['WARC_Record_ID'].tolist()).items():
+            if 'Content' in record: texts[record_id] = tuple(record.get(column) for column in TEXT_COLUMNS)
+    elif text_dest is not None:
+        items = []
+        for warc_file, group in records.groupby('WARC_File', sort=False):
+            path = _content_file(text_dest, warc_file)
+            if path is None:
+                print(f'The content of {warc_file} was not found in {text_dest}.')
+                continue
+            items.append((path, set(group['WARC_Record_ID'])))
+
+        if num_workers <= 1:
+            for found in map(_read_texts, items): texts.update(found)
+        else:
+            with ProcessPoolExecutor(max_workers=num_workers) as pool:
+                for found in pool.map(_read_texts, items): texts.update(found)
+
+    found = [texts.get(record_id, (None, None)) for record_id in records['WARC_Record_ID']]
+    return records.assign(**{column: [text[i] for text in found] for i, column in enumerate(TEXT_COLUMNS)})
+
+def save_sample(dest: str, records: 'pd.DataFrame', output_format='csv') -> int:
+    """
+    Saves the sampled records to a CSV (or Parquet) file.
+
+    Returns:
+    int: Number of records written.
+    """
+    records = records.astype(object).where(records.notna(), None)
+    with open_sink(dest, list(records.columns), output_format) as sink:
+        sink.write_rows(list(records.itertuples(index=False, name=None)))
+
+    return sink.rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Samples the same number of records per stratum (e.g. per HTML_Language) across every metadata output of a crawl.')
+
+    parser.add_argument('paths', help='Metadata files or folders containing them (e.g. the dest folder of extract_metadata.py).', nargs='+')
+    parser.add_argument('--by', help='Columns defining the strata (e.g. Domain HTML_Language).', nargs='+', required=True)
+    parser.add_argument('--size', help=f'Records kept per stratum (default is {SAMPLE_SIZE}).', required=False)
+    parser.add_argument('--targets', help="Strata to sample, as 'stratum' or 'stratum=size' separated by commas or listed in a file (default is every stratum, with --size records).", required=False)
+    parser.add_argument('--query', help="pandas query selecting the records to sample from (e.g. \"Content_Language == 'es'\").", required=False)
+    parser.add_argument('--seed', help=f'Seed of the sample, the same seed selects the same records (default is {SEED}).', required=False)
+    parser.add_argument('--text_dest', help='Folder containing the content outputs of extract_text.py, to add the text of the sampled records.', required=False)
+    parser.add_argument('--index', help='Folder of a record index (see recordindex.py), to add the text of the sampled records.', required=False)
+    parser.add_argument('--num_workers', help='Number of worker processes (default is 1).', required=False)
+    parser.add_argument('--output', help='File to save the sample (default is sample.csv in the current directory).', required=False)
+    parser.add_argument('--output_format', help='Format of the sample file (default is csv).', choices=list(EXTENSIONS), default='csv')
+
+    args = parser.parse_args()
+
+    size = int(args.size) if args.size != None else SAMPLE_SIZE
+    num_workers = int(args.num_workers) if args.num_workers != None else 1
+    targets = normalize_targets(read_targets(args.targets), args.by) if args.targets != None else None
+    output = args.output or f'sample{EXTENSIONS[args.output_format]}'
+
+    records, population = sample_outputs(args.paths, args.by, size=size, targets=targets, query=args.query,
+                                         seed=int(args.seed) if args.seed != None else SEED, num_workers=num_workers)
+    if args.index != None or args.text_dest != None:
+        records = fetch_texts(records, text_dest=args.text_dest, index=args.index, num_workers=num_workers)
+
+    save_sample(output, records, args.output_format)
+
+    for stratum in targets or []:
+        if not population[stratum]: print(f"No records found for the target '{stratum}'.")
+
+    sampled = records[STRATUM_COLUMN].value_counts().to_dict()
+    for stratum in sorted(targets or population, key=lambda stratum: -population[stratum]):
+        print(json.dumps({STRATUM_COLUMN: stratum, 'records': population[stratum], 'sampled': sampled.get(stratum, 0)}))
@@ -0,0 +1,107 @@
+from collections import deque
+
+def _start_worker():
+    return None
+
+def run_scheduler(paths, work, fetch=None, num_workers=1, num_fetchers=1, prefetch=1, on_done=None, on_state=None):
+    """
+    Runs a two stage pipeline over a sequence of paths: an I/O stage (fetch) executed by a pool of
+    threads, and a CPU stage (work) executed by a pool of processes. Workers are fed continuously from
+    a queue, so a slow file only occupies its own worker instead of stalling a whole batch.
+
+    Parameters:
+    - paths (iterable): Paths to be processed (e.g. lines from warc.paths). It is consumed lazily.
+    - work (callable): Picklable function executed in a worker process. It receives the path, or the
+      value returned by fetch if fetch is given.
+    - fetch (callable): Function executed in the I/O pool before work (default is None, that means paths
+      are sent straight to work). If it returns None the path is considered done and work is skipped.
+    - num_workers (int): Number of worker processes (default is 1).
+    - num_fetchers (int): Number of I/O threads (default is 1).
+    - prefetch (int): Number of fetched paths that may wait for a free worker (default is 1).
+    - on_done (callable): Called in the parent with (path, result, error) when a path is finished.
+    - on_state (callable): Called in the parent with the number of paths being fetched, fetched and waiting
+      for a worker, and being worked on, every time they change (default is None).
+
+    Returns:
+    int: Number of paths finished (successfully or not).
+    """
+    # Deferred, ProcessPoolExecutor pulls in multiprocessing.
+    from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    paths = iter(paths)
+    exhausted = False
+    completed = 0
+
+    fetching = {}
+    working = {}
+    ready = deque()
+
+    def finish(path, result=None, error=None):
+        nonlocal completed
+        completed += 1
+        if on_done is not None:
+            on_done(path, result, error)
+
+    fetch_pool = None
+    with ProcessPoolExecutor(max_workers=num_workers) as work_pool:
+        # Worker processes are forked before any fetch thread starts: forking while a thread holds a
+        # lock (e.g. on the SQLite manifest) leaves the children waiting on a lock nobody releases.
+        work_pool.submit(_start_worker).result()
+        if fetch is not None: fetch_pool = ThreadPoolExecutor(max_workers=num_fetchers)
+
+        try:
+            while True:
+                # Keep every worker busy plus 'prefetch' files already fetched and waiting on disk.
+                in_flight = len(fetching) + len(ready) + len(working)
+                while not exhausted and in_flight < num_workers + prefetch:
+                    try:
+                        path = next(paths)
+                    except StopIteration:
+                        exhausted = True
+                        break
+
+                    if fetch_pool is not None:
+                        fetching[fetch_pool.submit(fetch, path)] = path
+                    else:
+                        ready.append((path, path))
+                    in_flight += 1
+
+                while ready and len(working) < num_workers:
+                    path, item = ready.popleft()
+                    working[work_pool.submit(work, item)] = path
+
+                if on_state is not None:
+                    on_state(len(fetching), len(ready), len(working))
+
+                if not fetching and not working:
+                    break
+
+                done, _ = wait(set(fetching) | set(working), return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future in fetching:
+                        path = fetching.pop(future)
+                        try:
+                            item = future.result()
+                        except Exception as e:
+                            finish(path, error=e)
+                            continue
+
+                        if item is None:
+                            finish(path)
+                        else:
+                            ready.append((path, item))
+                    else:
+                        path = working.pop(future)
+                        # Errors raised by on_done are not errors of the work, they go up to the caller.
+                        try:
+                            result = future.result()
+                        except Exception as e:
+                            finish(path, error=e)
+                            continue
+
+                        finish(path, result=result)
+        finally:
+            if fetch_pool is not None:
+                fetch_pool.shutdown(wait=True)
+
+    return completed
@@ -0,0 +1,146 @@
+import os
+import csv
+
+# Output formats supported by open_sink, with the file extension used for each one.
+EXTENSIONS = {
+    'csv': '.csv',
+    'parquet': '.parquet'
+}
+
+# Low-cardinality columns, stored dictionary-encoded in columnar formats.
+DICTIONARY_COLUMNS = [
+    'WARC_File', 'Domain', 'Content_Language', 'HTML_Language',
+    'HTML_Dir', 'Server', 'Charset', 'WARC_Identified_Content_Language'
+]
+
+class Sink:
+    """
+    Base class of the output sinks. Records are written to a temporary file next to 'dest', which is
+    renamed to 'dest' only when the sink is closed without errors, so an interrupted run never leaves
+    a truncated output behind.
+
+    Records are given either as dictionaries (write) or as rows, tuples with a value per column in order
+    (write_rows). Rows are handed to the writer column by column, without building a DataFrame per batch.
+    """
+    def __init__(self, dest: str, columns: list):
+        self.dest = dest
+        self.columns = columns
+        self.rows = 0
+        self.tmp_dest = f'{dest}.tmp'
+
+    def write(self, records: list):
+        columns = self.columns
+        self.write_rows([tuple(record.get(column) for column in columns) for record in records])
+
+    def write_rows(self, rows: list):
+        raise NotImplementedError
+
+    def _finish(self):
+        pass
+
+    def close(self):
+        self._finish()
+        os.replace(self.tmp_dest, self.dest)
+
+    def abort(self):
+        try:
+            self._finish()
+        finally:
+            if os.path.exists(self.tmp_dest): os.remove(self.tmp_dest)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+class CSVSink(Sink):
+    """
+    Writes batches of records to a CSV file. Every batch is appended to the file, so only the current
+    batch is held in memory. Missing values are written as empty fields.
+    """
+    def __init__(self, dest: str, columns: list):
+        super().__init__(dest, columns)
+        self._file = open(self.tmp_dest, 'w', encoding='utf-8', newline='')
+        self._writer = csv.writer(self._file, lineterminator='\n')
+        self._writer.writerow(columns)
+
+    def write_rows(self, rows: list):
+        self._writer.writerows(rows)
+        self.rows += len(rows)
+
+    def _finish(self):
+        self._file.close()
+
+class ParquetSink(Sink):
+    """
+    Writes batches of records to a Parquet file (one row group per batch), with the low-cardinality
+    columns dictionary-encoded and the whole file compressed with zstd. Requires pyarrow.
+    """
+    def __init__(self, dest: str, columns: list, compression='zstd'):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('pyarrow is required to write Parquet files (pip install pyarrow).')
+
+        super().__init__(dest, columns)
+        self._pa = pa
+        self.schema = pa.schema([(column, pa.string()) for column in columns])
+        self._writer = pq.ParquetWriter(self.tmp_dest, self.schema, compression=compression,
+                                        use_dictionary=[c for c in columns if c in DICTIONARY_COLUMNS])
+
+    def write_rows(self, rows: list):
+        if not rows: return
+
+        # zip(*rows) turns the batch into one tuple per column, each one converted to an Arrow array at once.
+        pa = self._pa
+        arrays = [pa.array(values, type=pa.string()) for values in zip(*rows)]
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+        self.rows += len(rows)
+
+    def _finish(self):
+        self._writer.close()
+
+def open_sink(dest: str, columns: list, output_format='csv'):
+    """
+    Opens an output sink for the requested format.
+
+    Parameters:
+    - dest (str): Path of the output file (including its extension).
+    - columns (list): Columns of the records to be written.
+    - output_format (str): Either 'csv' or 'parquet' (default is 'csv').
+
+    Returns:
+    CSVSink or ParquetSink: Sink with write(records), write_rows(rows), close() and abort() methods, usable as a context manager.
+    """
+    if output_format == 'csv':
+        return CSVSink(dest, columns)
+    if output_format == 'parquet':
+        return ParquetSink(dest, columns)
+
+    raise ValueError(f"Invalid output format '{output_format}'. Supported values are {list(EXTENSIONS)}.")
+
+def read_output(path: str, index_col=None, columns=None) -> 'pd.DataFrame':
+    """
+    Reads an output file written by any sink, choosing the reader from its extension.
+    Every column is read as text, as written by the sinks.
+
+    Parameters:
+    - path (str): Path to a .csv or .parquet output file.
+    - index_col (str): Column to use as the index (default is None).
+    - columns (list): Columns to read, the others are skipped while reading (default is None, that means all of them).
+
+    Returns:
+    pd.DataFrame: The records stored in the file.
+    """
+    import pandas as pd
+
+    if path.endswith(EXTENSIONS['parquet']):
+        df = pd.read_parquet(path, columns=columns)
+        return df.set_index(index_col) if index_col is not None else df
+
+    return pd.read_csv(path, index_col=index_col, usecols=columns, dtype=str)
@@ -0,0 +1,240 @@
+import os
+import csv
+import json
+import argparse
+from collections import Counter
+from functools import partial
+from itertools import product
+from sinks import read_output, EXTENSIONS
+
+# Columns counted by default, and the ones holding comma-separated language tags.
+STATS_COLUMNS = ['Domain', 'Content_Language', 'HTML_Language', 'HTML_Dir']
+LANGUAGE_COLUMNS = {'Content_Language', 'HTML_Language'}
+
+# Name of the counts file written inside the metadata folder (its extra dot keeps it out of the inputs).
+STATS_FILE = 'stats.counts.csv'
+
+# Folder (inside the metadata folder) with the counts of every file, reused while the file is unchanged.
+CACHE_DIR = '.stats'
+
+def normalize_languages(value) -> list:
+    """
+    Normalizes a language value (e.g. 'en_US, es') into its list of tags (e.g. ['en-us', 'es']).
+    Missing values count as ''.
+    """
+    value = value if isinstance(value, str) else ''
+    return value.lower().strip().replace(' ', '').replace('_', '-').split(',')
+
+def joint_column(columns) -> str:
+    """
+    Returns the name under which the joint counts of some columns are stored (e.g. 'Domain+HTML_Language').
+    """
+    return '+'.join(columns)
+
+def count_records(records, columns=STATS_COLUMNS, joint=()) -> dict:
+    """
+    Counts the values of some columns over metadata records as they are extracted, without keeping them.
+
+    Parameters:
+    - records: List or generator of metadata records (see extract_metadata.iter_metadata).
+    - columns (list): Columns to count (default is STATS_COLUMNS).
+    - joint (list): Groups of columns whose combinations are also counted, e.g. [('Domain', 'HTML_Language')].
+      Their values are joined with '|' and stored under joint_column(group) (default is no joint counts).
+
+    Returns:
+    dict: A Counter of values for every column and joint group.
+    """
+    counts = {column: Counter() for column in columns}
+    for group in joint:
+        counts[joint_column(group)] = Counter()
+
+    needed = set(columns).union(*joint)
+    for record in records:
+        values = {}
+        for column in needed:
+            value = record[column]
+            values[column] = normalize_languages(value) if column in LANGUAGE_COLUMNS else [value if value is not None else '']
+
+        for column in columns:
+            counts[column].update(values[column])
+        for group in joint:
+            counts[joint_column(group)].update('|'.join(combination) for combination in product(*(values[c] for c in group)))
+
+    return counts
+
+def count_file(path: str, columns=STATS_COLUMNS) -> dict:
+    """
+    Counts the values of some columns of a metadata output file, language columns normalized
+    (lowercase, '_' as '-' and split by commas).
+
+    Parameters:
+    - path (str): Path to a .csv or .parquet metadata file.
+    - columns (list): Columns to count (default is STATS_COLUMNS).
+
+    Returns:
+    dict: A Counter of values for every column.
+    """
+    df = read_output(path, columns=columns).fillna('')
+
+    counts = {}
+    for column in columns:
+        # Raw values repeat a lot, so they are counted first and only the distinct ones are normalized.
+        raw_counts = df[column].value_counts()
+        if column not in LANGUAGE_COLUMNS:
+            counts[column] = Counter(raw_counts.to_dict())
+            continue
+
+        counter = Counter()
+        for value, count in raw_counts.items():
+            for language in normalize_languages(value):
+                counter[language] += count
+        counts[column] = counter
+
+    return counts
+
+def cached_count_file(path: str, columns=STATS_COLUMNS, cache_dir=None) -> dict:
+    """
+    Same as count_file, but the counts are stored in cache_dir and reused while the file keeps
+    its size and modification time.
+
+    Parameters:
+    - path (str): Path to a .csv or .parquet metadata file.
+    - columns (list): Columns to count (default is STATS_COLUMNS).
+    - cache_dir (str): Folder of the cached counts (default is None, that means no cache).
+
+    Returns:
+    dict: A Counter of values for every column.
+    """
+    if cache_dir is None: return count_file(path, columns)
+
+    stat = os.stat(path)
+    version = [stat.st_size, stat.st_mtime_ns]
+    cache_file = f'{cache_dir}/{os.path.basename(path)}.json'
+
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r') as file:
+                cached = json.load(file)
+            if cached['version'] == version and all(column in cached['counts'] for column in columns):
+                return {column: Counter(cached['counts'][column]) for column in columns}
+        except (ValueError, KeyError):
+            pass
+
+    counts = count_file(path, columns)
+
+    with open(f'{cache_file}.tmp', 'w') as file:
+        json.dump({'version': version, 'counts': counts}, file)
+    os.replace(f'{cache_file}.tmp', cache_file)
+
+    return counts
+
+def merge_counts(total: dict, counts: dict) -> dict:
+    """
+    Adds the counters of 'counts' into 'total' (in place), column by column.
+
+    Returns:
+    dict: total.
+    """
+    for column, counter in counts.items():
+        total.setdefault(column, Counter()).update(counter)
+
+    return total
+
+def save_counts(dest: str, counts: dict):
+    """
+    Saves counters to a CSV file with Column, Value and Count columns (most common values first).
+
+    Parameters:
+    - dest (str): Path of the counts file.
+    - counts (dict): A Counter of values for every column.
+    """
+    # Several nodes may save the same total at once.
+    tmp = f'{dest}.{os.getpid()}.{os.urandom(4).hex()}.tmp'
+    with open(tmp, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Column', 'Value', 'Count'])
+        for column, counter in counts.items():
+            for value, count in counter.most_common():
+                writer.writerow([column, value, count])
+
+    os.replace(tmp, dest)
+
+def load_counts(path: str) -> dict:
+    """
+    Loads a counts file written by save_counts.
+
+    Returns:
+    dict: A Counter of values for every column.
+    """
+    counts = {}
+    with open(path, 'r', newline='') as file:
+        for row in csv.DictReader(file):
+            counts.setdefault(row['Column'], Counter())[row['Value']] = int(row['Count'])
+
+    return counts
+
+def get_output_files(folder: str) -> list:
+    """
+    Returns the metadata output files of a folder ('<name>.csv' or '<name>.parquet'). Content, joined
+    and counts files are left out, since their names contain more dots.
+    """
+    return sorted(f'{folder}/{file}' for file in os.listdir(folder)
+                  if file.count('.') == 1 and os.path.splitext(file)[1] in EXTENSIONS.values())
+
+def compute_stats(folder: str, columns=STATS_COLUMNS, num_workers=1, cache=True) -> dict:
+    """
+    Counts the values of some columns over every metadata file of a folder. Every file is counted on
+    its own in a pool of processes and only its counters are merged, so memory only grows with the
+    number of distinct values.
+
+    Parameters:
+    - folder (str): Folder containing the metadata files (e.g. the 'dest' folder of extract_metadata.py).
+    - columns (list): Columns to count (default is STATS_COLUMNS).
+    - num_workers (int): Number of worker processes (default is 1).
+    - cache (bool): Reuse the counts of the files that did not change since the last run (default is True).
+
+    Returns:
+    dict: A Counter of values for every column.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    files = get_output_files(folder)
+
+    cache_dir = f'{folder}/{CACHE_DIR}' if cache else None
+    if cache_dir is not None: os.makedirs(cache_dir, exist_ok=True)
+
+    total = {column: Counter() for column in columns}
+    count = partial(cached_count_file, columns=columns, cache_dir=cache_dir)
+
+    if num_workers <= 1:
+        for counts in map(count, files):
+            merge_counts(total, counts)
+        return total
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        for counts in pool.map(count, files, chunksize=max(1, len(files) // (num_workers * 16))):
+            merge_counts(total, counts)
+
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Count the values of the metadata extracted from WARC files.')
+
+    parser.add_argument('dest', help='Folder containing the metadata files.')
+    parser.add_argument('--output', help=f"Counts file (default is '{STATS_FILE}' inside dest).", required=False)
+    parser.add_argument('--columns', help=f'Columns to count (default is {" ".join(STATS_COLUMNS)}).', nargs='+', required=False)
+    parser.add_argument('--num_workers', help='Number of worker processes (default is 1).', required=False)
+    parser.add_argument('--without_cache', help='Counts every file again, ignoring the cached counts.', action='store_true')
+
+    args = parser.parse_args()
+
+    columns = args.columns or STATS_COLUMNS
+    num_workers = int(args.num_workers) if args.num_workers != None else 1
+    output = args.output or f'{args.dest}/{STATS_FILE}'
+
+    counts = compute_stats(args.dest, columns, num_workers=num_workers, cache=not args.without_cache)
+    save_counts(output, counts)
+
+    for column, counter in counts.items():
+        print(f'{column}: {len(counter)} values, {sum(counter.values())} total')
@@ -0,0 +1,19 @@
+import os
+import sys
+import pytest
+
+# The modules live at the root of the repository.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def crawl(tmp_path_factory):
+    """
+    Synthetic crawl of benchmark.Fixtures (2 WARC/WET pairs), served by a local HTTP server standing in
+    for data.commoncrawl.org (utils.BASE_URL points to it).
+    """
+    from benchmark import Fixtures
+
+    fixtures = Fixtures(str(tmp_path_factory.mktemp('crawl')), num_files=2, num_records=200)
+    fixtures.serve()
+    yield fixtures
+    fixtures.close()
@@ -0,0 +1,91 @@
+import os
+import pytest
+from extract_metadata import run_pipeline, counts_file, merge_counts_files, save_total_counts
+from stats import load_counts, STATS_FILE
+from coordinator import SQLiteCoordinator
+
+@pytest.fixture(autouse=True)
+def served(crawl):
+    crawl.serve()
+
+def modified(dest_path, names) -> dict:
+    # Modification time of the counts file of every WARC file (the parse stage runs in worker processes).
+    return {name: os.stat(counts_file(str(dest_path), name)).st_mtime_ns for name in names}
+
+def test_resume_merges_the_counts_of_written_files(crawl, tmp_path):
+    run_pipeline(crawl.warc_paths_file, dest_path=str(tmp_path), streaming=True, aggregate=True)
+    total = load_counts(f'{tmp_path}/{STATS_FILE}')
+    before = modified(tmp_path, crawl.names)
+
+    # Only the file without counts is counted again, the other one is merged from its counts file.
+    os.remove(f'{tmp_path}/{STATS_FILE}')
+    os.remove(counts_file(str(tmp_path), crawl.names[0]))
+    run_pipeline(crawl.warc_paths_file, dest_path=str(tmp_path), streaming=True, aggregate=True, resume=True)
+    after = modified(tmp_path, crawl.names)
+    assert after[crawl.names[1]] == before[crawl.names[1]]
+    assert load_counts(f'{tmp_path}/{STATS_FILE}') == total
+
+    # Without --resume, files with counts are skipped as well.
+    run_pipeline(crawl.warc_paths_file, dest_path=str(tmp_path), streaming=True, aggregate=True)
+    assert modified(tmp_path, crawl.names) == after
+    assert load_counts(f'{tmp_path}/{STATS_FILE}') == total
+
+def test_resume_counts_the_files_written_without_aggregate(crawl, tmp_path):
+    single = tmp_path / 'single'
+    os.makedirs(single)
+    run_pipeline(crawl.warc_paths_file, dest_path=str(single), streaming=True, aggregate=True)
+
+    # The manifest has the metadata files of a normal run, which are not counts files.
+    dest_path = str(tmp_path / 'dest')
+    os.makedirs(dest_path)
+    run_pipeline(crawl.warc_paths_file, dest_path=dest_path, streaming=True)
+    run_pipeline(crawl.warc_paths_file, dest_path=dest_path, streaming=True, aggregate=True, resume=True)
+    assert all(os.path.exists(counts_file(dest_path, name)) for name in crawl.names)
+    assert load_counts(f'{dest_path}/{STATS_FILE}') == load_counts(f'{single}/{STATS_FILE}')
+
+def test_failed_runs_do_not_save_the_total(crawl, tmp_path):
+    paths_file = f'{tmp_path}/warc.paths'
+    with open(crawl.warc_paths_file) as file, open(paths_file, 'w') as dest:
+        dest.write(file.read().rstrip('\n') + '\ncrawl-data/missing.warc.gz\n')
+
+    dest_path = tmp_path / 'dest'
+    os.makedirs(dest_path)
+    run_pipeline(paths_file, dest_path=str(dest_path), streaming=True, aggregate=True)
+
+    assert not os.path.exists(f'{dest_path}/{STATS_FILE}')
+    assert all(os.path.exists(counts_file(str(dest_path), name)) for name in crawl.names)
+
+def test_shards_do_not_save_the_total(crawl, tmp_path):
+    single = tmp_path / 'single'
+    os.makedirs(single)
+    run_pipeline(crawl.warc_paths_file, dest_path=str(single), streaming=True, aggregate=True)
+
+    # Every shard only writes the counts of its files, the total is merged once every shard is done.
+    dest_path = str(tmp_path / 'shards')
+    os.makedirs(dest_path)
+    for shard_id in range(2):
+        assert not save_total_counts(crawl.warc_paths_file, dest_path)
+        run_pipeline(crawl.warc_paths_file, dest_path=dest_path, streaming=True, aggregate=True, shard=(shard_id, 2))
+        assert not os.path.exists(f'{dest_path}/{STATS_FILE}')
+
+    assert save_total_counts(crawl.warc_paths_file, dest_path)
+    assert load_counts(f'{dest_path}/{STATS_FILE}') == load_counts(f'{single}/{STATS_FILE}')
+
+def test_nodes_save_the_total_once_the_job_is_done(crawl, tmp_path):
+    # Another node claimed the first path and gave it up: the job is not done when this node finishes.
+    coordinator = SQLiteCoordinator(f'{tmp_path}/coordinator.sqlite', max_attempts=1)
+    with open(crawl.warc_paths_file) as file: coordinator.add(file)
+    path = coordinator.claim('other')[0]
+    coordinator.fail('other', path, 'killed')
+
+    dest_path = str(tmp_path / 'dest')
+    os.makedirs(dest_path)
+    run_pipeline(crawl.warc_paths_file, dest_path=dest_path, streaming=True, aggregate=True, coordinator=coordinator)
+    assert merge_counts_files(crawl.warc_paths_file, dest_path)[1] == 1
+    assert not os.path.exists(f'{dest_path}/{STATS_FILE}')
+
+    # Once it is done (here by a second job over the same folder), the node finishing last merges every counts file.
+    run_pipeline(crawl.warc_paths_file, dest_path=dest_path, streaming=True, aggregate=True,
+                 coordinator=SQLiteCoordinator(f'{tmp_path}/coordinator.sqlite', job='again'))
+    total, missing = merge_counts_files(crawl.warc_paths_file, dest_path)
+    assert missing == 0 and load_counts(f'{dest_path}/{STATS_FILE}') == total
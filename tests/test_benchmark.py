@@ -0,0 +1,29 @@
+from benchmark import compare
+
+BASELINE = {'results': {
+    'get_metadata': {'seconds': 1.0, 'records_per_s': 1000, 'traced_peak_mb': 10.0},
+    'save_metadata': {'seconds': 2.0, 'build_seconds': 1.0},
+    'dedup': {'seconds': 3.0},
+}}
+
+def test_slower_metrics_are_regressions():
+    report = {'results': {
+        'get_metadata': {'seconds': 1.05, 'records_per_s': 500, 'traced_peak_mb': 12.0},
+        'save_metadata': {'seconds': 2.5, 'build_seconds': 5.0},
+    }}
+    assert compare(report, BASELINE) == [('get_metadata', 'traced_peak_mb', 10.0, 12.0, 1.2),
+                                         ('save_metadata', 'seconds', 2.0, 2.5, 1.25)]
+    assert compare(report, BASELINE, threshold=0.3) == []
+
+def test_failed_and_missing_metrics_are_regressions():
+    report = {'results': {
+        'get_metadata': {'records_per_s': 1000, 'traced_peak_mb': None},
+        'save_metadata': {'error': 'ValueError: broken'},
+    }}
+    assert compare(report, BASELINE) == [('get_metadata', 'seconds', 1.0, None, None),
+                                         ('get_metadata', 'traced_peak_mb', 10.0, None, None),
+                                         ('save_metadata', 'error', None, 'ValueError: broken', None)]
+
+    # New benchmarks and benchmarks that failed in the baseline only are compared when they run.
+    assert compare({'results': {'dedup': {'seconds': 3.0}, 'new': {'seconds': 1.0}}},
+                   {'results': {'dedup': {'error': 'KeyError: x'}}}) == []
@@ -0,0 +1,121 @@
+import io
+import os
+import time
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+import pytest
+import cache
+from cache import DownloadCache, CachingReader
+
+PATH = 'crawl-data/CC-MAIN-2024-10/segments/1/warc/file.warc.gz'
+DATA = os.urandom(1000)
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Every access is strictly later than the previous one.
+    ticks = itertools.count()
+    monkeypatch.setattr(cache.time, 'time', lambda: float(next(ticks)))
+
+def writer(data: bytes, calls: list, delay=0):
+    def download(file_path):
+        calls.append(file_path)
+        time.sleep(delay)
+        with open(file_path, 'wb') as file: file.write(data)
+    return download
+
+def fetch_in_process(cache_dir: str, calls_file: str) -> str:
+    def download(file_path):
+        with open(calls_file, 'a') as file: file.write(f'{os.getpid()}\n')
+        time.sleep(0.5)
+        with open(file_path, 'wb') as file: file.write(DATA)
+    return DownloadCache(cache_dir).fetch(PATH, download)
+
+def test_concurrent_threads_download_once(tmp_path):
+    downloads = DownloadCache(str(tmp_path))
+    calls, results = [], []
+    threads = [threading.Thread(target=lambda: results.append(downloads.fetch(PATH, writer(DATA, calls, delay=0.3))))
+               for _ in range(4)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+
+    assert len(calls) == 1
+    assert results == [downloads.file_path(PATH)] * 4
+    with open(results[0], 'rb') as file: assert file.read() == DATA
+
+def test_concurrent_processes_download_once(tmp_path):
+    calls_file = f'{tmp_path}/calls'
+    with ProcessPoolExecutor(max_workers=3) as pool:
+        results = list(pool.map(fetch_in_process, [f'{tmp_path}/cache'] * 3, [calls_file] * 3))
+
+    with open(calls_file) as file: assert len(file.read().split()) == 1
+    assert len(set(results)) == 1 and DownloadCache(f'{tmp_path}/cache').get(PATH) == results[0]
+
+def test_evict_least_recently_used(tmp_path, clock):
+    downloads = DownloadCache(str(tmp_path), max_size=250 / 2**30)
+    for name in 'abc':
+        if name == 'c': downloads.get('a')
+        downloads.fetch(name, writer(os.urandom(100), []))
+
+    # 'b' is the least recently used when 'c' goes over the budget.
+    assert [downloads.get(name) is not None for name in 'abc'] == [True, False, True]
+    assert downloads.size() == 200
+
+    # A file larger than the budget evicts every other file, but is kept itself.
+    downloads.fetch('d', writer(os.urandom(300), []))
+    assert [downloads.get(name) is not None for name in 'abcd'] == [False, False, False, True]
+    assert downloads.size() == 300
+
+def test_corrupted_entries_are_downloaded_again(tmp_path):
+    downloads = DownloadCache(str(tmp_path))
+    calls = []
+    path = downloads.fetch(PATH, writer(DATA, calls))
+
+    with open(path, 'r+b') as file: file.truncate(500)
+    assert downloads.get(PATH) is None and not os.path.exists(path)
+    assert downloads.fetch(PATH, writer(DATA, calls)) == path and len(calls) == 2
+
+    # Same size, different bytes: only found by the checksum.
+    with open(path, 'r+b') as file: file.write(b'\x00' * 10)
+    assert downloads.get(PATH) == path
+    assert DownloadCache(str(tmp_path), verify=True).fetch(PATH, writer(DATA, calls)) == path and len(calls) == 3
+    with open(path, 'rb') as file: assert file.read() == DATA
+
+def test_failed_downloads_are_not_cached(tmp_path):
+    downloads = DownloadCache(str(tmp_path))
+    def fail(file_path):
+        with open(file_path, 'wb') as file: file.write(DATA[:10])
+        raise ConnectionError('dropped')
+
+    with pytest.raises(ConnectionError):
+        downloads.fetch(PATH, fail)
+    assert downloads.get(PATH) is None and os.listdir(os.path.dirname(downloads.file_path(PATH))) == []
+
+class Stream(io.BytesIO):
+    def __init__(self, data: bytes, total=None):
+        super().__init__(data)
+        if total is not None: self.total = total
+
+def read_all(reader, size=100) -> bytes:
+    chunks = []
+    while chunk := reader.read(size): chunks.append(chunk)
+    return b''.join(chunks)
+
+def test_caching_reader(tmp_path):
+    downloads = DownloadCache(str(tmp_path))
+    with CachingReader(downloads, PATH, Stream(DATA, total=len(DATA))) as reader:
+        assert read_all(reader) == DATA
+    with open(downloads.get(PATH), 'rb') as file: assert file.read() == DATA
+
+@pytest.mark.parametrize('stream, read', [
+    # Not read to the end.
+    (Stream(DATA), lambda reader: reader.read(500)),
+    # Read to the end, but shorter than expected (e.g. a dropped connection).
+    (Stream(DATA, total=len(DATA) + 1), read_all),
+])
+def test_incomplete_streams_are_not_cached(tmp_path, stream, read):
+    downloads = DownloadCache(str(tmp_path))
+    with CachingReader(downloads, PATH, stream) as reader:
+        read(reader)
+
+    assert downloads.get(PATH) is None and not os.path.exists(reader.tmp)
@@ -0,0 +1,189 @@
+import os
+import random
+import socket
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import requests
+import client
+from client import HTTPClient
+
+DATA = random.Random(0).randbytes(300000)
+
+class FaultyServer:
+    """
+    Local server of DATA at /file that answers every request with the next fault of a script, then normally:
+    - ('503', seconds): 503 with a Retry-After header.
+    - ('cut', size): the requested bytes with their full Content-Length, but the connection is closed after 'size' of them.
+    - ('ignore_range',): the whole body with 200, whatever the Range header.
+    Every request is recorded with its Range header.
+    """
+    def __init__(self):
+        self.script = []
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args): pass
+
+            def do_GET(self):
+                request_range = self.headers.get('Range')
+                server.requests.append(request_range)
+                fault = server.script.pop(0) if server.script else ('ok',)
+
+                if fault[0] == '503':
+                    self.send_response(503)
+                    self.send_header('Retry-After', str(fault[1]))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+
+                start, end = 0, len(DATA) - 1
+                if request_range is not None and fault[0] != 'ignore_range':
+                    first, _, last = request_range.removeprefix('bytes=').partition('-')
+                    start, end = int(first), min(int(last) if last else end, len(DATA) - 1)
+                    if start >= len(DATA):
+                        self.send_response(416)
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    self.send_response(206)
+                    self.send_header('Content-Range', f'bytes {start}-{end}/{len(DATA)}')
+                else:
+                    self.send_response(200)
+
+                body = DATA[start:end + 1]
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+
+                if fault[0] == 'cut':
+                    self.wfile.write(body[:fault[1]])
+                    self.wfile.flush()
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    self.close_connection = True
+                    return
+
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/file'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def server():
+    server = FaultyServer()
+    yield server
+    server.close()
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # Delays of the retries, recorded instead of slept.
+    delays = []
+    monkeypatch.setattr(client.time, 'sleep', delays.append)
+    return delays
+
+def totals(http: HTTPClient) -> dict:
+    stats = http.metrics().values()
+    return {key: sum(s[key] for s in stats) for key in ('requests', 'retries', 'bytes')}
+
+def test_download_retries_503_and_resumes_dropped_connections(server, sleeps, tmp_path):
+    server.script = [('503', 7), ('cut', 100000), ('cut', 50000)]
+    http = HTTPClient(max_retries=5, timeout=(5, 5))
+
+    size = http.download(server.url, f'{tmp_path}/file')
+
+    assert size == len(DATA)
+    assert open(f'{tmp_path}/file', 'rb').read() == DATA
+    assert not os.path.exists(f'{tmp_path}/file.part')
+    assert server.requests == [None, None, 'bytes=100000-', 'bytes=150000-']
+    assert sleeps[0] == 7
+    assert totals(http) == {'requests': 4, 'retries': 3, 'bytes': len(DATA)}
+
+def test_download_starts_over_when_range_is_ignored(server, sleeps, tmp_path):
+    server.script = [('cut', 100000), ('ignore_range',)]
+    http = HTTPClient(timeout=(5, 5))
+
+    http.download(server.url, f'{tmp_path}/file')
+
+    assert open(f'{tmp_path}/file', 'rb').read() == DATA
+    assert server.requests == [None, 'bytes=100000-']
+
+def test_download_gives_up_after_max_retries(server, sleeps, tmp_path):
+    server.script = [('503', 1)] * 10
+    http = HTTPClient(max_retries=2, timeout=(5, 5))
+
+    with pytest.raises(requests.HTTPError):
+        http.download(server.url, f'{tmp_path}/file')
+
+    assert len(server.requests) == 3
+    assert sleeps == [1, 1]
+    assert not os.path.exists(f'{tmp_path}/file')
+
+def test_resumable_reader_resumes_dropped_connections(server, sleeps):
+    server.script = [('503', 2), ('cut', 120000)]
+    http = HTTPClient(timeout=(5, 5))
+
+    with http.open(server.url) as reader:
+        data = b''.join(iter(lambda: reader.read(1 << 14), b''))
+
+    assert data == DATA
+    assert server.requests == [None, None, 'bytes=120000-']
+    assert totals(http)['retries'] == 2
+
+def test_resumable_reader_fails_when_range_is_ignored(server, sleeps):
+    server.script = [('cut', 120000), ('ignore_range',)]
+    http = HTTPClient(timeout=(5, 5))
+
+    with pytest.raises(IOError, match='does not support Range'):
+        with http.open(server.url) as reader:
+            while reader.read(1 << 14): pass
+
+def test_range_reader_retries_cut_ranges(server, sleeps):
+    # The second request (bytes 65536-196607) is cut after 1000 bytes and requested again.
+    server.script = [('ok',), ('cut', 1000), ('503', 3)]
+    http = HTTPClient(timeout=(5, 5))
+
+    with http.open_range(server.url, initial_size=1 << 16) as reader:
+        data = b''.join(iter(lambda: reader.read(1 << 14), b''))
+
+    assert data == DATA
+    assert server.requests == ['bytes=0-65535', 'bytes=65536-196607', 'bytes=65536-196607', 'bytes=65536-196607', 'bytes=196608-458751']
+    assert sleeps[1] == 3
+
+def test_range_reader_streams_when_range_is_ignored(server, sleeps):
+    server.script = [('ignore_range',)]
+    http = HTTPClient(timeout=(5, 5))
+
+    with http.open_range(server.url, initial_size=1 << 16) as reader:
+        data = b''.join(iter(lambda: reader.read(1 << 14), b''))
+
+    assert data == DATA
+    assert len(server.requests) == 1
+
+def test_slots_cover_body_streaming(server, sleeps):
+    http = HTTPClient(max_connections=1, timeout=(5, 5))
+
+    reader = http.open(server.url)
+    reader.read(1000)
+    # The body is still being streamed, so no other request may start.
+    assert not http._slots.acquire(blocking=False)
+    reader.close()
+    assert http._slots.acquire(blocking=False)
+    http._slots.release()
+
+    server.script = [('ignore_range',)]
+    reader = http.open_range(server.url, initial_size=1 << 16)
+    assert not http._slots.acquire(blocking=False)
+    reader.close()
+    assert http._slots.acquire(blocking=False)
+    http._slots.release()
+
+    # Range requests release the slot once read.
+    with http.open_range(server.url, initial_size=1 << 16) as reader:
+        reader.read(1000)
+        assert http._slots.acquire(blocking=False)
+        http._slots.release()
@@ -0,0 +1,117 @@
+import time
+import threading
+import pytest
+import coordinator
+from coordinator import SQLiteCoordinator, RedisCoordinator, PathQueue, PENDING, LEASED, DONE, FAILED
+from scheduler import run_scheduler
+
+PATHS = [f'crawl-data/file-{i}.warc.gz' for i in range(5)]
+
+# Leases expire quickly, so expired leases can be tested without waiting long.
+LEASE = 0.3
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def make_coordinator(request, tmp_path):
+    if request.param == 'sqlite':
+        return lambda **kwargs: SQLiteCoordinator(f'{tmp_path}/coordinator.sqlite', **kwargs)
+
+    import fakeredis
+    server = fakeredis.FakeServer()
+    return lambda **kwargs: RedisCoordinator(fakeredis.FakeRedis(server=server), **kwargs)
+
+def counts(status: dict) -> tuple:
+    return tuple(status[state] for state in (PENDING, LEASED, DONE, FAILED))
+
+def test_claims_are_exclusive_and_in_order(make_coordinator):
+    c = make_coordinator()
+    assert c.add(line + '\n' for line in PATHS) == len(PATHS)
+    assert c.add(PATHS) == 0
+
+    assert c.claim('a', 2) == PATHS[:2]
+    assert c.claim('b') == PATHS[2:3]
+    assert c.claim('b', 10) == PATHS[3:]
+    assert c.claim('a') == []
+    assert counts(c.status()) == (0, 5, 0, 0)
+
+    c.complete('a', PATHS[0])
+    assert counts(c.status()) == (0, 4, 1, 0) and c.status()['total'] == 5
+
+def test_expired_leases_are_claimed_again(make_coordinator):
+    c = make_coordinator(lease_seconds=LEASE, max_attempts=2)
+    c.add(PATHS[:2])
+    assert c.claim('a', 2) == PATHS[:2]
+
+    time.sleep(LEASE / 2)
+    assert c.renew('a', [PATHS[0]]) == []
+    time.sleep(LEASE * 3 / 4)
+
+    # Only the lease that was not renewed expired.
+    assert c.status()['expired'] == 1
+    assert c.claim('b', 2) == [PATHS[1]]
+    assert c.renew('a', PATHS[:2]) == [PATHS[1]]
+
+    # A path whose lease expired max_attempts times is given up.
+    time.sleep(LEASE * 1.5)
+    assert c.claim('c', 2) == [PATHS[0]]
+    assert counts(c.status()) == (0, 1, 0, 1)
+
+def test_release_does_not_count_an_attempt(make_coordinator):
+    c = make_coordinator(max_attempts=1)
+    c.add(PATHS[:2])
+    assert c.claim('a', 2) == PATHS[:2]
+
+    # Leases of another node are left alone.
+    c.release('b', PATHS[:2])
+    assert counts(c.status()) == (0, 2, 0, 0)
+
+    c.release('a', [PATHS[1]])
+    assert counts(c.status()) == (1, 1, 0, 0)
+    assert c.claim('b') == [PATHS[1]]
+
+def test_failed_paths_are_retried_until_max_attempts(make_coordinator):
+    c = make_coordinator(max_attempts=2)
+    c.add(PATHS[:1])
+
+    assert c.claim('a') == PATHS[:1]
+    c.fail('b', PATHS[0], 'not the owner')
+    assert counts(c.status()) == (0, 1, 0, 0)
+
+    c.fail('a', PATHS[0], 'error')
+    assert counts(c.status()) == (1, 0, 0, 0)
+    assert c.claim('b') == PATHS[:1]
+    c.fail('b', PATHS[0], 'error')
+    assert counts(c.status()) == (0, 0, 0, 1)
+    assert c.claim('a') == []
+
+def test_nodes_claim_only_for_free_workers(make_coordinator, tmp_path):
+    c = make_coordinator()
+    paths_file = f'{tmp_path}/warc.paths'
+    with open(paths_file, 'w') as file: file.write('\n'.join(PATHS) + '\n')
+
+    leased = []
+    def fetch(path):
+        leased.append(c.status()[LEASED])
+        return path
+
+    with PathQueue(paths_file, coordinator=c) as queue:
+        assert queue.prefetch(4) == 0
+        for paths in queue.rounds():
+            run_scheduler(paths, work=len, fetch=fetch, num_workers=1, prefetch=queue.prefetch(4),
+                          on_done=lambda path, result, error: queue.done(path, error))
+
+    assert len(leased) == len(PATHS) and max(leased) == 1
+    assert counts(c.status()) == (0, 0, 5, 0)
+
+def test_idle_nodes_notice_the_end_of_the_job_quickly(make_coordinator, tmp_path):
+    c = make_coordinator()
+    paths_file = f'{tmp_path}/warc.paths'
+    with open(paths_file, 'w') as file: file.write(PATHS[0] + '\n')
+    c.add(PATHS[:1])
+    c.claim('other')
+
+    with PathQueue(paths_file, coordinator=c) as queue:
+        # The other node finishes while this one is waiting.
+        threading.Timer(0.1, c.complete, ('other', PATHS[0])).start()
+        begin = time.perf_counter()
+        assert queue.wait() is False
+        assert time.perf_counter() - begin < coordinator.POLL_INTERVAL / 2
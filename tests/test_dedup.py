@@ -0,0 +1,239 @@
+import os
+import re
+import csv
+import random
+import numpy as np
+import pytest
+import dedup
+import extract_text
+import warcapi
+from dedup import (shingle_hashes, minhash_signatures, find_duplicates, save_masks, deduplicate, signature_dtype,
+                   SignatureWriter, SIGNATURE_SUFFIX, MASK_SUFFIX, NUM_PERM, SHINGLE_SIZE, MAX_HASH)
+from extract_text import iter_text_rows
+from extract_metadata import iter_metadata_rows, save_metadata
+from warcapi import WARCChunk, DuplicateFilter
+from sinks import read_output
+
+MASK = (1 << 64) - 1
+
+def mix(value: int) -> int:
+    value ^= value >> 30
+    value = value * 0xBF58476D1CE4E5B9 & MASK
+    value ^= value >> 27
+    value = value * 0x94D049BB133111EB & MASK
+    return value ^ (value >> 31)
+
+def reference_hashes(text: str, shingle_size=SHINGLE_SIZE) -> list:
+    # shingle_hashes of a single text, a word and a shingle at a time.
+    positions, weights, _, _ = (array.tolist() for array in dedup._coefficients(NUM_PERM, shingle_size))
+    words = [mix(sum((byte + 1) * positions[i & 63] for i, byte in enumerate(word)) & MASK)
+             for word in re.split(rb'[\t\n\v\f\r ]+', text.lower().encode('utf-8', errors='replace')) if word]
+    if not words: return []
+    if len(words) < shingle_size: return [mix(sum(word * weights[0] for word in words) & MASK)]
+
+    return [mix(sum(words[i + j] * weights[j] for j in range(shingle_size)) & MASK)
+            for i in range(len(words) - shingle_size + 1)]
+
+def reference_signature(text: str) -> np.ndarray:
+    _, _, multipliers, increments = dedup._coefficients(NUM_PERM, SHINGLE_SIZE)
+    hashes = np.array(reference_hashes(text), dtype=np.uint64)
+    if not len(hashes): return np.full(NUM_PERM, MAX_HASH, dtype=np.uint32)
+
+    with np.errstate(over='ignore'):
+        return ((multipliers[:, None] * hashes[None, :] + increments[:, None]) >> np.uint64(32)).min(axis=1).astype(np.uint32)
+
+def random_text(rng: random.Random, num_words: int) -> str:
+    vocabulary = ['hola', 'mundo', 'Página', 'TEXTO', 'ñandú', 'café', 'casa', 'perro', 'gato', 'árbol']
+    return ''.join(rng.choice(vocabulary) + rng.choice([' ', '  ', '\n', '\t', ' \r\n']) for _ in range(num_words))
+
+@pytest.fixture
+def texts():
+    rng = random.Random(0)
+    # Empty and whitespace texts, texts shorter than a shingle, and long ones (between and at both ends of the batch).
+    return ['', 'one', 'Two words', ' \n\t', 'a b c d', 'a b c d e'] + \
+        [random_text(rng, rng.choice([0, 1, 4, 5, 6, 50, 300])) for _ in range(40)] + [random_text(rng, 3000), '']
+
+def test_shingle_hashes(texts):
+    hashes, starts = shingle_hashes(texts)
+    assert len(starts) == len(texts) + 1 and starts[-1] == len(hashes)
+    for i, text in enumerate(texts):
+        assert hashes[starts[i]:starts[i + 1]].tolist() == reference_hashes(text)
+
+    # Lowercased, split on any run of whitespace.
+    assert reference_hashes('A  b\nC d') == reference_hashes('a b c d') and len(reference_hashes('a b c d e f')) == 2
+
+    hashes, starts = shingle_hashes(['', ' \n'])
+    assert len(hashes) == 0 and starts.tolist() == [0, 0, 0]
+    assert len(shingle_hashes([])[0]) == 0
+
+@pytest.mark.parametrize('block_size', [dedup.BLOCK_SIZE, 7, 64, 1])
+def test_batch_matches_single_texts(texts, monkeypatch, block_size):
+    # Small blocks split texts and start in the middle of others (or of empty ones).
+    monkeypatch.setattr(dedup, 'BLOCK_SIZE', block_size)
+    signatures = minhash_signatures(texts)
+    assert signatures.shape == (len(texts), NUM_PERM) and signatures.dtype == np.uint32
+
+    for text, signature in zip(texts, signatures):
+        assert np.array_equal(signature, minhash_signatures([text])[0])
+        assert np.array_equal(signature, reference_signature(text))
+
+def test_empty_and_short_texts():
+    empty, blank, short, upper, other = minhash_signatures(['', ' \n', 'a b c', 'A  B\nc', 'a b d'])
+    assert (empty == MAX_HASH).all() and (blank == MAX_HASH).all()
+    assert np.array_equal(short, upper) and (short < MAX_HASH).all()
+    assert not np.array_equal(short, other)
+
+def test_signature_writer(texts, tmp_path):
+    path = f'{tmp_path}/file{SIGNATURE_SUFFIX}'
+    with SignatureWriter(path, batch_size=7) as writer:
+        for i, text in enumerate(texts): writer.add(f'<urn:{i}>', text)
+    assert writer.rows == len(texts)
+
+    entries = np.load(path)
+    assert entries.dtype == signature_dtype() and [record_id.decode() for record_id in entries['id']] == [f'<urn:{i}>' for i in range(len(texts))]
+    assert np.array_equal(entries['signature'], minhash_signatures(texts))
+
+    # Nothing is written when the extraction fails.
+    with pytest.raises(ValueError):
+        with SignatureWriter(f'{tmp_path}/failed{SIGNATURE_SUFFIX}') as writer:
+            writer.add('<urn:0>', 'text')
+            raise ValueError()
+    assert sorted(os.listdir(tmp_path)) == [f'file{SIGNATURE_SUFFIX}']
+
+def write_signatures(path: str, records: list):
+    entries = np.empty(len(records), dtype=signature_dtype())
+    entries['id'] = [record_id.encode() for record_id, _ in records]
+    entries['signature'] = [signature for _, signature in records]
+    np.save(path, entries)
+
+def read_mask(path: str) -> list:
+    with open(path, 'r', encoding='utf-8', newline='') as file:
+        return list(csv.reader(file))
+
+@pytest.fixture
+def chain(tmp_path):
+    # r1 agrees with r0 and r2 on 108 of 128 values, but r0 and r2 only on 88 (and share some bands).
+    rng = np.random.default_rng(0)
+    def signature(): return rng.integers(0, 1 << 32, NUM_PERM, dtype=np.uint32)
+    r0 = signature()
+    r1 = r0.copy()
+    r1[:20] = signature()[:20]
+    r2 = r1.copy()
+    r2[108:] = signature()[108:]
+    assert (r0 == r2).sum() == 88
+
+    # The chain spans both files, and its first record is r2.
+    folder = f'{tmp_path}/signatures'
+    os.makedirs(folder)
+    write_signatures(f'{folder}/a{SIGNATURE_SUFFIX}', [('<urn:a:0>', signature()), ('<urn:r2>', r2), ('<urn:a:2>', signature())])
+    write_signatures(f'{folder}/b{SIGNATURE_SUFFIX}', [('<urn:r1>', r1), ('<urn:b:1>', signature()), ('<urn:r0>', r0)])
+    # Other files are ignored.
+    write_signatures(f'{folder}/c.npy', [('<urn:c:0>', r0)])
+    return folder
+
+@pytest.mark.parametrize('pair_batch', [1 << 16, 1])
+def test_duplicate_chain_is_one_cluster(chain, pair_batch):
+    files, starts, labels = find_duplicates([chain], pair_batch=pair_batch)
+    assert [os.path.basename(path) for path in files] == [f'a{SIGNATURE_SUFFIX}', f'b{SIGNATURE_SUFFIX}']
+    assert starts.tolist() == [0, 3, 6]
+    assert labels.tolist() == [0, 1, 2, 1, 4, 1]
+
+    # Without r1, r0 and r2 are not duplicates (but still LSH candidates).
+    os.remove(f'{chain}/b{SIGNATURE_SUFFIX}')
+    os.rename(f'{chain}/c.npy', f'{chain}/c{SIGNATURE_SUFFIX}')
+    assert find_duplicates([chain], pair_batch=pair_batch)[2].tolist() == [0, 1, 2, 3]
+    assert find_duplicates([chain], threshold=0)[2].tolist() == [0, 1, 2, 1]
+
+def test_find_duplicates_arguments(chain, tmp_path):
+    # Files and folders, in the given order (a file given twice has the same records twice).
+    files, _, labels = find_duplicates([f'{chain}/b{SIGNATURE_SUFFIX}', chain, f'{chain}/c.npy'])
+    assert [os.path.basename(path) for path in files] == [f'b{SIGNATURE_SUFFIX}', f'a{SIGNATURE_SUFFIX}', f'b{SIGNATURE_SUFFIX}']
+    assert labels.tolist() == [0, 1, 0, 3, 0, 5, 0, 1, 0]
+
+    with pytest.raises(ValueError):
+        find_duplicates([chain], num_bands=3)
+
+    files, starts, labels = find_duplicates([f'{tmp_path}/missing'])
+    assert files == [] and starts.tolist() == [0] and len(labels) == 0
+
+def test_union():
+    labels = np.arange(8, dtype=np.int64)
+    # A chain given backwards, and pairs already merged.
+    dedup._union(labels, np.array([6, 5, 4, 1]), np.array([7, 6, 5, 3]))
+    dedup._union(labels, np.array([7, 3, 0]), np.array([4, 1, 2]))
+    assert dedup._find(labels, np.arange(8)).tolist() == [0, 1, 0, 1, 4, 4, 4, 4]
+
+def test_masks(chain, tmp_path):
+    stats = deduplicate([chain])
+    assert stats == {'files': 2, 'records': 6, 'duplicates': 2, 'clusters': 1}
+
+    # Next to every signature file, in the order of its records.
+    assert read_mask(f'{chain}/a{MASK_SUFFIX}') == [
+        ['WARC_Record_ID', 'Keep', 'Duplicate_Of'],
+        ['<urn:a:0>', '1', ''], ['<urn:r2>', '1', ''], ['<urn:a:2>', '1', ''],
+    ]
+    assert read_mask(f'{chain}/b{MASK_SUFFIX}') == [
+        ['WARC_Record_ID', 'Keep', 'Duplicate_Of'],
+        ['<urn:r1>', '0', '<urn:r2>'], ['<urn:b:1>', '1', ''], ['<urn:r0>', '0', '<urn:r2>'],
+    ]
+
+    assert deduplicate([chain], dest_folder=f'{tmp_path}/masks') == stats
+    assert sorted(os.listdir(f'{tmp_path}/masks')) == [f'a{MASK_SUFFIX}', f'b{MASK_SUFFIX}']
+    assert read_mask(f'{tmp_path}/masks/b{MASK_SUFFIX}') == read_mask(f'{chain}/b{MASK_SUFFIX}')
+
+    files, starts, labels = find_duplicates([chain])
+    assert save_masks(files, starts, np.arange(6), f'{tmp_path}/masks') == {'records': 6, 'duplicates': 0, 'clusters': 0}
+    assert all(row[1] == '1' for row in read_mask(f'{tmp_path}/masks/b{MASK_SUFFIX}')[1:])
+
+def test_near_duplicate_texts(tmp_path):
+    rng = random.Random(0)
+    originals = [random_text(rng, 400) for _ in range(20)]
+    # A word edited in a copy of the first texts, in another file.
+    copies = []
+    for text in originals[:5]:
+        words = text.split()
+        words[200] = 'distinto'
+        copies.append(' '.join(words))
+
+    for name, batch in [('a', originals), ('b', copies)]:
+        with SignatureWriter(f'{tmp_path}/{name}{SIGNATURE_SUFFIX}', batch_size=3) as writer:
+            for i, text in enumerate(batch): writer.add(f'<urn:{name}:{i}>', text)
+
+    assert find_duplicates([str(tmp_path)])[2].tolist() == list(range(20)) + list(range(5))
+
+def test_minhash_pipeline(crawl, tmp_path):
+    crawl.serve()
+    extract_text.run_pipeline(crawl.wet_paths_file, dest_path=str(tmp_path), num_workers=2, streaming=True, minhash=True)
+
+    for i, name in enumerate(crawl.names):
+        # Keyed by the WARC response record, in the order of the content output.
+        rows = list(iter_text_rows(crawl.wet_file(i)))
+        entries = np.load(f'{tmp_path}/{name}{SIGNATURE_SUFFIX}')
+        assert [record_id.decode() for record_id in entries['id']] == [row[2] for row in rows]
+        assert read_output(f'{tmp_path}/{name}.wet.csv')['WARC_Refers_To'].tolist() == [row[2] for row in rows]
+        assert np.array_equal(entries['signature'], minhash_signatures([row[4] for row in rows]))
+
+    # Without --minhash no signatures are written.
+    os.makedirs(f'{tmp_path}/plain')
+    extract_text.run_pipeline(crawl.wet_paths_file, dest_path=f'{tmp_path}/plain', num_workers=1, streaming=True)
+    assert not any(name.endswith(SIGNATURE_SUFFIX) for name in os.listdir(f'{tmp_path}/plain'))
+
+def test_chunk_save_drops_the_duplicates(crawl, tmp_path, monkeypatch):
+    crawl.serve()
+    monkeypatch.setattr(warcapi, 'wet_dict', warcapi._get_paths(crawl.wet_paths_file, use_cache=False), raising=False)
+    for i, name in enumerate(crawl.names):
+        with SignatureWriter(f'{tmp_path}/{name}{SIGNATURE_SUFFIX}') as writer:
+            for row in iter_text_rows(crawl.wet_file(i)): writer.add(row[2], row[4])
+    # Every LSH candidate is a duplicate, so the texts of the crawl have some.
+    assert deduplicate([str(tmp_path)], threshold=0)['duplicates'] > 0
+
+    chunk_file = f'{tmp_path}/{crawl.names[0]}.csv'
+    save_metadata(chunk_file, iter_metadata_rows(crawl.warc_file(0)))
+    chunk = WARCChunk(chunk_file, streaming=True)
+    (tmp_path / 'saved').mkdir()
+    chunk.save(f'{tmp_path}/saved', filters=[DuplicateFilter([f'{tmp_path}/{name}{MASK_SUFFIX}' for name in crawl.names])])
+    saved = read_output(f'{tmp_path}/saved/{chunk.chunk_name}.csv')
+
+    dropped = {record_id for name in crawl.names for record_id, keep, _ in read_mask(f'{tmp_path}/{name}{MASK_SUFFIX}')[1:] if keep == '0'}
+    assert dropped & set(chunk.warc_df.index)
+    assert sorted(saved['WARC_Record_ID']) == sorted(set(chunk.warc_df.index) - dropped)
@@ -0,0 +1,51 @@
+import random
+from extract_joint import iter_joined
+
+def metadata(i):
+    return {'WARC_Record_ID': f'<urn:uuid:{i}>', 'Domain': 'com'}
+
+def text(i):
+    return {'WARC_Refers_To': f'<urn:uuid:{i}>', 'WARC_Identified_Content_Language': 'eng', 'Content': f'text {i}'}
+
+def test_unmatched_text_at_start_does_not_block_the_join():
+    # The conversion of a non-HTML response (no metadata) before 30000 records.
+    warc = [metadata(i) for i in range(30000)]
+    wet = [text('non-html')] + [text(i) for i in range(30000)]
+
+    joined = list(iter_joined(warc, wet))
+
+    assert [record['WARC_Record_ID'] for record in joined] == [f'<urn:uuid:{i}>' for i in range(30000)]
+    assert all(record['Content'] == f'text {i}' for i, record in enumerate(joined))
+
+def test_unmatched_records_on_both_sides():
+    rng = random.Random(0)
+    warc, wet, expected = [], [], []
+    for i in range(20000):
+        kind = rng.random()
+        if kind < 0.2:
+            wet.append(text(f'wet-only-{i}'))      # e.g. a PDF converted to text
+        elif kind < 0.25:
+            warc.append(metadata(f'warc-only-{i}'))  # an HTML response without text
+        else:
+            warc.append(metadata(i))
+            wet.append(text(i))
+            expected.append(f'<urn:uuid:{i}>')
+
+    joined = [record['WARC_Record_ID'] for record in iter_joined(warc, wet, max_pending=100)]
+
+    assert joined == expected
+
+def test_pending_records_stay_bounded():
+    # Every fifth WET record has no metadata and every seventh response has no text.
+    warc = [metadata(i) for i in range(10000) if i % 7]
+    wet = [text(i if i % 5 else f'other-{i}') for i in range(10000)]
+
+    joined = list(iter_joined(warc, wet, max_pending=2))
+
+    assert len(joined) == len([i for i in range(10000) if i % 7 and i % 5])
+
+def test_max_count():
+    warc = [metadata(i) for i in range(100)]
+    wet = [text(i) for i in range(100)]
+
+    assert len(list(iter_joined(warc, wet, max_count=10))) == 10
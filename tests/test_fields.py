@@ -0,0 +1,43 @@
+import os
+from fastwarc.warc import ArchiveIterator, WarcRecordType
+from extract_metadata import iter_metadata_rows, run_pipeline, TAGS_WINDOW
+from sinks import read_output
+from fields import compile_plan
+
+def payloads(path: str) -> dict:
+    # WARC Content-Length and payload length of every response.
+    lengths = {}
+    for record in ArchiveIterator(open(path, 'rb'), record_types=WarcRecordType.response):
+        lengths[record.record_id] = (int(record.headers['Content-Length']), len(record.reader.read()))
+    return lengths
+
+def test_payload_length_leaves_out_the_http_headers(crawl):
+    path = crawl.warc_file(0)
+    lengths = payloads(path)
+
+    # With and without reading the payload window for HTML fields.
+    for fields in (['WARC_Record_ID', 'Payload_Length'], ['WARC_Record_ID', 'Payload_Length', 'HTML_Language']):
+        rows = list(iter_metadata_rows(path, fields=fields))
+        assert len(rows) > 0
+        for row in rows:
+            block, payload = lengths[row[0]]
+            assert int(row[1]) == payload < block
+
+def test_payload_length_parses_the_http_headers(crawl):
+    plan = compile_plan(['WARC_Record_ID', 'Payload_Length'])
+    lengths = payloads(crawl.warc_file(0))
+
+    for record in ArchiveIterator(open(crawl.warc_file(0), 'rb'), parse_http=False, record_types=WarcRecordType.response):
+        assert plan.extract(record, 'file', 0) == (record.record_id, str(lengths[record.record_id][1]))
+
+def test_tags_window_reaches_the_workers(crawl, tmp_path):
+    crawl.serve()
+    languages = {}
+    for window in (TAGS_WINDOW, 5):
+        dest = tmp_path / str(window)
+        os.makedirs(dest)
+        run_pipeline(crawl.warc_paths_file, dest_path=str(dest), num_workers=2, streaming=True, tags_window=window)
+        languages[window] = read_output(f'{dest}/{crawl.names[0]}.csv')['HTML_Language']
+
+    # 5 bytes are too few to reach any <html> start tag.
+    assert languages[TAGS_WINDOW].notna().any() and languages[5].isna().all()
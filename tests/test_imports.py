@@ -0,0 +1,29 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported on first use only: importing the entry points and the public API must not load them.
+HEAVY_MODULES = ['pandas', 'requests', 'numpy', 'pyarrow']
+
+def loaded_modules(statement: str) -> list:
+    script = f'import sys, json\n{statement}\nprint(json.dumps(sorted(sys.modules)))'
+    output = subprocess.run([sys.executable, '-c', script], cwd=REPO, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+@pytest.mark.parametrize('statement', [
+    'import extract_metadata, extract_text, warcapi',
+    'import extract_joint, stats, sample',
+])
+def test_heavy_modules_are_not_imported(statement):
+    modules = loaded_modules(statement)
+
+    assert [name for name in HEAVY_MODULES if name in modules] == []
+
+def test_heavy_imports_are_detected():
+    # recordindex needs numpy as soon as it is imported, so the check does see heavy imports.
+    assert 'numpy' in loaded_modules('import recordindex')
+
@@ -0,0 +1,88 @@
+import os
+import gzip
+import random
+import pytest
+import inflate
+from inflate import find_member_starts, iter_inflate, GZIP_MAGIC
+
+def write_members(path: str, payloads: list, **kwargs) -> list:
+    # Writes every payload as its own gzip member, returns where every member starts.
+    starts = []
+    with open(path, 'wb') as file:
+        for payload in payloads:
+            starts.append(file.tell())
+            file.write(gzip.compress(payload, **kwargs))
+    return starts
+
+@pytest.fixture
+def members(tmp_path):
+    rng = random.Random(0)
+    words = [rng.randbytes(rng.randint(2, 8)).hex().encode() for _ in range(500)]
+    # Records of a few KB, and a large one spanning several chunks.
+    payloads = [b' '.join(rng.choices(words, k=rng.randint(50, 2000))) for _ in range(300)]
+    payloads[150] = rng.randbytes(300000)
+
+    path = f'{tmp_path}/file.warc.gz'
+    return path, write_members(path, payloads), b''.join(payloads)
+
+def inflated(path: str, **kwargs) -> bytes:
+    return b''.join(iter_inflate(path, **kwargs))
+
+def test_find_member_starts(members):
+    path, starts, _ = members
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        found = find_member_starts(file.fileno(), size, chunk_size=50000)
+        assert find_member_starts(file.fileno(), size, chunk_size=size) == [0]
+
+    assert found[0] == 0 and found == sorted(set(found))
+    assert len(found) > 5 and set(found) <= set(starts)
+    # The first member after every split point, unless it is too far (the large member).
+    for split in found[1:]:
+        assert split == min(start for start in starts if start >= split - split % 50000)
+
+@pytest.mark.parametrize('num_threads, chunk_size', [(1, inflate.CHUNK_SIZE), (2, 50000), (4, 20000), (8, 4096), (3, 123457)])
+def test_iter_inflate_matches_gzip(members, num_threads, chunk_size):
+    path, _, data = members
+    with gzip.open(path, 'rb') as file:
+        assert file.read() == data
+    assert inflated(path, num_threads=num_threads, chunk_size=chunk_size) == data
+
+def test_split_points_inside_a_member(tmp_path):
+    # A stored member containing a whole member and the magic number looks like a member start inside
+    # another member (here just after the split point at 13 * 4096): the chunk starting there is inflated
+    # again from the end of the previous one.
+    fake = gzip.compress(b'not a record') + GZIP_MAGIC + b'\x00' * 100
+    payloads = [os.urandom(5000) for _ in range(20)]
+    payloads[10] = os.urandom(3500) + fake + os.urandom(3000)
+
+    path = f'{tmp_path}/file.gz'
+    starts = write_members(path, payloads, compresslevel=0)
+    with open(path, 'rb') as file:
+        found = find_member_starts(file.fileno(), os.path.getsize(path), chunk_size=4096)
+    assert set(found) - set(starts), 'the fake member should be taken for a split point'
+
+    assert inflated(path, num_threads=4, chunk_size=4096) == b''.join(payloads)
+
+def test_padding_and_truncation(members, tmp_path):
+    path, _, data = members
+    with open(path, 'ab') as file: file.write(b'\x00' * 1000)
+    assert inflated(path, num_threads=4, chunk_size=50000) == data
+
+    truncated = f'{tmp_path}/truncated.gz'
+    with open(path, 'rb') as file, open(truncated, 'wb') as dest: dest.write(file.read()[:-2000])
+    with pytest.raises(EOFError):
+        inflated(truncated)
+
+def test_window_is_bounded():
+    # Chunks are made smaller so that 2 chunks per thread stay within the window.
+    assert inflate._window(1, inflate.CHUNK_SIZE, inflate.WINDOW_SIZE) == (inflate.CHUNK_SIZE, 2)
+    for num_threads in (2, 4, 32, 256):
+        chunk_size, ahead = inflate._window(num_threads, inflate.CHUNK_SIZE, inflate.WINDOW_SIZE)
+        assert chunk_size * ahead <= inflate.WINDOW_SIZE and ahead == 2 * num_threads
+
+def test_small_window(members):
+    path, _, data = members
+    assert inflate._window(8, 20000, 60000) == (3750, 16)
+    assert inflated(path, num_threads=8, chunk_size=20000, window_size=60000) == data
+    assert inflated(path, num_threads=8, chunk_size=20000, window_size=1000) == data
@@ -0,0 +1,125 @@
+import os
+import shutil
+import pytest
+import sinks
+import extract_metadata
+import extract_text
+from manifest import Manifest, file_checksum, QUEUED, DOWNLOADED, WRITTEN, FAILED
+
+# Module, crawl files ('warc' or 'wet') and output suffix of both pipelines.
+PIPELINES = {
+    'metadata': (extract_metadata, 'warc', '.csv'),
+    'text': (extract_text, 'wet', '.wet.csv'),
+}
+
+@pytest.fixture(autouse=True)
+def served(crawl):
+    crawl.serve()
+
+def outputs(dest, names, suffix) -> dict:
+    # Modification time and contents of the output of every file.
+    result = {}
+    for name in names:
+        with open(f'{dest}/{name}{suffix}', 'rb') as file:
+            result[name] = (os.stat(f'{dest}/{name}{suffix}').st_mtime_ns, file.read())
+    return result
+
+def test_manifest(tmp_path):
+    manifest = Manifest(f'{tmp_path}/manifest.sqlite')
+    assert manifest.get('a') is None and not manifest.is_written('a') and manifest.counts() == {}
+
+    output = f'{tmp_path}/a.csv'
+    with open(output, 'w') as file: file.write('a,b\n1,2\n')
+    manifest.mark('a\n', QUEUED)
+    manifest.mark('a', DOWNLOADED, download_size=100)
+    assert not manifest.is_written('a')
+    manifest.mark('a', WRITTEN, records=1, output=output, size=os.path.getsize(output), checksum=file_checksum(output))
+    manifest.mark('b', FAILED, error='download failed')
+
+    # Fields not given keep their value.
+    entry = manifest.get('a')
+    assert (entry['state'], entry['download_size'], entry['records'], entry['output']) == (WRITTEN, 100, 1, output)
+    assert entry['checksum'] == file_checksum(output) and len(entry['checksum']) == 40
+    assert manifest.is_written('a') and manifest.get('b')['error'] == 'download failed'
+    # Reopened from disk.
+    assert Manifest(f'{tmp_path}/manifest.sqlite').counts() == {WRITTEN: 1, FAILED: 1}
+
+    with open(output, 'a') as file: file.write('3,4\n')
+    assert not manifest.is_written('a')
+    os.remove(output)
+    assert not manifest.is_written('a')
+
+@pytest.mark.parametrize('pipeline', PIPELINES)
+def test_resume_skips_written_paths(crawl, tmp_path, pipeline):
+    module, kind, suffix = PIPELINES[pipeline]
+    paths_file = getattr(crawl, f'{kind}_paths_file')
+    module.run_pipeline(paths_file, dest_path=str(tmp_path), streaming=True)
+    before = outputs(tmp_path, crawl.names, suffix)
+
+    module.run_pipeline(paths_file, dest_path=str(tmp_path), streaming=True, resume=True)
+    assert outputs(tmp_path, crawl.names, suffix) == before
+    assert Manifest(f'{tmp_path}/{module.MANIFEST_FILE}').counts() == {WRITTEN: len(crawl.names)}
+
+@pytest.mark.parametrize('pipeline', PIPELINES)
+def test_resume_redoes_truncated_and_deleted_outputs(crawl, tmp_path, pipeline):
+    module, kind, suffix = PIPELINES[pipeline]
+    paths_file = getattr(crawl, f'{kind}_paths_file')
+    module.run_pipeline(paths_file, dest_path=str(tmp_path), streaming=True)
+    before = outputs(tmp_path, crawl.names, suffix)
+
+    truncated, deleted = crawl.names
+    with open(f'{tmp_path}/{truncated}{suffix}', 'r+b') as file: file.truncate(100)
+    os.remove(f'{tmp_path}/{deleted}{suffix}')
+    # Without the manifest only the deleted output is written again.
+    module.run_pipeline(paths_file, dest_path=str(tmp_path), streaming=True)
+    assert os.path.getsize(f'{tmp_path}/{truncated}{suffix}') == 100
+    os.remove(f'{tmp_path}/{deleted}{suffix}')
+
+    module.run_pipeline(paths_file, dest_path=str(tmp_path), streaming=True, resume=True)
+    after = outputs(tmp_path, crawl.names, suffix)
+    assert all(after[name][1] == before[name][1] and after[name][0] != before[name][0] for name in crawl.names)
+
+@pytest.mark.parametrize('pipeline', PIPELINES)
+def test_resume_removes_leftover_downloads(crawl, tmp_path, pipeline):
+    module, kind, _ = PIPELINES[pipeline]
+    path, served_file = getattr(crawl, f'{kind}_paths')[0], getattr(crawl, f'{kind}_file')(0)
+    local_file = f'{tmp_path}/{path.split("/")[-1]}'
+    with open(served_file, 'rb') as file: contents = file.read()
+    manifest = Manifest(f'{tmp_path}/{module.MANIFEST_FILE}')
+
+    # A file from another run (not in the manifest, or of another size) is downloaded again.
+    for download_size in (None, len(contents) + 1):
+        with open(local_file, 'wb') as file: file.write(contents[:1000])
+        if download_size is not None: manifest.mark(path, DOWNLOADED, download_size=download_size)
+        assert module.fetch(path, str(tmp_path), None, manifest=manifest, resume=True) == path
+        with open(local_file, 'rb') as file: assert file.read() == contents
+        assert manifest.get(path)['download_size'] == len(contents)
+        os.remove(local_file)
+
+    # A complete download is kept.
+    shutil.copyfile(served_file, local_file)
+    modified = os.stat(local_file).st_mtime_ns
+    assert module.fetch(path, str(tmp_path), None, manifest=manifest, resume=True) == path
+    assert os.stat(local_file).st_mtime_ns == modified
+
+@pytest.mark.parametrize('pipeline', PIPELINES)
+def test_failed_sinks_leave_no_output(crawl, tmp_path, monkeypatch, pipeline):
+    module, kind, suffix = PIPELINES[pipeline]
+    paths_file = getattr(crawl, f'{kind}_paths_file')
+    # The sink fails after writing its first batch (the workers are forked with the patch).
+    monkeypatch.setattr(module, 'BATCH_SIZE', 20)
+    write_rows = sinks.CSVSink.write_rows
+    def failing(self, rows):
+        if self.rows: raise OSError('disk full')
+        write_rows(self, rows)
+    monkeypatch.setattr(sinks.CSVSink, 'write_rows', failing)
+
+    module.run_pipeline(paths_file, dest_path=str(tmp_path), streaming=True)
+    assert not any(name.endswith(suffix) or name.endswith('.tmp') for name in os.listdir(tmp_path))
+    manifest = Manifest(f'{tmp_path}/{module.MANIFEST_FILE}')
+    assert manifest.counts() == {FAILED: len(crawl.names)}
+    assert 'disk full' in manifest.get(getattr(crawl, f'{kind}_paths')[0])['error']
+
+    monkeypatch.setattr(sinks.CSVSink, 'write_rows', write_rows)
+    module.run_pipeline(paths_file, dest_path=str(tmp_path), streaming=True, resume=True)
+    assert manifest.counts() == {WRITTEN: len(crawl.names)}
@@ -0,0 +1,127 @@
+import io
+import json
+import time
+import urllib.request
+import pytest
+import client
+import metrics
+from metrics import PipelineMetrics, record_file, instrumented, stage, count
+from extract_metadata import iter_metadata
+
+def work(seconds: float, records: int) -> int:
+    with stage('parse'):
+        time.sleep(seconds)
+        with stage('tags'):
+            time.sleep(seconds)
+    count('records', records)
+    return records
+
+def test_stages_are_exclusive():
+    result, record = instrumented(work, 0.05, 10)
+    assert result == 10 and record['counters'] == {'records': 10}
+    assert record['stages']['parse'] == pytest.approx(0.05, abs=0.03)
+    assert record['stages']['tags'] == pytest.approx(0.05, abs=0.03)
+    assert record['stages']['total'] >= record['stages']['parse'] + record['stages']['tags']
+
+    # Outside of a record nothing is recorded.
+    assert work(0, 1) == 1
+
+def fetched(monitor: PipelineMetrics, path: str, download_error=False) -> str:
+    def fetch(path):
+        with stage('download'):
+            count('download_bytes', 2**20)
+            if download_error: count('download_errors')
+        return None if download_error else path
+    return monitor.fetch(fetch, path)
+
+def test_file_done_states():
+    stream = io.StringIO()
+    monitor = PipelineMetrics(5, num_workers=2, log_files=True, stream=stream)
+
+    fetched(monitor, 'a')
+    monitor.file_done('a', instrumented(work, 0, 100)[1])
+    # Skipped by the fetch stage (e.g. already written).
+    monitor.file_done('b', None, skipped=True)
+    # A fetch stage returning nothing after a failed download is a failure, not a skipped path.
+    fetched(monitor, 'c', download_error=True)
+    monitor.file_done('c', None, skipped=True)
+    fetched(monitor, 'd')
+    monitor.file_done('d', None, error=ValueError('broken'))
+
+    snapshot = monitor.snapshot()
+    assert (snapshot['done'], snapshot['failed'], snapshot['skipped']) == (1, 2, 1)
+    assert snapshot['counters'] == {'download_bytes': 3 * 2**20, 'download_errors': 1, 'records': 100}
+
+    # A JSON line per file processed, none for skipped ones.
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert [(line['path'], line['error']) for line in lines] == [('a', None), ('c', 'download failed'), ('d', 'broken')]
+    assert lines[0]['counters'] == {'download_bytes': 2**20, 'records': 100}
+
+def test_eta(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(metrics.time, 'time', lambda: now[0])
+    monitor = PipelineMetrics(10)
+    assert monitor.snapshot()['eta_seconds'] is None and monitor.progress() == 'Progress: 0/10 (ETA -)'
+
+    # Skipped paths count as finished, but not in the rate.
+    now[0] += 100
+    for path in 'abc': monitor.file_done(path, None, skipped=True)
+    for path in 'de': monitor.file_done(path, instrumented(work, 0, 1)[1])
+    snapshot = monitor.snapshot()
+    assert snapshot['files_per_s'] == 0.02 and snapshot['eta_seconds'] == 250.0
+    assert monitor.progress() == 'Progress: 5/10 (ETA 0h 4m 10s)'
+
+def test_prometheus():
+    monitor = PipelineMetrics(3, num_workers=1)
+    fetched(monitor, 'a')
+    monitor.file_done('a', instrumented(work, 0, 7)[1])
+    monitor.set_queues(1, 0, 2)
+
+    text = monitor.prometheus()
+    assert text.endswith('\n')
+    samples = {line.rsplit(' ', 1)[0]: float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if not line.startswith('#')}
+    assert samples['cc_files{state="done"}'] == 1 and samples['cc_files{state="total"}'] == 3
+    assert samples['cc_counter_total{name="records"}'] == 7
+    assert samples['cc_queue_depth{queue="working"}'] == 2
+    assert set(f'cc_stage_seconds_total{{stage="{name}"}}' for name in metrics.STAGES) <= set(samples)
+    # Every metric is declared once, before its samples.
+    types = [line.split()[2] for line in text.splitlines() if line.startswith('# TYPE')]
+    assert len(types) == len(set(types)) and all(name.split('{')[0] in types for name in samples)
+
+def test_metrics_endpoint():
+    monitor = PipelineMetrics(3)
+    monitor.serve(0)
+    try:
+        port = monitor._server.server_address[1]
+        with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert 'cc_files{state="total"} 3' in response.read().decode()
+
+        with pytest.raises(urllib.request.HTTPError) as error:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/other')
+        assert error.value.code == 404
+    finally:
+        monitor.close()
+
+@pytest.mark.parametrize('partial_fetch', [False, True])
+def test_streamed_bodies_are_timed_as_download(crawl, monkeypatch, partial_fetch):
+    crawl.serve()
+    # A slow network: every read of a body waits.
+    reads = []
+    get = client.HTTPClient._get
+    def slow_get(self, *args, **kwargs):
+        response = get(self, *args, **kwargs)
+        read = response.raw.read
+        def slow_read(*args, **kwargs):
+            reads.append(None)
+            time.sleep(0.005)
+            return read(*args, **kwargs)
+        response.raw.read = slow_read
+        return response
+    monkeypatch.setattr(client.HTTPClient, '_get', slow_get)
+
+    with record_file() as record:
+        records = list(metrics.timed(iter_metadata(crawl.warc_paths[0], streaming=True, partial_fetch=partial_fetch), 'parse'))
+
+    assert records and reads and record.stages['download'] >= 0.005 * len(reads)
+    assert record.counters['download_bytes'] > 0
@@ -0,0 +1,151 @@
+import os
+import csv
+import pytest
+import recordindex
+from recordindex import RecordIndex, iter_csv_rows, file_kind, CATALOG_FILE
+from sinks import open_sink, EXTENSIONS
+
+METADATA = ['WARC_File', 'WARC_Record_ID', 'WARC_Target_URI', 'Domain', 'HTML_Language']
+CONTENT = ['WARC_File', 'WARC_Record_ID', 'WARC_Refers_To', 'WARC_Identified_Content_Language', 'Content']
+JOINED = METADATA + ['WARC_Identified_Content_Language', 'Content']
+
+def text(record_id: str) -> str:
+    # Line breaks, quotes and commas inside quoted CSV fields.
+    return f'Title of {record_id}\n"quoted", text\r\nlast line'
+
+def metadata_row(name: str, i: int) -> tuple:
+    # Records 5 to 9 repeat the URLs of records 0 to 4.
+    return (name, f'<urn:{name}:{i}>', f'https://{name}.example.cl/{i % 5}', 'cl', 'es' if i % 2 else None)
+
+def write(path: str, columns: list, rows: list, output_format: str):
+    with open_sink(path, columns, output_format) as sink:
+        # Several batches (row groups in Parquet files).
+        for begin in range(0, len(rows), 4): sink.write_rows(rows[begin:begin + 4])
+
+def write_outputs(dest: str, output_format: str, names=('a', 'b'), num_records=10):
+    ext = EXTENSIONS[output_format]
+    for name in names:
+        write(f'{dest}/{name}{ext}', METADATA, [metadata_row(name, i) for i in range(num_records)], output_format)
+        write(f'{dest}/{name}.wet{ext}', CONTENT, [(name, f'<urn:wet:{name}:{i}>', f'<urn:{name}:{i}>', 'spa', text(f'<urn:{name}:{i}>'))
+                                                    for i in range(num_records)], output_format)
+    # The records of the first file also in a joined file.
+    write(f'{dest}/{names[0]}.joined{ext}', JOINED, [metadata_row(names[0], i) + ('spa', text(f'<urn:{names[0]}:{i}>'))
+                                                     for i in range(num_records)], output_format)
+
+def expected(name: str, i: int) -> dict:
+    row = dict(zip(METADATA, metadata_row(name, i)))
+    row['HTML_Language'] = row['HTML_Language'] or ''
+    return row
+
+@pytest.fixture(params=['csv', 'parquet'])
+def dest(request, tmp_path):
+    os.makedirs(f'{tmp_path}/dest')
+    write_outputs(f'{tmp_path}/dest', request.param)
+    return f'{tmp_path}/dest', request.param
+
+def test_file_kind():
+    assert [file_kind(name) for name in ['a.csv', 'a.wet.parquet', 'a.joined.csv', 'a.counts.csv', 'a.txt', 'stats.counts.csv']] == \
+        ['metadata', 'content', 'joined', None, None, None]
+
+def test_iter_csv_rows(tmp_path):
+    rows = [['id', 'text'], ['1', text('1')], ['2', ''], ['3', 'a "quoted" word, and\n\nlines'], ['4', '"']]
+    path = f'{tmp_path}/file.csv'
+    with open(path, 'w', newline='', encoding='utf-8') as file: csv.writer(file).writerows(rows)
+
+    with open(path, 'rb') as file:
+        found = list(iter_csv_rows(file))
+        assert [row for _, row in found] == rows
+        # Every offset is the start of its row.
+        for offset, row in found:
+            assert next(iter_csv_rows(file, offset))[1] == row
+
+def test_lookup(dest, tmp_path):
+    folder, _ = dest
+    index = RecordIndex(f'{tmp_path}/index', num_shards=4)
+    assert index.add([folder]) == 5 and len(index) == 5
+
+    ids = ['<urn:a:3>', '<urn:b:0>', '<urn:b:9>', '<urn:missing>']
+    found = index.lookup(ids)
+    assert set(found) == set(ids[:3])
+    for record_id, (name, i) in zip(ids, [('a', 3), ('b', 0), ('b', 9)]):
+        record = found[record_id]
+        assert {column: record[column] for column in METADATA} == expected(name, i)
+        assert record['Content'] == text(record_id) and record['WARC_Identified_Content_Language'] == 'spa'
+
+    # Reopened from disk.
+    assert RecordIndex(f'{tmp_path}/index').lookup(ids) == found
+
+def test_lookup_urls_and_url_stats(dest, tmp_path):
+    folder, _ = dest
+    index = RecordIndex(f'{tmp_path}/index', num_shards=4)
+    index.add([folder])
+
+    # Records of 'a' are in its metadata and joined files, but count once.
+    records = index.lookup_urls(['https://a.example.cl/1', 'https://b.example.cl/4', 'https://c.example.cl/0'])
+    assert sorted(records) == ['https://a.example.cl/1', 'https://b.example.cl/4']
+    assert sorted(record['WARC_Record_ID'] for record in records['https://a.example.cl/1']) == ['<urn:a:1>', '<urn:a:6>']
+    assert index.url_stats() == {'records': 20, 'urls': 10, 'duplicated_urls': 10, 'duplicate_records': 10, 'max_records_per_url': 2}
+
+def test_rewritten_files_are_added_again(dest, tmp_path):
+    folder, output_format = dest
+    index = RecordIndex(f'{tmp_path}/index', num_shards=4)
+    index.add([folder])
+    assert index.add([folder]) == 0
+
+    # 'b' extracted again with other records: its old entries are dropped.
+    ext = EXTENSIONS[output_format]
+    os.remove(f'{folder}/b{ext}')
+    write(f'{folder}/b{ext}', METADATA, [metadata_row('b', i) for i in range(10, 13)], output_format)
+    assert index.add([folder]) == 1 and len(index) == 5
+
+    found = index.lookup(['<urn:b:1>', '<urn:b:11>'])
+    # The content of the old record is still indexed, its metadata is not.
+    assert 'WARC_Target_URI' not in found['<urn:b:1>'] and found['<urn:b:1>']['Content'] == text('<urn:b:1>')
+    assert {column: found['<urn:b:11>'][column] for column in METADATA} == expected('b', 11)
+    assert index.lookup_urls(['https://b.example.cl/1']) == {'https://b.example.cl/1': [expected('b', 11)]}
+    assert index.url_stats()['records'] == 13
+
+def test_compaction(dest, tmp_path, monkeypatch):
+    folder, output_format = dest
+    monkeypatch.setattr(recordindex, 'MAX_SEGMENTS', 3)
+    write_outputs(folder, output_format, names=[f'f{i}' for i in range(6)], num_records=20)
+
+    # A segment per file: shards go over MAX_SEGMENTS and are merged.
+    index = RecordIndex(f'{tmp_path}/index', num_shards=2)
+    index.add([folder], files_per_segment=1)
+    for space in ('id', 'url'):
+        shards = index.catalog['shards'][space]
+        assert shards and all(len(names) <= 3 for names in shards.values())
+        # Merged segments are removed from disk.
+        assert sorted(os.listdir(f'{tmp_path}/index/{space}')) == sorted(name for names in shards.values() for name in names)
+
+    before = index.lookup(['<urn:a:1>', '<urn:f5:19>', '<urn:f0:0>'])
+    stats = index.url_stats()
+    index.compact()
+    assert all(len(names) == 1 for names in index.catalog['shards']['id'].values())
+    assert index.lookup(['<urn:a:1>', '<urn:f5:19>', '<urn:f0:0>']) == before and index.url_stats() == stats
+    assert before['<urn:f0:0>']['Content'] == text('<urn:f0:0>')
+
+def test_hash_collisions_are_rejected(dest, tmp_path, monkeypatch):
+    folder, _ = dest
+    # 2-bit keys: most record IDs and URLs share their key with others.
+    monkeypatch.setattr(recordindex, 'record_key', lambda value: sum(value.encode()) % 4)
+    index = RecordIndex(f'{tmp_path}/index', num_shards=2)
+    index.add([folder])
+
+    found = index.lookup(['<urn:a:2>', '<urn:b:7>', '<urn:missing>'])
+    assert sorted(found) == ['<urn:a:2>', '<urn:b:7>']
+    assert found['<urn:a:2>']['WARC_Record_ID'] == '<urn:a:2>' and found['<urn:a:2>']['Content'] == text('<urn:a:2>')
+    assert sorted(record['WARC_Record_ID'] for record in index.lookup_urls(['https://b.example.cl/3'])['https://b.example.cl/3']) == ['<urn:b:3>', '<urn:b:8>']
+    assert index.lookup_urls(['https://c.example.cl/3']) == {}
+
+def test_add_with_workers(dest, tmp_path):
+    folder, _ = dest
+    index = RecordIndex(f'{tmp_path}/index', num_shards=4)
+    assert not os.path.exists(f'{tmp_path}/index/{CATALOG_FILE}')
+    index.add([folder], num_workers=2)
+    assert len(RecordIndex(f'{tmp_path}/index')) == 5
+    assert index.lookup(['<urn:b:2>'])['<urn:b:2>']['Content'] == text('<urn:b:2>')
+
+    with pytest.raises(ValueError):
+        RecordIndex(f'{tmp_path}/other', num_shards=3)
@@ -0,0 +1,66 @@
+import gzip
+import pytest
+import client
+from recordreader import parse_cdx_line, iter_cdx, coalesce_ranges, get_metadata_at, get_text_at
+from extract_metadata import iter_metadata
+from extract_text import iter_text
+
+def ranges_of(records) -> list:
+    return [(int(record['WARC_Offset']), int(record['WARC_Length'])) for record in records]
+
+def test_parse_cdx_line(tmp_path):
+    line = ('org,example)/page 20240301120000 {"url": "https://example.org/page", "mime": "text/html", "status": "200", '
+            '"length": "1234", "offset": "56789", "filename": "crawl-data/CC-MAIN-2024-10/segments/1/warc/file.warc.gz"}\n')
+    entry = parse_cdx_line(line)
+    assert entry['offset'] == 56789 and entry['length'] == 1234
+    assert entry['url'] == 'https://example.org/page' and entry['status'] == '200'
+    assert entry['filename'].endswith('file.warc.gz')
+
+    path = f'{tmp_path}/cdx-00000.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as file: file.write(line + '\n' + line)
+    assert list(iter_cdx(path)) == [entry, entry]
+
+def test_coalesce_ranges():
+    assert coalesce_ranges([]) == []
+    # Sorted, duplicates dropped, ranges closer than max_gap grouped (overlaps included).
+    assert coalesce_ranges([(500, 100), (0, 100), (150, 50), (0, 100), (160, 10)], max_gap=50) == [
+        (0, 200, [(0, 100), (150, 50), (160, 10)]),
+        (500, 600, [(500, 100)]),
+    ]
+    assert coalesce_ranges([(0, 100), (101, 1)], max_gap=0) == [(0, 100, [(0, 100)]), (101, 102, [(101, 1)])]
+    assert len(coalesce_ranges([(0, 100), (300, 100)])) == 1
+
+@pytest.fixture
+def requests_sent(monkeypatch):
+    sent = []
+    read_range = client.HTTPClient.read_range
+    def recorded(self, url, start, end):
+        sent.append((start, end))
+        return read_range(self, url, start, end)
+    monkeypatch.setattr(client.HTTPClient, 'read_range', recorded)
+    return sent
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_metadata_round_trip(crawl, requests_sent, streaming):
+    crawl.serve()
+    records = list(iter_metadata(crawl.warc_file(0)))
+    picked = records[:-1:7] + records[-1:]
+
+    path = crawl.warc_paths[0] if streaming else crawl.warc_file(0)
+    # In any order: records are returned in offset order.
+    assert get_metadata_at(path, ranges_of(picked)[::-1], streaming=streaming) == picked
+    assert bool(requests_sent) == streaming
+    assert len(requests_sent) <= len(coalesce_ranges(ranges_of(picked)))
+
+    # The first record of the file is its warcinfo record, not a response.
+    assert get_metadata_at(path, [(0, int(records[0]['WARC_Offset']))], streaming=streaming) == []
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_text_round_trip(crawl, streaming):
+    crawl.serve()
+    records = list(iter_text(crawl.wet_file(1)))
+    picked = records[1::5]
+
+    path = crawl.wet_paths[1] if streaming else crawl.wet_file(1)
+    assert get_text_at(path, ranges_of(picked), streaming=streaming) == picked
+    assert get_text_at(path, [(0, int(records[0]['WARC_Offset']))], streaming=streaming) == []
@@ -0,0 +1,93 @@
+import random
+import pandas as pd
+import pytest
+import sample
+from sample import read_targets, normalize_targets, sample_outputs, fetch_texts, save_sample, STRATUM_COLUMN
+
+LANGUAGES = ['es_CL', 'es-cl', 'ES-MX', 'en', None]
+
+@pytest.fixture
+def dest(tmp_path):
+    # 4 metadata files of 300 records, the first two with the same records (e.g. a file extracted twice).
+    rng = random.Random(0)
+    domains = [rng.choice(['cl', 'mx']) for _ in range(1200)]
+    for i in range(4):
+        ids = range(300) if i < 2 else range(300 * i, 300 * (i + 1))
+        pd.DataFrame({
+            'WARC_File': f'file{max(i, 1)}',
+            'WARC_Record_ID': [f'<urn:{n}>' for n in ids],
+            'Domain': [domains[n] for n in ids],
+            'HTML_Language': [LANGUAGES[n % len(LANGUAGES)] for n in ids],
+        }).to_csv(f'{tmp_path}/file{i}.csv', index=False)
+
+    return str(tmp_path)
+
+def test_read_targets(tmp_path):
+    assert read_targets('es-cl, es_MX=5,en=10') == {'es-cl': None, 'es_MX': 5, 'en': 10}
+
+    path = f'{tmp_path}/targets.txt'
+    with open(path, 'w') as file: file.write('# Spanish\nes-cl=5, es-mx\n\nen # English\n')
+    assert read_targets(path) == {'es-cl': 5, 'es-mx': None, 'en': None}
+
+def test_normalize_targets():
+    assert normalize_targets({'es_CL': 5, ' EN ': None}, ['HTML_Language']) == {'es-cl': 5, 'en': None}
+    assert normalize_targets({'CL|es_CL': 5}, ['Domain', 'HTML_Language']) == {'CL|es-cl': 5}
+
+def test_sizes_per_stratum(dest):
+    records, population = sample_outputs([dest], ['HTML_Language'], size=50)
+
+    # Records extracted twice are counted twice, but sampled once.
+    assert population == {'es-cl': 480, 'es-mx': 240, 'en': 240, '': 240}
+    assert records[STRATUM_COLUMN].value_counts().to_dict() == {'es-cl': 50, 'es-mx': 50, 'en': 50, '': 50}
+    assert not records['WARC_Record_ID'].duplicated().any()
+    assert records.groupby(STRATUM_COLUMN)['HTML_Language'].unique().map(sorted).to_dict()['es-cl'] == ['es-cl', 'es_CL']
+
+def test_targets(dest):
+    # Targets are normalized like the strata.
+    records, population = sample_outputs([dest], ['Domain', 'HTML_Language'], size=20,
+                                         targets={'cl|es_CL': 7, 'mx|ES-MX': None, 'cl|fr': 5})
+    assert set(population) == {'cl|es-cl', 'mx|es-mx'}
+    assert records[STRATUM_COLUMN].value_counts().to_dict() == {'mx|es-mx': 20, 'cl|es-cl': 7}
+
+def test_sample_is_stable(dest, monkeypatch):
+    def sampled(**kwargs):
+        return sample_outputs([dest], ['HTML_Language'], size=30, **kwargs)[0]
+
+    single = sampled()
+    # Merged a few files at a time, in another order.
+    monkeypatch.setattr(sample, 'MERGE_ROWS', 50)
+    pd.testing.assert_frame_equal(sampled(num_workers=2), single)
+    pd.testing.assert_frame_equal(sampled(), single)
+    pd.testing.assert_frame_equal(sample_outputs(sorted(sample.get_output_files(dest), reverse=True),
+                                                 ['HTML_Language'], size=30)[0], single)
+
+    assert set(sampled(seed=1)['WARC_Record_ID']) != set(single['WARC_Record_ID'])
+    pd.testing.assert_frame_equal(sampled(seed=1), sampled(seed=1))
+
+def test_query(dest):
+    records, population = sample_outputs([dest], ['HTML_Language'], size=10, query="Domain == 'cl'")
+    assert sum(population.values()) == sum(len(df.query("Domain == 'cl'")) for df in map(pd.read_csv, sample.get_output_files(dest)))
+    assert set(records['Domain']) == {'cl'}
+
+def test_fetch_texts(dest, tmp_path):
+    records, _ = sample_outputs([dest], ['HTML_Language'], size=10)
+
+    text_dest = f'{tmp_path}/text'
+    (tmp_path / 'text').mkdir()
+    for warc_file, group in records.groupby('WARC_File'):
+        if warc_file == 'file3': continue
+        # Content outputs hold other records too.
+        ids = group['WARC_Record_ID'].tolist() + ['<urn:other>']
+        pd.DataFrame({'WARC_Refers_To': ids, 'WARC_Identified_Content_Language': 'spa',
+                      'Content': [f'text of {record_id}' for record_id in ids]}).to_csv(f'{text_dest}/{warc_file}.wet.csv', index=False)
+
+    for num_workers in (1, 2):
+        with_texts = fetch_texts(records, text_dest=text_dest, num_workers=num_workers)
+        assert with_texts['WARC_Record_ID'].tolist() == records['WARC_Record_ID'].tolist()
+
+        found = with_texts['WARC_File'] != 'file3'
+        assert (with_texts['Content'][found] == 'text of ' + with_texts['WARC_Record_ID'][found]).all()
+        assert with_texts['Content'][~found].isna().all() and (~found).any()
+
+    save_sample(f'{tmp_path}/sample.csv', with_texts)
+    assert len(pd.read_csv(f'{tmp_path}/sample.csv')) == len(records)
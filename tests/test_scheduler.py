@@ -0,0 +1,21 @@
+import pytest
+from scheduler import run_scheduler
+
+def test_errors_of_on_done_are_not_work_errors():
+    calls = []
+    def on_done(path, result, error):
+        calls.append((path, result, error))
+        raise RuntimeError('on_done failed')
+
+    # abs is picklable and runs in the worker process.
+    with pytest.raises(RuntimeError, match='on_done failed'):
+        run_scheduler([-1], abs, on_done=on_done)
+    assert calls == [(-1, 1, None)]
+
+def test_work_errors_are_reported_once():
+    calls = []
+    completed = run_scheduler([-1, 'x', -3], abs, num_workers=2, on_done=lambda *args: calls.append(args))
+
+    assert completed == 3 and len(calls) == 3
+    assert sorted((path, result) for path, result, error in calls if error is None) == [(-3, 3), (-1, 1)]
+    assert [type(error) for path, _, error in calls if path == 'x'] == [TypeError]
@@ -0,0 +1,60 @@
+import os
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+from sinks import open_sink, read_output, EXTENSIONS, DICTIONARY_COLUMNS
+
+COLUMNS = ['WARC_Record_ID', 'Domain', 'HTML_Language', 'Content']
+
+def rows(begin: int, end: int) -> list:
+    # Missing values, separators, quotes, line breaks and non-ASCII text.
+    return [(f'<urn:{i}>', ['cl', 'es', None][i % 3], 'es-cl' if i % 2 else None, f'Línea {i}, "cita"\n\tfin') for i in range(begin, end)]
+
+def write(dest: str, output_format: str) -> str:
+    path = f'{dest}/file{EXTENSIONS[output_format]}'
+    with open_sink(path, COLUMNS, output_format) as sink:
+        sink.write_rows(rows(0, 10))
+        sink.write([dict(zip(COLUMNS, row)) for row in rows(10, 15)])
+        # Dictionaries may lack some columns.
+        sink.write([{'WARC_Record_ID': '<urn:15>', 'Content': 'sin dominio'}])
+        sink.write_rows([])
+    assert sink.rows == 16
+    return path
+
+def test_formats_read_back_the_same(tmp_path):
+    csv_path, parquet_path = write(str(tmp_path), 'csv'), write(str(tmp_path), 'parquet')
+    assert sorted(os.listdir(tmp_path)) == ['file.csv', 'file.parquet']
+
+    expected = pd.DataFrame(rows(0, 15) + [('<urn:15>', None, None, 'sin dominio')], columns=COLUMNS)
+    for path in (csv_path, parquet_path):
+        df = read_output(path)
+        pd.testing.assert_frame_equal(df.where(df.notna(), None), expected, check_dtype=False)
+
+    # Only some columns, indexed by record ID.
+    csv_df = read_output(csv_path, index_col='WARC_Record_ID', columns=['WARC_Record_ID', 'Content'])
+    parquet_df = read_output(parquet_path, index_col='WARC_Record_ID', columns=['WARC_Record_ID', 'Content'])
+    pd.testing.assert_frame_equal(csv_df, parquet_df, check_dtype=False)
+    assert list(csv_df.columns) == ['Content'] and csv_df.at['<urn:3>', 'Content'] == expected.at[3, 'Content']
+
+def test_parquet_metadata(tmp_path):
+    metadata = pq.ParquetFile(write(str(tmp_path), 'parquet')).metadata
+    # A row group per batch written.
+    assert metadata.num_row_groups == 3 and metadata.num_rows == 16
+
+    for group in range(metadata.num_row_groups):
+        for index, column in enumerate(COLUMNS):
+            chunk = metadata.row_group(group).column(index)
+            assert chunk.path_in_schema == column and chunk.compression == 'ZSTD'
+            assert (chunk.dictionary_page_offset is not None) == (column in DICTIONARY_COLUMNS)
+
+def test_failed_sinks_leave_no_file(tmp_path):
+    for output_format in EXTENSIONS:
+        path = f'{tmp_path}/file{EXTENSIONS[output_format]}'
+        with pytest.raises(ValueError):
+            with open_sink(path, COLUMNS, output_format) as sink:
+                sink.write_rows(rows(0, 10))
+                raise ValueError()
+    assert os.listdir(tmp_path) == []
+
+    with pytest.raises(ValueError):
+        open_sink(f'{tmp_path}/file.json', COLUMNS, 'json')
@@ -0,0 +1,107 @@
+import os
+import random
+from collections import Counter
+import pandas as pd
+import pytest
+import stats
+from stats import (normalize_languages, count_file, cached_count_file, compute_stats, get_output_files,
+                   save_counts, load_counts, STATS_COLUMNS, STATS_FILE, CACHE_DIR)
+
+LANGUAGES = ['en', 'en-US', 'en_us', ' EN-us ', 'es, en', 'es_CL,es', 'ES-cl', '', None, 'zh-Hant-TW']
+
+def notebook_stats(df: pd.DataFrame) -> tuple:
+    # get_stats of cc-metadata-analysis.ipynb.
+    df = df.fillna('')
+    domains = df['Domain'].tolist()
+    content_languages = []
+    for content_language in df['Content_Language'].tolist():
+        content_languages.extend(content_language.lower().strip().replace(' ', '').replace('_', '-').split(','))
+    html_langs = []
+    for html_lang in df['HTML_Language'].tolist():
+        html_langs.extend(html_lang.lower().strip().replace(' ', '').replace('_', '-').split(','))
+
+    return domains, content_languages, html_langs, df['HTML_Dir'].tolist()
+
+def metadata(seed: int, num_records=500) -> pd.DataFrame:
+    rng = random.Random(seed)
+    return pd.DataFrame({
+        'WARC_Record_ID': [f'<urn:{seed}:{i}>' for i in range(num_records)],
+        'Domain': [rng.choice(['cl', 'com', 'es', None]) for _ in range(num_records)],
+        'Content_Language': [rng.choice(LANGUAGES) for _ in range(num_records)],
+        'HTML_Language': [rng.choice(LANGUAGES) for _ in range(num_records)],
+        'HTML_Dir': [rng.choice(['ltr', 'rtl', 'auto', None]) for _ in range(num_records)],
+    })
+
+@pytest.fixture
+def dest(tmp_path):
+    for i in range(5):
+        df = metadata(i)
+        if i % 2: df.to_parquet(f'{tmp_path}/file{i}.parquet', index=False)
+        else: df.to_csv(f'{tmp_path}/file{i}.csv', index=False)
+
+    # Content and counts files are not metadata outputs.
+    pd.DataFrame({'Domain': ['x']}).to_csv(f'{tmp_path}/file0.wet.csv', index=False)
+    save_counts(f'{tmp_path}/{STATS_FILE}', {'Domain': Counter({'x': 1})})
+    return str(tmp_path)
+
+def test_normalize_languages():
+    assert normalize_languages(' en_US, ES ') == ['en-us', 'es']
+    assert normalize_languages('es_CL,,es') == ['es-cl', '', 'es']
+    assert normalize_languages(None) == [''] and normalize_languages(float('nan')) == ['']
+
+def test_count_file_matches_the_notebook(dest):
+    for path in get_output_files(dest):
+        counts = count_file(path)
+        expected = notebook_stats(metadata(int(os.path.basename(path)[4])))
+        assert [counts[column] for column in STATS_COLUMNS] == [Counter(values) for values in expected]
+
+def test_get_output_files(dest):
+    assert [os.path.basename(path) for path in get_output_files(dest)] == \
+        ['file0.csv', 'file1.parquet', 'file2.csv', 'file3.parquet', 'file4.csv']
+
+def test_cached_counts_are_invalidated(tmp_path, monkeypatch):
+    path, cache_dir = f'{tmp_path}/file.csv', f'{tmp_path}/{CACHE_DIR}'
+    os.makedirs(cache_dir)
+    metadata(0).to_csv(path, index=False)
+    counts = cached_count_file(path, cache_dir=cache_dir)
+    assert counts == count_file(path)
+
+    # Unchanged files are not read again.
+    calls = []
+    count = stats.count_file
+    monkeypatch.setattr(stats, 'count_file', lambda *args: calls.append(args) or count(*args))
+    assert cached_count_file(path, cache_dir=cache_dir) == counts and calls == []
+    assert cached_count_file(path, ['Domain', 'HTML_Dir'], cache_dir=cache_dir) == {column: counts[column] for column in ['Domain', 'HTML_Dir']}
+    assert calls == []
+
+    # Same size, other values and modification time.
+    df = metadata(0)
+    df['HTML_Dir'] = df['HTML_Dir'].replace({'ltr': 'rtl'})
+    df.to_csv(path, index=False)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cached_count_file(path, cache_dir=cache_dir)['HTML_Dir']['ltr'] == 0 and len(calls) == 1
+
+    # Other size.
+    metadata(1, num_records=100).to_csv(path, index=False)
+    assert sum(cached_count_file(path, cache_dir=cache_dir)['Domain'].values()) == 100 and len(calls) == 2
+
+    # Unreadable cache files are counted again.
+    with open(f'{cache_dir}/file.csv.json', 'w') as file: file.write('{')
+    assert cached_count_file(path, cache_dir=cache_dir) == count(path) and len(calls) == 3
+
+@pytest.mark.parametrize('num_workers', [1, 2])
+def test_compute_stats(dest, num_workers):
+    expected = [Counter() for _ in STATS_COLUMNS]
+    for i in range(5):
+        for counter, values in zip(expected, notebook_stats(metadata(i))): counter.update(values)
+
+    for cache in (False, True, True):
+        counts = compute_stats(dest, num_workers=num_workers, cache=cache)
+        assert [counts[column] for column in STATS_COLUMNS] == expected
+    assert len(os.listdir(f'{dest}/{CACHE_DIR}')) == 5
+
+def test_save_and_load_counts(dest, tmp_path):
+    counts = compute_stats(dest, cache=False)
+    save_counts(f'{tmp_path}/counts.csv', counts)
+    assert load_counts(f'{tmp_path}/counts.csv') == counts
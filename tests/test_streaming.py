@@ -0,0 +1,52 @@
+import os
+import pytest
+import extract_metadata
+import extract_text
+from extract_metadata import iter_metadata_rows
+from extract_text import iter_text_rows
+from sinks import read_output
+
+RANGE_COLUMNS = ['WARC_Offset', 'WARC_Length']
+
+@pytest.fixture(autouse=True)
+def served(crawl):
+    # Other tests may point utils.BASE_URL somewhere else.
+    crawl.serve()
+
+def run(module, paths_file, dest, **kwargs):
+    os.makedirs(dest)
+    module.run_pipeline(paths_file, dest_path=str(dest), num_workers=1, **kwargs)
+    return {name: read_output(f'{dest}/{name}') for name in sorted(os.listdir(dest)) if name.endswith('.csv')}
+
+def test_streamed_records_match_the_local_file(crawl):
+    for i, path in enumerate(crawl.warc_paths):
+        assert list(iter_metadata_rows(path, streaming=True)) == list(iter_metadata_rows(crawl.warc_file(i)))
+    for i, path in enumerate(crawl.wet_paths):
+        assert list(iter_text_rows(path, streaming=True)) == list(iter_text_rows(crawl.wet_file(i)))
+
+@pytest.mark.parametrize('module, paths', [(extract_metadata, 'warc_paths_file'), (extract_text, 'wet_paths_file')])
+def test_streaming_pipeline_matches_download_then_parse(crawl, tmp_path, module, paths):
+    downloaded = run(module, getattr(crawl, paths), tmp_path / 'download')
+    streamed = run(module, getattr(crawl, paths), tmp_path / 'streaming', streaming=True)
+
+    assert list(downloaded) == list(streamed) and len(streamed) == len(crawl.names)
+    for name, df in streamed.items():
+        assert len(df) > 0
+        # Decompressed files have no gzip members, so only streamed records have their ranges.
+        assert df[RANGE_COLUMNS].notna().all().all()
+        assert df.drop(columns=RANGE_COLUMNS).equals(downloaded[name].drop(columns=RANGE_COLUMNS))
+
+def test_streaming_without_decompression_keeps_the_ranges(crawl, tmp_path):
+    downloaded = run(extract_metadata, crawl.warc_paths_file, tmp_path / 'download', decompression=False)
+    streamed = run(extract_metadata, crawl.warc_paths_file, tmp_path / 'streaming', streaming=True)
+
+    for name, df in streamed.items():
+        assert df.equals(downloaded[name])
+
+def test_partial_fetch_matches_the_first_records(crawl, tmp_path):
+    streamed = run(extract_metadata, crawl.warc_paths_file, tmp_path / 'streaming', streaming=True)
+    partial = run(extract_metadata, crawl.warc_paths_file, tmp_path / 'partial', max_count=20, partial_fetch=True)
+
+    for name, df in partial.items():
+        assert len(df) == 20
+        assert df.equals(streamed[name].head(20))
@@ -0,0 +1,36 @@
+import pytest
+from utils import extract_tags
+from fields import extract_head
+
+TAGS = ['lang', 'xml:lang', 'dir']
+
+@pytest.mark.parametrize('html, expected', [
+    ('<html lang="en" dir="rtl">', ('en', None, 'rtl')),
+    ("<html class='a' lang='pt-BR' dir='LTR'>", ('pt-BR', None, 'ltr')),
+    ('<html dir=rtl lang=es-CL>', ('es-CL', None, 'rtl')),
+    ('<html xml:lang="de" lang="en">', ('en', 'de', None)),
+    ('<html xml:lang="de">', ('de', 'de', None)),
+    ('<html data-lang="x" lang="en">', ('en', None, None)),
+    ('<html lang="en-US.utf8"', ('en-US', None, None)),
+    ('<htmlx lang="en">', (None, None, None)),
+    ('<meta lang="en"><html>', (None, None, None)),
+    # The first occurrence of a repeated attribute wins.
+    ('<html lang="en" lang="fr">', ('en', None, None)),
+    ('<HTML LANG="en" Lang="fr" dir="ltr" dir="rtl">', ('en', None, 'ltr')),
+    ('<html xml:lang="de" xml:lang="fr" lang="en" lang="es">', ('en', 'de', None)),
+    # Attributes may follow a closing quote without whitespace.
+    ('<html lang="en"dir="rtl">', ('en', None, 'rtl')),
+    ("<html class='a'lang='fr'>", ('fr', None, None)),
+    # Values stop at a closing curly quote, like at the other invalid characters.
+    ('<html lang="en”" dir="rtl”">', ('en', None, 'rtl')),
+    ('<html lang=”en”>', (None, None, None)),
+])
+def test_html_start_tag(html, expected):
+    assert tuple(extract_tags(html, TAGS, 'utf-8').values()) == expected
+    assert tuple(extract_tags(html.encode('utf-16'), TAGS, 'utf-16').values()) == expected
+
+@pytest.mark.parametrize('charset', ['utf-16', 'Utf-16', 'UTF-16', 'utf-16le', 'UTF-16LE'])
+def test_wide_charsets_in_any_case(charset):
+    html = '<html lang="en" dir="rtl">'.encode(charset)
+    assert extract_tags(html, TAGS, charset) == {'lang': 'en', 'xml:lang': None, 'dir': 'rtl'}
+    assert extract_head('<title>Título</title>'.encode(charset), ['title'], charset) == {'title': 'Título'}
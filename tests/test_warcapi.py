@@ -0,0 +1,93 @@
+import pytest
+import pandas as pd
+import warcapi
+from warcapi import WARCChunk, MetadataFilter, TextFilter, DuplicateFilter
+from extract_metadata import iter_metadata_rows, save_metadata
+from sinks import read_output
+
+@pytest.fixture
+def records():
+    return pd.DataFrame({
+        'HTML_Language': ['en', 'e', 'es', None, 'en-US'],
+        'Text': ['Hello World', 'hello world', 'Hola', '', 'WORLD news'],
+    }, index=pd.Index([f'<urn:{i}>' for i in range(5)], name='WARC_Record_ID'))
+
+def assert_consistent(f, df, values):
+    # The vectorized mask keeps the same records as check, record by record.
+    assert f.mask(df).tolist() == [f.check(value) for value in values]
+
+@pytest.mark.parametrize('target, operator_type, expected', [
+    ('en', '==', [True, False, False, False, False]),
+    ('en', '!=', [False, True, True, True, True]),
+    # A single string is a single value: 'e' is not in 'en'.
+    ('en', 'in', [True, False, False, False, False]),
+    (['en', 'es'], 'in', [True, False, True, False, False]),
+    ({'e', 'en-US'}, 'in', [False, True, False, False, True]),
+    ((language for language in ['es']), 'in', [False, False, True, False, False]),
+])
+def test_metadata_filter(records, target, operator_type, expected):
+    f = MetadataFilter('HTML_Language', target, operator_type)
+    assert [f.check(value) for value in records['HTML_Language']] == expected
+    assert_consistent(f, records, records['HTML_Language'])
+
+@pytest.mark.parametrize('target, operator_type, sensitive', [
+    ('world', 'in', True), ('world', 'in', False), ('hello world', '==', False),
+    ('Hola', '==', True), ('Hola', '!=', True), ('hola', '!=', False),
+])
+def test_text_filter(records, target, operator_type, sensitive):
+    assert_consistent(TextFilter(target, operator_type, sensitive), records, records['Text'])
+
+def test_invalid_operator():
+    with pytest.raises(ValueError):
+        MetadataFilter('Domain', 'cl', '<')
+    with pytest.raises(ValueError):
+        TextFilter('a', 'contains')
+
+def test_duplicate_filter(records, tmp_path):
+    path = f'{tmp_path}/file.dedup.csv'
+    pd.DataFrame({'WARC_Record_ID': records.index, 'Keep': [1, 0, 1, 0, 1], 'Duplicate_Of': ''}).to_csv(path, index=False)
+
+    f = DuplicateFilter(path)
+    assert f.mask(records).tolist() == [True, False, True, False, True]
+    assert_consistent(f, records, records.index)
+
+@pytest.fixture
+def chunk_file(crawl, tmp_path):
+    path = f'{tmp_path}/{crawl.names[0]}.csv'
+    save_metadata(path, iter_metadata_rows(crawl.warc_file(0)))
+    return path
+
+def test_chunk_save_applies_the_filters(crawl, chunk_file, tmp_path, monkeypatch):
+    crawl.serve()
+    monkeypatch.setattr(warcapi, 'wet_dict', warcapi._get_paths(crawl.wet_paths_file, use_cache=False), raising=False)
+
+    chunk = WARCChunk(chunk_file, streaming=True)
+    filters = [MetadataFilter('HTML_Language', ['en', 'es'], 'in'), TextFilter('a', 'in', sensitive=False)]
+    # Saved to another folder: '<chunk_name>.csv' has the name of the input file.
+    (tmp_path / 'saved').mkdir()
+    chunk.save(f'{tmp_path}/saved', filters=filters)
+    saved = read_output(f'{tmp_path}/saved/{chunk.chunk_name}.csv')
+
+    expected = [record_id for record_id in chunk.warc_df.index
+                if chunk.filter_metadata(record_id, 'HTML_Language', ['en', 'es'], 'in')
+                and chunk.filter_text(record_id, 'a', 'in', sensitive=False)]
+    assert 0 < len(expected) < len(chunk.warc_df)
+    assert sorted(saved['WARC_Record_ID']) == sorted(expected)
+    assert saved['Text'].tolist() == [chunk.get_text(record_id) for record_id in saved['WARC_Record_ID']]
+
+def test_chunk_without_wet_file(chunk_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(warcapi, 'wet_dict', {}, raising=False)
+
+    with pytest.raises(KeyError):
+        WARCChunk(chunk_file)
+
+    chunk = WARCChunk(chunk_file, ignore_errors=True, store_dir=f'{tmp_path}/store')
+    record_id = chunk.warc_df.index[0]
+    assert chunk.get_text(record_id, default_value='missing') == 'missing'
+    assert chunk.filter_text(record_id, '', '==')
+
+    (tmp_path / 'saved').mkdir()
+    chunk.save(f'{tmp_path}/saved', filters=[TextFilter('', '==')])
+    saved = read_output(f'{tmp_path}/saved/{chunk.chunk_name}.csv')
+    assert sorted(saved['WARC_Record_ID']) == sorted(chunk.warc_df.index)
+    assert saved['Text'].isna().all()
@@ -0,0 +1,71 @@
+import os
+import pytest
+import warcapi
+import wetstore
+from wetstore import WETStore
+from warcapi import WARCChunk
+from extract_metadata import iter_metadata_rows, save_metadata
+
+TEXTS = {f'<urn:uuid:{i}>': f'Texto {i}\ncon ñ, "comillas" y\r\nlíneas' * (i % 4) for i in range(50)}
+
+def test_build_and_lookup(tmp_path):
+    store_dir = f'{tmp_path}/store'
+    assert not WETStore.exists(store_dir, 'chunk')
+    # Records are written as they come, from a generator.
+    assert WETStore.build(((record_id, text) for record_id, text in TEXTS.items()), store_dir, 'chunk') == len(TEXTS)
+    assert sorted(os.listdir(store_dir)) == ['chunk.wet.blob', 'chunk.wet.idx.npy']
+
+    store = WETStore(store_dir, 'chunk')
+    assert len(store) == len(TEXTS)
+    assert all(store.get(record_id) == text for record_id, text in TEXTS.items())
+    # Empty texts are stored too.
+    assert store.get('<urn:uuid:0>') == '' and '<urn:uuid:0>' in store
+    store.close()
+
+def test_missing_keys(tmp_path):
+    WETStore.build(TEXTS.items(), f'{tmp_path}/store', 'chunk')
+    store = WETStore(f'{tmp_path}/store', 'chunk')
+    assert store.get('<urn:uuid:missing>') is None and store.get('<urn:uuid:missing>', '') == ''
+    assert '<urn:uuid:missing>' not in store
+    store.close()
+
+    with pytest.raises(FileNotFoundError):
+        WETStore(f'{tmp_path}/store', 'other')
+
+def test_hash_collisions(tmp_path, monkeypatch):
+    # Every record ID has one of two keys: lookups tell them apart by the stored ID.
+    monkeypatch.setattr(wetstore, 'record_key', lambda record_id: len(record_id) % 2)
+    WETStore.build(TEXTS.items(), f'{tmp_path}/store', 'chunk')
+    store = WETStore(f'{tmp_path}/store', 'chunk')
+    assert all(store.get(record_id) == text for record_id, text in TEXTS.items())
+    assert store.get('<urn:uuid:missing>') is None
+    store.close()
+
+def test_empty_store(tmp_path):
+    assert WETStore.build([], f'{tmp_path}/store', 'chunk') == 0
+    assert os.path.getsize(f'{tmp_path}/store/chunk.wet.blob') == 0
+
+    store = WETStore(f'{tmp_path}/store', 'chunk')
+    assert len(store) == 0 and store.get('<urn:uuid:0>') is None and '<urn:uuid:0>' not in store
+    store.close()
+
+def test_chunk_reopens_its_store(crawl, tmp_path, monkeypatch):
+    crawl.serve()
+    chunk_file = f'{tmp_path}/{crawl.names[0]}.csv'
+    save_metadata(chunk_file, iter_metadata_rows(crawl.warc_file(0)))
+    store_dir = f'{tmp_path}/store'
+
+    monkeypatch.setattr(warcapi, 'wet_dict', warcapi._get_paths(crawl.wet_paths_file, use_cache=False), raising=False)
+    built = WARCChunk(chunk_file, streaming=True, store_dir=store_dir)
+    assert built.store is not None and built.wet_df is None
+    texts = {record_id: built.get_text(record_id) for record_id in built.warc_df.index}
+    assert any(texts.values())
+
+    # Reopened without wet.paths nor fetching the WET file.
+    monkeypatch.setattr(warcapi, 'wet_dict', {}, raising=False)
+    def fail(*args, **kwargs): raise AssertionError('the WET file was fetched again')
+    monkeypatch.setattr(warcapi, 'iter_text', fail)
+    monkeypatch.setattr(warcapi, 'download', fail)
+    reopened = WARCChunk(chunk_file, store_dir=store_dir)
+    assert len(reopened.store) == len(built.store)
+    assert {record_id: reopened.get_text(record_id) for record_id in reopened.warc_df.index} == texts
@@ -1,8 +1,10 @@
-import requests
-import gzip
-import shutil
 import os
+import re
+import sys
+from contextlib import contextmanager
+from itertools import islice
 from urllib.parse import urlparse
+import metrics
 
 BASE_URL = 'https://data.commoncrawl.org/'
 
@@ -14,55 +16,133 @@ invalid_chars = {
 
 # source: https://html.spec.whatwg.org/multipage/dom.html#the-dir-attribute
 # 'auto' is not beign considered since it cannot be inferred in HTML text
-valid_dir = {'ltr', 'rtl'}
+valid_dir = {b'ltr', b'rtl'}
 
 # TODO
 # valid_lang = {}
 
+def batched(iterable, size: int):
+    """
+    Splits an iterable into lists of at most 'size' elements, consuming it lazily.
+
+    Parameters:
+    - iterable: Iterable to be split (e.g. a record generator).
+    - size (int): Max number of elements per batch.
+
+    Returns:
+    generator: Lists of elements, in order.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch: return
+        yield batch
+
+def intern_value(value):
+    """
+    Returns the interned copy of a string (None is returned as is). Low-cardinality values (domains,
+    languages, directions) are interned while extracting, so every record of a batch shares one string per value.
+    """
+    return sys.intern(value) if value is not None else None
+
+def with_record_ranges(items, stream, compressed=True):
+    """
+    Adds where every record is in its .gz file (the offset and length of its gzip member, see recordreader.py)
+    to the rows parsed from it. The length of a record is only known once the next one starts, so every row
+    is yielded after the next WARC record is read.
+
+    Parameters:
+    - items: Generator of (row, stream_pos) pairs, one per WARC record of the file, where row is the tuple
+      extracted from it, or None if it was skipped.
+    - stream: Stream being parsed, its position after the last record is the end of the last member.
+    - compressed (bool): Whether the stream is the .gz file itself. Positions in a decompressed file are not
+      member positions, so the ranges are left empty (default is True).
+
+    Returns:
+    generator: The rows, in order, with the offset and length (as strings) appended.
+    """
+    if not compressed:
+        for row, _ in items:
+            if row is not None:
+                yield row + (None, None)
+        return
+
+    pending, offset = None, 0
+    for row, position in items:
+        if pending is not None:
+            yield pending + (str(offset), str(position - offset))
+            pending = None
+
+        if row is not None:
+            pending, offset = row, position
+
+    if pending is not None:
+        yield pending + (str(offset), str(stream.tell() - offset))
+
 def get_domain_from_url(url: str):
     parsed_url = urlparse(url)
     domain = parsed_url.netloc
     return domain
 
+# Value of an attribute (double-quoted, single-quoted or unquoted). Only its longest prefix without
+# invalid characters (see invalid_chars, multi-byte ones as UTF-8) is captured, so values come out of the scan already cleaned.
+_invalid_bytes = b''.join(re.escape(c.encode('utf-8')) for c in sorted(invalid_chars) if len(c.encode('utf-8')) == 1)
+_invalid_sequences = b'|'.join(re.escape(c.encode('utf-8')) for c in sorted(invalid_chars) if len(c.encode('utf-8')) > 1)
+_attribute_value = rb"""\s*=\s*["']?\s*((?:(?!""" + _invalid_sequences + rb""")[^'\s""" + _invalid_bytes + rb"""])*)[^"'\s>]*["']?"""
+
+# Start tag of the root element, walked attribute by attribute in a single pass. Only 'lang', 'xml:lang'
+# and 'dir' are captured, any other attribute is skipped. Like browsers, the first occurrence of a repeated
+# attribute wins: once its group is set, its branch fails and the generic one skips it. Attributes are
+# separated by whitespace or follow a closing quote. A start tag cut by the window still matches.
+_html_start_tag = re.compile(
+    rb"""<html(?:(?:\s+|(?<=["']))(?:(?(1)(?!)|lang""" + _attribute_value + rb')|(?(2)(?!)|xml:lang' + _attribute_value +
+    rb')|(?(3)(?!)|dir' + _attribute_value + rb""")|[^\s=>]+(?:\s*=\s*(?:"[^"]*"|'[^']*'|[^\s"'>]*))?))*""",
+    re.IGNORECASE
+)
+
+# Encodings that are not ASCII compatible, so they cannot be scanned as raw bytes (compared in lowercase).
+_wide_charsets = {'utf-16', 'utf-16le', 'utf-16be', 'utf-32', 'utf-32le', 'utf-32be'}
+
 def extract_tags(html_xml, tags: list, charset, default_value=None) -> dict:
     """
     Extract tags from an HTML or XML bytes or string.
-    Internally, it does not parse the HTML or XML, instead it follows a string search to find 
-    the requested tags. Therefore, only the first match for a tag is considered.
+    Internally, it does not parse the HTML or XML nor decode it. A single precompiled scan over the
+    bytes walks the attributes of the <html> start tag (double-quoted, single-quoted or unquoted), so
+    attributes of other elements (e.g. <meta> or scripts) are never considered.
 
     Parameters:
-    - html_xml: HTML or XML as bytes or string.
-    - tags (list): Tags to be extracted.
-    - charset: Specific encoding for HTML or XML.
+    - html_xml: HTML or XML as bytes or string (usually the first bytes of the payload).
+    - tags (list): Tags to be extracted ('lang', 'xml:lang' and/or 'dir'). 'lang' falls back to 'xml:lang'.
+    - charset: Specific encoding for HTML or XML (only the extracted values are decoded).
     - default_value: If a tag is not found, in the returned dictionary save this value in the tag key.
 
     Returns:
     - dict: Dictionary containing the requested tags with their corresponding values.
     """
+    if type(html_xml) is str:
+        html_xml, charset = html_xml.encode('utf-8'), 'utf-8'
+    elif charset.lower() in _wide_charsets:
+        html_xml, charset = html_xml.decode(charset, errors='replace').encode('utf-8'), 'utf-8'
+
+    # bytes.find is much faster than a case-insensitive regex search, lowering is only a fallback.
+    start = html_xml.find(b'<html')
+    if start == -1:
+        start = html_xml.lower().find(b'<html')
+        if start == -1:
+            return {tag: default_value for tag in tags}
 
-    content = html_xml.decode(charset, errors='replace')
+    lang, xml_lang, direction = _html_start_tag.match(html_xml, start).groups()
 
     result_dict = {}
     for tag in tags:
-        search_string = f'{tag}="'
-        index = content.find(search_string)
-
-        if index != -1:
-            buffer = ''
-            end_index = index + len(search_string)
-            for c in content[end_index:]:
-                if c in invalid_chars: break
-                buffer += c
-
-            if buffer in {'lang', 'dir'}: buffer = default_value
-
-            if tag == 'dir' and buffer not in valid_dir: buffer = default_value
-            # TODO check for language
-
-            result_dict[tag] = buffer
+        if tag == 'dir':
+            direction = direction.lower() if direction else None
+            result_dict[tag] = direction.decode() if direction in valid_dir else default_value
             continue
 
-        result_dict[tag] = default_value
+        value = (lang or xml_lang) if tag == 'lang' else xml_lang if tag == 'xml:lang' else None
+        # TODO check for language
+        result_dict[tag] = value.decode(charset, errors='replace') if value and value not in {b'lang', b'dir'} else default_value
 
     return result_dict
 
@@ -106,55 +186,88 @@ def get_warc_header(name: str, warc_headers, default_value=None):
 def download(warc_path: str, dest_path='', errors=None, verbose=False):
     """
     Downloads a single WARC path and saves it into a destionation folder.
+    It uses the shared HTTP client (see client.py): pooled connections, retries with backoff on
+    throttling, and Range requests to resume interrupted transfers. The body is streamed to disk in chunks.
+    If a download cache is configured (see cache.py), the file is taken from the cache when possible.
 
     Parameters:
     - warc_path (str): WARC path to be downloaded (without base URL).
     - dest_path (str): Destionation folder to save the WARC record (default is the current directory).
     - errors (str): File to save the corresponding WARC path if the download failed (default is None, that means no errors file).
+
+    Returns:
+    str: Path to the downloaded file, or None if the download failed.
     """
 
     url = BASE_URL + warc_path
     out = warc_path.split('/')[-1]
 
-    if os.path.exists(f'{dest_path}/{out}'): return
+    # Files are renamed into place only once complete, so an existing file is never a partial download.
+    if os.path.exists(f'{dest_path}/{out}'): return f'{dest_path}/{out}'
 
     if dest_path != '' and (dest_path[-1] != '/' or dest_path[-1] != '\\'):
         dest_path = f'{dest_path}/{out}'
     else:
         dest_path = out
 
-    response = requests.get(url)
+    from client import get_client # deferred, it imports requests
+    from cache import get_cache, link_or_copy
+
+    def fetch(file_path):
+        with metrics.stage('download'):
+            size = get_client().download(url, file_path)
+        metrics.count('download_bytes', size)
+
+    try:
+        cache = get_cache()
+        if cache is None:
+            fetch(dest_path)
+        else:
+            # The file is downloaded into the shared cache (unless it is already there) and linked into
+            # dest_path, so removing it after parsing does not remove it from the cache.
+            missed = []
+            cached = cache.fetch(warc_path, lambda file_path: missed.append(fetch(file_path)))
+            metrics.count('cache_misses' if missed else 'cache_hits')
+            link_or_copy(cached, dest_path)
 
-    if response.status_code == 200:
-        with open(dest_path, 'wb') as file:
-            file.write(response.content)
-        file.close()
         if verbose: print(f'File downloaded successfully to {dest_path}')
-    else:
+        return dest_path
+    except Exception as e:
         if errors != None:
             with open(errors, 'a') as file:
                 file.write(f'{warc_path}\n')
-        
-        print(f'Failed to download file. Status code: {response.status_code}')
 
-def decompress_gz(file_path: str, extract_path: str, remove=False):
+        metrics.count('download_errors')
+        print(f'Failed to download file. {e}')
+        return None
+
+def decompress_gz(file_path: str, extract_path: str, remove=False, num_threads=1):
     """
-    Decompress a GZip file.
+    Decompress a GZip file. Members are inflated directly with zlib (or a faster backend, see inflate.py), and
+    with several threads a multi-member file (as every CommonCrawl file) is split at member boundaries and its
+    chunks are inflated in parallel, the output being written in order.
 
     Parameters:
     - file_path (str): File path to extract.
     - extract_path (str): Path to save the extracted file.
     - remove (bool): Wether you want to remove the compressed file after decompressing or not (default is False).
+    - num_threads (int): Number of threads inflating the file (default is 1).
 
     Returns:
     str: Path to the extracted file.
     """
+    from inflate import iter_inflate
+
     name = file_path.split('/')[-1].removesuffix('.gz')
     output = f'{extract_path}/{name}'
 
     try:
-        with gzip.open(file_path, 'rb') as gz_file, open(output, 'wb') as out_file:
-            shutil.copyfileobj(gz_file, out_file)
+        with metrics.stage('decompress'):
+            with open(f'{output}.part', 'wb') as out_file:
+                for data in iter_inflate(file_path, num_threads):
+                    out_file.write(data)
+            os.replace(f'{output}.part', output)
+        metrics.count('decompressed_bytes', os.path.getsize(output))
 
         if remove:
             os.remove(file_path)
@@ -162,3 +275,80 @@ def decompress_gz(file_path: str, extract_path: str, remove=False):
         return output
     except Exception as e:
         print(f'[Decompression] An error ocurred: {e}')
+
+@contextmanager
+def open_stream(warc_path: str, errors=None, verbose=False, partial_fetch=False):
+    """
+    Opens a WARC path from CommonCrawl as a streaming HTTP body. Nothing is written to disk and
+    only the bytes currently being parsed are held in memory. If the connection drops, the body is
+    resumed from the current position with a Range request (see client.py).
+    If a download cache is configured (see cache.py), a cached file is read from disk instead, and a
+    body streamed to the end is added to the cache.
+
+    Parameters:
+    - warc_path (str): WARC path to be streamed (without base URL).
+    - errors (str): File to save the corresponding WARC path if the request failed (default is None, that means no errors file).
+    - partial_fetch (bool): Fetch the body in Range requests of growing size (see client.RangeReader), for readers
+      that only need the first records of the file (default is False).
+
+    Returns:
+    file: Raw (still compressed) response body, to be consumed by an ArchiveIterator.
+    """
+    url = BASE_URL + warc_path
+
+    from client import get_client # deferred, it imports requests
+    from cache import get_cache, CachingReader
+
+    cache = get_cache()
+    cached = cache.get(warc_path) if cache is not None else None
+    if cached is not None:
+        metrics.count('cache_hits')
+        if verbose: print(f'Reading {warc_path} from the cache')
+        with open(cached, 'rb') as stream:
+            yield stream
+        return
+
+    try:
+        reader = get_client().open_range(url) if partial_fetch else get_client().open(url)
+    except Exception as e:
+        if errors != None:
+            with open(errors, 'a') as file:
+                file.write(f'{warc_path}\n')
+
+        raise IOError(f'Failed to stream file. {e}')
+
+    try:
+        if verbose: print(f'Streaming {url}')
+        # The body is gzip encoded at the file level, not at the HTTP level, so the raw bytes
+        # are exactly the .warc.gz contents and ArchiveIterator decompresses them on the fly.
+        if cache is None or partial_fetch:
+            yield reader
+        else:
+            # The streamed bytes are also written to the cache, which keeps them if the body is read to the end.
+            metrics.count('cache_misses')
+            with CachingReader(cache, warc_path, reader) as stream:
+                yield stream
+    finally:
+        metrics.count('download_bytes', reader.fetched if partial_fetch else reader.position)
+        reader.close()
+
+@contextmanager
+def open_archive(warc_path: str, streaming=False, errors=None, verbose=False, partial_fetch=False):
+    """
+    Opens a WARC/WET file either from disk or, in streaming mode, directly from CommonCrawl.
+
+    Parameters:
+    - warc_path (str): Local file path, or WARC path (without base URL) if streaming is enabled.
+    - streaming (bool): Whether warc_path must be streamed over HTTP instead of read from disk (default is False).
+    - errors (str): File to save the corresponding WARC path if streaming failed (default is None).
+    - partial_fetch (bool): When streaming, fetch only the leading byte ranges that are read (default is False).
+
+    Returns:
+    file: Binary stream to be consumed by an ArchiveIterator.
+    """
+    if streaming:
+        with open_stream(warc_path, errors, verbose, partial_fetch) as stream:
+            yield stream
+    else:
+        with open(warc_path, 'rb') as stream:
+            yield stream
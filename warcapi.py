@@ -1,12 +1,34 @@
-import pandas as pd
 import os
 import operator
+import pickle
 from utils import *
-from fastwarc.warc import ArchiveIterator
+from extract_text import iter_text
+from sinks import read_output, EXTENSIONS
 
-def _get_paths(paths_file: str) -> dict:
+# pandas and the WET store (numpy) are imported on first use, so importing this module stays cheap.
+
+WET_PATHS = 'wet.paths'
+
+def _get_paths(paths_file: str, use_cache=True) -> dict:
+    """
+    Maps every file name in a warc.paths or wet.paths file to its crawl/segment prefix.
+    The mapping is cached next to the paths file ('{paths_file}.cache') and rebuilt only when the
+    paths file changes. Prefixes are shared between files, so the cache stays compact.
+    """
     if not os.path.exists(paths_file): return {}
 
+    stat = os.stat(paths_file)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cache_file = f'{paths_file}.cache'
+
+    if use_cache and os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'rb') as file:
+                cached_version, _dict = pickle.load(file)
+            if cached_version == version: return _dict
+        except Exception:
+            pass
+
     _dict = {}
     _type = paths_file.split('/')[-1].split('\\')[-1].split('.')[0]
 
@@ -16,20 +38,44 @@ def _get_paths(paths_file: str) -> dict:
     elif _type == 'wet':
         suffix = '.warc.wet.gz'
 
-    paths = open(paths_file, 'r').read().splitlines()
-    for path in paths:
-        segments = path.split('/')
-        crawl_data = f'{segments[0]}/{segments[1]}/'
-        segment = f'{segments[2]}/{segments[3]}/{segments[4]}/'
+    prefixes = {}
+    with open(paths_file, 'r') as paths:
+        for path in paths:
+            segments = path.rstrip('\n').split('/')
+            if len(segments) < 6: continue
+            crawl_data = f'{segments[0]}/{segments[1]}/'
+            segment = f'{segments[2]}/{segments[3]}/{segments[4]}/'
+
+            prefix = prefixes.setdefault(crawl_data + segment, crawl_data + segment)
 
-        prefix = crawl_data + segment
+            file = segments[5].removesuffix(suffix)
+            _dict[file] = prefix
 
-        file = segments[5].removesuffix(suffix)
-        _dict[file] = prefix
+    if use_cache:
+        try:
+            with open(f'{cache_file}.tmp', 'wb') as file:
+                pickle.dump((version, _dict), file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f'{cache_file}.tmp', cache_file)
+        except OSError:
+            pass
 
     return _dict
 
-wet_dict = _get_paths('wet.paths')
+def get_wet_dict() -> dict:
+    """
+    Returns the mapping of WET files to their prefixes, reading WET_PATHS the first time it is needed.
+    """
+    global wet_dict
+    try:
+        return wet_dict
+    except NameError:
+        wet_dict = _get_paths(WET_PATHS)
+        return wet_dict
+
+def __getattr__(name):
+    # 'warcapi.wet_dict' keeps working, but wet.paths is only read when it is first accessed.
+    if name == 'wet_dict': return get_wet_dict()
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
 
 comparison_func = {
     '==': operator.eq,
@@ -38,49 +84,70 @@ comparison_func = {
 }
 
 class WARCChunk:
-    def __init__(self, csv_warc_chunk: str, ignore_errors=False):
+    def __init__(self, csv_warc_chunk: str, ignore_errors=False, streaming=False, store_dir=None):
         self.chunk = csv_warc_chunk
-        self.chunk_name = csv_warc_chunk.split('/')[-1].split('\\')[-1].removesuffix('.csv')
-        self.warc_df = pd.read_csv(self.chunk, index_col='WARC_Record_ID')
+        self.chunk_name = csv_warc_chunk.split('/')[-1].split('\\')[-1].removesuffix('.csv').removesuffix(EXTENSIONS['parquet'])
+        self.warc_df = read_output(self.chunk, index_col='WARC_Record_ID')
         self.ignore_errors = ignore_errors
+        self.streaming = streaming
+        self.store_dir = store_dir
         self.wet_df = None
+        self.store = None
         self._load()
 
     def _load(self):
-        if self.chunk_name not in wet_dict and not self.ignore_errors:
-            raise f'{self.chunk_name} does not exist in wet.paths'
-        
-        prefix = wet_dict[self.chunk_name]
-        file = f'{self.chunk_name}.warc.wet.gz'
-        dest_file = prefix+file
-        download(dest_file, '.')
-
-        records = []
-        with open(file, 'rb') as stream:
-            for record in ArchiveIterator(stream):
-                content_type = get_warc_header('Content-Type', record.headers)
-                if not content_type: continue
-                if content_type != 'text/plain': continue
-
-                warc_refers_to = get_warc_header('WARC-Refers-To', record.headers)
-                content = record.reader.read().decode('utf-8', errors='replace')
-
-                records.append({
-                    'WARC_Refers_To': warc_refers_to,
-                    'Content': content
-                })
-
-        self.wet_df = pd.DataFrame(records)
-        self.wet_df.set_index('WARC_Refers_To', inplace=True)
-
-        os.remove(file)
+        # A persistent store is opened in O(index size), the WET file is only fetched the first time.
+        from wetstore import WETStore
+
+        if self.store_dir is not None and WETStore.exists(self.store_dir, self.chunk_name):
+            self.store = WETStore(self.store_dir, self.chunk_name)
+            return
+
+        wet_dict = get_wet_dict()
+        if self.chunk_name not in wet_dict:
+            if not self.ignore_errors:
+                raise KeyError(f'{self.chunk_name} does not exist in wet.paths')
+
+            # Every text is missing (see get_text), and no store is built, so it is fetched once wet.paths has it.
+            records = []
+        else:
+            prefix = wet_dict[self.chunk_name]
+            file = f'{self.chunk_name}.warc.wet.gz'
+            dest_file = prefix+file
+            if self.streaming:
+                source = dest_file
+            else:
+                download(dest_file, '.')
+                source = file
+
+            records = iter_text(source, remove=not self.streaming, streaming=self.streaming)
+
+            if self.store_dir is not None:
+                WETStore.build(((r['WARC_Refers_To'], r['Content']) for r in records), self.store_dir, self.chunk_name)
+                self.store = WETStore(self.store_dir, self.chunk_name)
+                return
+
+        # Only the two needed columns are kept, instead of a dictionary per record.
+        refers_to, contents = [], []
+        for record in records:
+            refers_to.append(record['WARC_Refers_To'])
+            contents.append(record['Content'])
+
+        import pandas as pd
+
+        self.wet_df = pd.DataFrame({'Content': contents}, index=pd.Index(refers_to, name='WARC_Refers_To'))
     
     def get_text(self, warc_record_id, default_value='') -> str:
         try:
+            if self.store is not None:
+                text = self.store.get(warc_record_id)
+                if text is None: raise KeyError(warc_record_id)
+                return text
+
             return self.wet_df.at[warc_record_id, 'Content']
         except KeyError:
             if not self.ignore_errors:
-                raise f'{warc_record_id} does not exist in the WET format.'
+                raise KeyError(f'{warc_record_id} does not exist in the WET format.')
 
             return default_value
         
@@ -89,7 +156,7 @@ class WARCChunk:
             return self.warc_df.at[warc_record_id, column]
         except KeyError:
             if not self.ignore_errors:
-                raise f'{warc_record_id} does not exist in the WARC format'
+                raise KeyError(f'{warc_record_id} does not exist in the WARC format')
             
             return default_value
         
@@ -100,49 +167,164 @@ class WARCChunk:
         return self.warc_df.query(query).sample(frac=frac).index.tolist()
     
     def save(self, dest_folder = '.', query=None, sample=1, filters=None):
+        """
+        Saves the sampled records of the chunk with their text to '{dest_folder}/{chunk_name}.csv'.
+        The metadata and the text are joined on the record ID and the filters are evaluated as
+        vectorized column predicates over the joined table.
+
+        Parameters:
+        - dest_folder (str): Folder to save the CSV file (default is the current directory).
+        - query (str): pandas query over the metadata columns (default is None, that means every record).
+        - sample (float): Fraction of the records to sample (default is 1).
+        - filters (list): MetadataFilter, TextFilter and DuplicateFilter objects that every saved record must satisfy.
+          Plain callables receiving a record ID are still accepted, but evaluated record by record.
+        """
+        import pandas as pd
+
         dest = f'{dest_folder}/{self.chunk_name}.csv'
 
         records = self.get(query, sample)
 
-        data = []
-        for record in records:
-            if filters is not None and not all(f(record) for f in filters):
-                continue
-
-            data.append({
-                'WARC_File': self.chunk_name,
-                'WARC_Record_ID': record,
-                'Text': self.get_text(record),
-                'WARC_Target_URI': self.get_metadata(record, 'WARC_Target_URI'),
-                'Content_Language': self.get_metadata(record, 'Content_Language'),
-                'HTML_Lang': self.get_metadata(record, 'HTML_Lang'),
-                'HTML_Dir': self.get_metadata(record, 'HTML_Dir'),
-                'Domain': self.get_metadata(record, 'Domain')
-            })
-            
-        df = pd.DataFrame(data)
-        df.to_csv(dest, index=False)
+        df = self.warc_df.loc[records]
+        df = df.assign(Text=self._get_texts(df.index))
 
-    def filter_metadata(self, record, metadata, target, operator_type='=='):
-        comparison_func.get(operator_type)
+        for f in filters or []:
+            mask = f.mask(df) if isinstance(f, (MetadataFilter, TextFilter, DuplicateFilter)) else df.index.map(f).astype(bool)
+            df = df[mask]
 
-        if comparison_func is None:
-            raise ValueError("Invalid operator_type. Supported values are '==', '!=' and 'in'.")
+        data = pd.DataFrame({
+            'WARC_File': self.chunk_name,
+            'WARC_Record_ID': df.index,
+            'Text': df['Text'].values,
+            'WARC_Target_URI': df['WARC_Target_URI'].values,
+            'Content_Language': df['Content_Language'].values,
+            'HTML_Lang': df['HTML_Language'].values,
+            'HTML_Dir': df['HTML_Dir'].values,
+            'Domain': df['Domain'].values
+        })
+        data.to_csv(dest, index=False)
+
+    def _get_texts(self, warc_record_ids, default_value='') -> list:
+        if self.store is not None:
+            texts = [self.store.get(record_id) for record_id in warc_record_ids]
+        else:
+            texts = self.wet_df['Content'].reindex(warc_record_ids).tolist()
+            texts = [None if isinstance(text, float) else text for text in texts]
+
+        missing = sum(text is None for text in texts)
+        if missing and not self.ignore_errors:
+            raise KeyError(f'{missing} records do not exist in the WET format.')
+
+        return [default_value if text is None else text for text in texts]
+
+    def filter_metadata(self, record, metadata, target, operator_type='=='):
+        """
+        Evaluates a metadata predicate on a single record (see MetadataFilter for the vectorized version).
+        """
+        return MetadataFilter(metadata, target, operator_type).check(self.get_metadata(record, metadata))
 
-        _metadata = self.get_metadata(record, metadata)
-        return comparison_func(target, _metadata)
-    
-    
     def filter_text(self, record, target, operator_type='==', sensitive=True):
-        comparison_func.get(operator_type)
+        """
+        Evaluates a text predicate on a single record (see TextFilter for the vectorized version).
+        """
+        return TextFilter(target, operator_type, sensitive).check(self.get_text(record))
 
-        if comparison_func is None:
-            raise ValueError("Invalid operator_type. Supported values are '==', '!=' and 'in'.")
-        
-        text = self.get_text(record)
+def _check_operator(operator_type: str):
+    if operator_type not in comparison_func:
+        raise ValueError("Invalid operator_type. Supported values are '==', '!=' and 'in'.")
 
-        if sensitive:
-            return comparison_func(target, text)
-                    
-        return comparison_func(target.lower(), text.lower())
-        
+class MetadataFilter:
+    """
+    Predicate over a metadata column.
+
+    Parameters:
+    - column (str): Metadata column (e.g. 'Domain' or 'HTML_Language').
+    - target: Value to compare with, or a collection of values if operator_type is 'in' (a single string is one value,
+      not a collection of characters).
+    - operator_type (str): '==' (equality), '!=' (inequality) or 'in' (membership in target).
+    """
+    def __init__(self, column: str, target, operator_type='=='):
+        _check_operator(operator_type)
+        self.column = column
+        self.operator_type = operator_type
+        if operator_type == 'in':
+            # check and mask both test membership in the same list.
+            target = [target] if isinstance(target, str) else list(target)
+        self.target = target
+
+    def check(self, value) -> bool:
+        if self.operator_type == 'in':
+            return value in self.target
+
+        return comparison_func[self.operator_type](value, self.target)
+
+    def mask(self, df: 'pd.DataFrame') -> 'pd.Series':
+        column = df[self.column]
+        if self.operator_type == 'in':
+            return column.isin(self.target)
+        if self.operator_type == '==':
+            return column == self.target
+
+        return column != self.target
+
+class TextFilter:
+    """
+    Predicate over the text of a record.
+
+    Parameters:
+    - target (str): Text to compare with.
+    - operator_type (str): '==' (equality), '!=' (inequality) or 'in' (target is a substring of the text).
+    - sensitive (bool): Whether the comparison is case-sensitive (default is True).
+    """
+    def __init__(self, target: str, operator_type='==', sensitive=True):
+        _check_operator(operator_type)
+        self.target = target
+        self.operator_type = operator_type
+        self.sensitive = sensitive
+
+    def check(self, text: str) -> bool:
+        target = self.target
+        if not self.sensitive:
+            text, target = text.lower(), target.lower()
+
+        if self.operator_type == 'in':
+            return target in text
+
+        return comparison_func[self.operator_type](text, target)
+
+    def mask(self, df: 'pd.DataFrame') -> 'pd.Series':
+        text = df['Text']
+        if self.operator_type == 'in':
+            return text.str.contains(self.target, case=self.sensitive, regex=False)
+
+        target = self.target
+        if not self.sensitive:
+            text, target = text.str.lower(), target.lower()
+
+        if self.operator_type == '==':
+            return text == target
+
+        return text != target
+
+class DuplicateFilter:
+    """
+    Drops the near-duplicates found by dedup.py: records whose Keep is 0 in some '<name>.dedup.csv' masks.
+
+    Parameters:
+    - mask_files: Path of a mask file, or a list of them (e.g. the masks of every file of a crawl).
+    """
+    def __init__(self, mask_files):
+        import csv
+
+        if isinstance(mask_files, str): mask_files = [mask_files]
+
+        self.dropped = set()
+        for path in mask_files:
+            with open(path, 'r', encoding='utf-8', newline='') as file:
+                self.dropped.update(row['WARC_Record_ID'] for row in csv.DictReader(file) if row['Keep'] == '0')
+
+    def check(self, record_id: str) -> bool:
+        return record_id not in self.dropped
+
+    def mask(self, df: 'pd.DataFrame') -> 'pd.Series':
+        return ~df.index.isin(self.dropped)
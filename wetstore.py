@@ -0,0 +1,117 @@
+import os
+import mmap
+import zlib
+import hashlib
+import numpy as np
+
+# One entry per record: hash of its record ID, and where its compressed text is in the blob file.
+INDEX_DTYPE = np.dtype([('key', '<u8'), ('offset', '<u8'), ('length', '<u4')])
+
+def record_key(record_id: str) -> int:
+    """
+    Returns the 64-bit key of a record ID used by the index.
+    """
+    return int.from_bytes(hashlib.blake2b(record_id.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class WETStore:
+    """
+    Persistent text store of a WET chunk. Every record is compressed on its own into a blob file,
+    and an index sorted by record ID hash maps IDs to (offset, length) in the blob. Both files are
+    memory-mapped, so opening a store only maps its index and a lookup is a binary search plus
+    the decompression of a single record.
+
+    Parameters:
+    - store_dir (str): Folder containing the store files.
+    - chunk_name (str): Name of the chunk (e.g. 'CC-MAIN-20231128083443-20231128113443-00000').
+    """
+    def __init__(self, store_dir: str, chunk_name: str):
+        self.blob_path, self.index_path = WETStore.paths(store_dir, chunk_name)
+
+        if not WETStore.exists(store_dir, chunk_name):
+            raise FileNotFoundError(f'There is no WET store for {chunk_name} in {store_dir}')
+
+        self.index = np.load(self.index_path, mmap_mode='r')
+        self._file = open(self.blob_path, 'rb')
+        self._blob = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(self.blob_path) > 0 else b''
+
+    @staticmethod
+    def paths(store_dir: str, chunk_name: str) -> tuple:
+        return f'{store_dir}/{chunk_name}.wet.blob', f'{store_dir}/{chunk_name}.wet.idx.npy'
+
+    @staticmethod
+    def exists(store_dir: str, chunk_name: str) -> bool:
+        return all(os.path.exists(path) for path in WETStore.paths(store_dir, chunk_name))
+
+    @staticmethod
+    def build(records, store_dir: str, chunk_name: str, level=6) -> int:
+        """
+        Builds the store of a chunk from an iterable of (record_id, text) pairs, writing the texts as
+        they come (memory only grows with the index). Files are renamed into place once complete.
+
+        Parameters:
+        - records (iterable): Pairs of (WARC_Refers_To, Content).
+        - store_dir (str): Folder where the store files are written.
+        - chunk_name (str): Name of the chunk.
+        - level (int): zlib compression level (default is 6).
+
+        Returns:
+        int: Number of records stored.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        blob_path, index_path = WETStore.paths(store_dir, chunk_name)
+
+        keys, offsets, lengths = [], [], []
+        offset = 0
+        with open(f'{blob_path}.tmp', 'wb') as blob:
+            for record_id, text in records:
+                # The record ID is stored with its text, so a hash collision is detected on read.
+                data = zlib.compress(f'{record_id}\n{text}'.encode('utf-8'), level)
+                blob.write(data)
+
+                keys.append(record_key(record_id))
+                offsets.append(offset)
+                lengths.append(len(data))
+                offset += len(data)
+
+        index = np.empty(len(keys), dtype=INDEX_DTYPE)
+        index['key'] = keys
+        index['offset'] = offsets
+        index['length'] = lengths
+        index.sort(order='key')
+
+        with open(f'{index_path}.tmp', 'wb') as file:
+            np.save(file, index)
+
+        os.replace(f'{blob_path}.tmp', blob_path)
+        os.replace(f'{index_path}.tmp', index_path)
+
+        return len(index)
+
+    def get(self, record_id: str, default_value=None):
+        """
+        Returns the text of a record ID, or default_value if the record is not stored.
+        """
+        key = record_key(record_id)
+        keys = self.index['key']
+        position = int(np.searchsorted(keys, key))
+
+        prefix = f'{record_id}\n'
+        while position < len(keys) and keys[position] == key:
+            entry = self.index[position]
+            offset = int(entry['offset'])
+            data = zlib.decompress(self._blob[offset:offset + int(entry['length'])]).decode('utf-8')
+            if data.startswith(prefix):
+                return data[len(prefix):]
+            position += 1
+
+        return default_value
+
+    def __contains__(self, record_id: str) -> bool:
+        return self.get(record_id) is not None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def close(self):
+        if isinstance(self._blob, mmap.mmap): self._blob.close()
+        self._file.close()